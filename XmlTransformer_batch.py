@@ -0,0 +1,169 @@
+import sublime
+import os
+import re
+import glob
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import XmlTransformer_build
+from . import XmlTransformer_stylesheet
+from . import XmlTransformer_worker
+from . import XmlTransformer_catalog
+from . import XmlTransformer_jobs
+from .XmlTransformer_build import settings, is_debug, get_message
+
+def find_xml_files(pattern):
+    """All .xml files under a directory (recursively), or the files matching a glob."""
+    if os.path.isdir(pattern):
+        files = []
+        for root, dirs, names in os.walk(pattern):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            files.extend(os.path.join(root, name) for name in names if name.endswith('.xml'))
+    else:
+        files = [f for f in glob.glob(pattern) if os.path.isfile(f)]
+    return sorted(files)
+
+def previous_outputs(files, output_file):
+    """The files that another file in files would write: output_file(source), or a sweep's
+    <output base>.<set><ext> variant of it. Those are results of earlier runs, not inputs."""
+    names = set(files)
+    bases = {}
+    for source in files:
+        output = output_file(source)
+        bases[os.path.splitext(output)[0]] = os.path.splitext(output)[1]
+    excluded = set()
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        if bases.get(stem) == extension:
+            excluded.add(name)
+            continue
+        directory, base = os.path.split(stem)
+        for match in re.finditer(r'\.', base):
+            if bases.get(os.path.join(directory, base[:match.start()])) == extension:
+                excluded.add(name)
+                break
+    return excluded
+
+def is_up_to_date(source, output, dependencies_mtime):
+    try:
+        output_mtime = os.path.getmtime(output)
+    except OSError:
+        return False
+    return output_mtime >= max(os.path.getmtime(source), dependencies_mtime)
+
+def batch_threads():
+    threads = settings.get("batch_threads", 0)
+    return threads if threads and threads > 0 else multiprocessing.cpu_count()
+
+class XmlTransformerBatchCommand(XmlTransformer_build.XmlTransformerBuildCommand):
+    """Apply one stylesheet to every XML file in a directory or glob.
+
+    Reuses the build command's XSL and parameter panels; only the final step differs."""
+
+    def run(self, pattern=None, force=False):
+        if not self.use_toolchain(lambda: self.run(pattern, force)):
+            return
+        view = self.window.active_view()
+        if view and view.file_name():
+            self.working_dir = os.path.dirname(view.file_name())
+        else:
+            self.working_dir = (self.window.folders() or [os.path.expanduser("~")])[0]
+        self.force = force
+        if pattern:
+            self.on_pattern_entered(pattern)
+            return
+        self.window.show_input_panel(
+            get_message("enter_batch_pattern"),
+            os.path.join(self.working_dir, "*.xml"),
+            self.on_pattern_entered,
+            None,
+            None
+        )
+
+    def on_pattern_entered(self, pattern):
+        files = find_xml_files(os.path.expanduser(pattern))
+        if is_debug():
+            print("DEBUG: Batch pattern %s matched %d files" % (pattern, len(files)))
+        if not files:
+            sublime.error_message(get_message("no_batch_files", pattern))
+            return
+        self.batch_files = files
+        self.xml_path = files[0]
+        self.show_combined_panel(self.working_dir)
+
+    def run_transformation(self, param_file):
+        xsl_info = XmlTransformer_stylesheet.stylesheet_info(self.xsl_path)
+        if not self.validate_stylesheet(xsl_info):
+            return
+        param_values = {}
+        if param_file:
+            param_values = self.parse_xml_param_file(param_file)
+            if param_values is None:
+                return
+        dependencies = XmlTransformer_stylesheet.stylesheet_files(self.xsl_path) + ([param_file] if param_file else [])
+        dependencies_mtime = max(os.path.getmtime(path) for path in dependencies if os.path.exists(path))
+        # The output names depend on the stylesheet's output method, so earlier results are only known now.
+        excluded = previous_outputs(self.batch_files, self.get_output_file)
+        pending = []
+        skipped = 0
+        for source in self.batch_files:
+            if source in excluded:
+                continue
+            output = self.get_output_file(source)
+            if not self.force and is_up_to_date(source, output, dependencies_mtime):
+                skipped += 1
+            else:
+                pending.append((source, output))
+        suppress_warnings = settings.get("suppress_warnings", True)
+        label = "batch of {0} with {1}".format(len(pending), os.path.basename(self.xsl_path))
+        XmlTransformer_jobs.submit_work(self.window.id(), label, lambda job: self.run_batch(pending, skipped, sorted(excluded), param_values, suppress_warnings, job))
+
+    def run_batch(self, pending, skipped, excluded, param_values, suppress_warnings, job):
+        started = time.time()
+        # Cache remote resources first, so the worker starts with a catalog that already lists them.
+        XmlTransformer_catalog.prepare([source for source, output in pending], xsl=self.xsl_path)
+        worker = XmlTransformer_worker.get_worker(self.java_bin, self.get_classpath())
+        results = []
+        total = len(pending)
+        failed = 0
+
+        with ThreadPoolExecutor(max_workers=batch_threads()) as pool:
+            futures = dict((pool.submit(self.transform_blocking, worker, source, output, param_values, suppress_warnings, job), (source, output)) for source, output in pending)
+            for future in as_completed(futures):
+                source, output = futures[future]
+                try:
+                    ok, error_text = future.result()
+                except Exception as e:
+                    ok, error_text = False, str(e)
+                results.append((source, output, ok, error_text))
+                failed += 0 if ok else 1
+                message = get_message("batch_progress", len(results), total, failed)
+                sublime.set_timeout(lambda message=message: sublime.status_message(message), 0)
+        elapsed = time.time() - started
+        sublime.set_timeout(lambda: self.show_summary(results, skipped, excluded, elapsed), 0)
+
+    def show_summary(self, results, skipped, excluded, elapsed):
+        failures = sorted(r for r in results if not r[2])
+        successes = sorted(r for r in results if r[2])
+        lines = [
+            "XmlTransformer batch: " + self.xsl_path,
+            get_message("batch_summary", len(successes), len(failures), skipped, "%.1f" % elapsed),
+            ""
+        ]
+        if failures:
+            lines.append("Failed:")
+            for source, output, ok, error_text in failures:
+                lines.append("  " + source)
+                lines.extend("    " + line for line in (error_text or "unknown error").splitlines())
+            lines.append("")
+        if successes:
+            lines.append("Succeeded:")
+            lines.extend("  {0} -> {1}".format(source, output) for source, output, ok, error_text in successes)
+            lines.append("")
+        if excluded:
+            lines.append("Not transformed (output of another file in the batch):")
+            lines.extend("  " + path for path in excluded)
+        panel = self.window.create_output_panel("xml_transformer_batch")
+        panel.run_command("append", {"characters": "\n".join(lines)})
+        self.window.run_command("show_panel", {"panel": "output.xml_transformer_batch"})
+        sublime.status_message(lines[1])
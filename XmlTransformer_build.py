@@ -1,11 +1,21 @@
 import sublime
 import sublime_plugin
 import os
-import subprocess
-import platform
 import xml.etree.ElementTree as ET
 import time
 import json
+import subprocess
+from urllib.request import pathname2url
+from . import XmlTransformer_stylesheet
+from . import XmlTransformer_validate
+from . import XmlTransformer_jvm
+from . import XmlTransformer_toolchain
+from . import XmlTransformer_results
+from . import XmlTransformer_index
+from . import XmlTransformer_worker
+from . import XmlTransformer_perf
+from . import XmlTransformer_catalog
+from . import XmlTransformer_jobs
 
 settings = sublime.load_settings("XmlTransformer.sublime-settings")
 
@@ -24,13 +34,25 @@ def get_message(key, *args):
         messages = sublime.load_resource("Packages/XmlTransformer/locale/en.sublime-messages")
         return json.loads(messages)[key].format(*args)
 
-# Global flags for environment readiness
-java_available = True
-jars_available = True
+# Window ID -> running background well-formedness check
+active_checks = {}
+
+def collect_params(element):
+    """name -> value of the <param>s under element, leaving out those inside <set>s."""
+    param_values = {}
+    for child in element:
+        if child.tag == 'set':
+            continue
+        if child.tag == 'param':
+            name = child.get('name')
+            value = child.get('value', '')
+            if name and value:
+                param_values[name] = value
+        else:
+            param_values.update(collect_params(child))
+    return param_values
 
 def plugin_loaded():
-    global java_available
-    global jars_available
     if is_debug():
         print("DEBUG: XmlTransformer_build.py loaded at:", time.time())
     if is_debug():
@@ -38,91 +60,86 @@ def plugin_loaded():
             "last_param_filename": settings.get("last_param_filename", "params.xml"),
             "suppress_warnings": settings.get("suppress_warnings", True)
         })
-    system = sublime.platform()
-    is_windows = system == "windows"
+    # Probing Java spawns a JVM, so never do it on the startup path.
+    XmlTransformer_toolchain.resolve_async(report_toolchain)
+
+def report_toolchain(toolchain):
+    system = toolchain.system
     is_macos = system == "osx"
-    if is_windows:
-        jar_path = os.path.join(os.environ["ProgramFiles"], "Saxon")
-        java_bin = "java"  # Windows typically has java in PATH
-    elif is_macos:
-        jar_path = os.path.expanduser("~/Library/Saxon")
-        possible_java_paths = [
-            "/opt/homebrew/opt/openjdk@11/bin/java",  # Apple Silicon
-            "/usr/local/opt/openjdk@11/bin/java"      # Intel
-        ]
-        java_bin = None
-        for path in possible_java_paths:
-            if os.path.exists(path):
-                java_bin = path
-                break
-        if not java_bin:
-            java_bin = "java"  # Fallback to PATH
-    else:  # Linux
-        jar_path = "/usr/local/lib/saxon"
-        java_bin = "java"
-    try:
-        creation_flags = 0
-        if sublime.platform() == "windows":
-            creation_flags = 0x08000000  # subprocess.CREATE_NO_WINDOW
-        process = subprocess.Popen([java_bin, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creation_flags)
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(process.returncode, [java_bin, "-version"])
-        global java_available
-        java_available = True
-        if is_debug():
-            print("DEBUG: Java found: %s" % stdout.decode('utf-8').split('\n')[0])
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        if is_debug():
-            print("DEBUG: Java not found at:", time.time(), "Error:", str(e))
+    if not toolchain.java_available:
         java_install_cmd = "brew install openjdk@11" if is_macos else "sudo apt install openjdk-11-jre" if system == "linux" else "download from adoptium.net"
         platform_name = "macOS" if is_macos else "Linux" if system == "linux" else "Windows"
         msg = get_message("java_missing", java_install_cmd, platform_name)
         if is_debug():
             print("DEBUG: " + msg)
-        java_available = False
-    required_jars = ["Saxon-HE-12.9.jar", "xmlresolver-6.0.6.jar", "xmlresolver-6.0.6-data.jar"]
-    if not all(os.path.exists(os.path.join(jar_path, jar)) for jar in required_jars):
+    if not toolchain.jars_available:
         if is_debug():
-            print("DEBUG: Missing JARs in", jar_path, "at:", time.time())
+            print("DEBUG: Missing JARs in", toolchain.jar_path, "at:", time.time())
         setup_cmd = "setup_XmlTransformer_macos.sh" if is_macos else "setup_XmlTransformer_ubuntu.sh" if system == "linux" else "setup_XmlTransformer_windows.bat"
-        msg = get_message("jars_missing", jar_path, setup_cmd)
+        msg = get_message("jars_missing", toolchain.jar_path, setup_cmd)
         if is_debug():
             print("DEBUG: " + msg)
-        global jars_available
-        jars_available = False
-    else:
-        jars_available = True
 
 class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
+    force = False
+    watch = False
+    buffer = False
+    run_id = None
+
     def run(self, **kwargs):
         if is_debug():
             print("DEBUG: XmlTransformerBuildCommand run() called at:", time.time())
             print("DEBUG: Current window ID:", self.window.id())
-        if not java_available:
-            sublime.error_message(get_message("java_missing"))
-            return
-        if not jars_available:
-            sublime.error_message(get_message("jars_missing"))
+        if not self.use_toolchain(lambda: self.run(**kwargs)):
             return
+        self.force = kwargs.get("force", False)
+        self.watch = kwargs.get("watch", False)
+        self.buffer = kwargs.get("buffer", False)
         if is_debug():
             print("DEBUG: Before active_view at:", time.time())
         view = self.window.active_view()
         if is_debug():
             print("DEBUG: After active_view at:", time.time())
-        if not view or view.file_name() is None:
+        if not view or (view.file_name() is None and not self.buffer):
             if is_debug():
                 print("DEBUG: No active view or file not saved at:", time.time())
             sublime.error_message(get_message("no_xml_file"))
             return
+        self.buffer_view = view
         self.xml_path = view.file_name()
-        self.working_dir = os.path.dirname(self.xml_path) if os.path.sep in self.xml_path else "."
-        self.default_xsl = os.path.splitext(self.xml_path)[0] + '.xsl'
+        if self.xml_path is None:
+            # Unsaved buffer: browse from the project (or home) and resolve relative URIs there.
+            self.working_dir = (self.window.folders() or [os.path.expanduser("~")])[0]
+        else:
+            self.working_dir = os.path.dirname(self.xml_path) if os.path.sep in self.xml_path else "."
+            self.default_xsl = os.path.splitext(self.xml_path)[0] + '.xsl'
         if is_debug():
             print("DEBUG: XML file path set at:", time.time())
+        if kwargs.get("search"):
+            self.show_project_files_panel("xsl")
+            return
         self.show_combined_panel(self.working_dir)
 
+    def use_toolchain(self, retry):
+        """Adopt the resolved toolchain; returns False (and calls retry once it is ready) if unavailable."""
+        toolchain = XmlTransformer_toolchain.current()
+        if toolchain is None:
+            XmlTransformer_toolchain.resolve_async(lambda toolchain: retry())
+            return False
+        if not toolchain.java_available:
+            sublime.error_message(get_message("java_missing"))
+            return False
+        if not toolchain.jars_available:
+            sublime.error_message(get_message("jars_missing"))
+            return False
+        self.toolchain = toolchain
+        self.java_bin = toolchain.java_bin
+        self.jar_path = toolchain.jar_path
+        self.cp_separator = toolchain.cp_separator
+        return True
+
     def show_combined_panel(self, current_dir):
+        panel_span = XmlTransformer_perf.span("panel.xsl")
         sublime.status_message(get_message("navigate_xsl"))
         if is_debug():
             print("DEBUG: Starting show_combined_panel at:", time.time())
@@ -135,10 +152,14 @@ class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
         if is_debug():
             print("DEBUG: Directory resolved at:", time.time())
         items = ["[Parent Directory]" if self.current_dir != os.path.abspath(os.path.sep) else "[Root Directory]"]
-        dirs = sorted([d + os.path.sep for d in os.listdir(current_dir) if os.path.isdir(os.path.join(current_dir, d)) and not d.startswith('.') and len(d) < 100])
-        xsl_files = sorted([f for f in os.listdir(current_dir) if f.endswith('.xsl') and len(f) < 100])
+        with XmlTransformer_perf.span("dir.scan", dir=self.current_dir):
+            names = XmlTransformer_index.list_dir(current_dir)
+        dirs = [d + os.path.sep for d in names[0] if len(d) < 100]
+        xsl_files = [f for f in names[1] if f.endswith('.xsl') and len(f) < 100]
         if is_debug():
             print("DEBUG: Directory scan completed at:", time.time())
+        if XmlTransformer_index.project_index(self.window):
+            items.append("[Search Project Stylesheets]")
         items.extend(dirs)
         items.extend(xsl_files)
         if not dirs and not xsl_files:
@@ -152,6 +173,7 @@ class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
             items,
             self.on_item_selected
         )
+        panel_span.end(items=len(items))
 
     def on_item_selected(self, index):
         if index == -1:
@@ -160,60 +182,69 @@ class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
             sublime.status_message(get_message("param_choice_cancelled"))
             return
         selected_item = self.items[index]
-        self.system = sublime.platform()
-        self.is_windows = self.system == "windows"
-        self.is_macos = self.system == "osx"
-        if self.is_macos:
-            possible_java_paths = [
-                "/opt/homebrew/opt/openjdk@11/bin/java",  # Apple Silicon
-                "/usr/local/opt/openjdk@11/bin/java"      # Intel
-            ]
-            self.java_bin = None
-            for path in possible_java_paths:
-                if os.path.exists(path):
-                    self.java_bin = path
-                    break
-            if not self.java_bin:
-                self.java_bin = "java"  # Fallback to PATH
-        else:
-            self.java_bin = "java"
-        self.cp_separator = ";" if self.is_windows else ":"
-        self.jar_path = os.path.join(os.environ["ProgramFiles"], "Saxon") if self.is_windows else os.path.expanduser("~/Library/Saxon") if self.is_macos else "/usr/local/lib/saxon"
         if selected_item == "[Parent Directory]" and self.current_dir != os.path.abspath(os.path.sep):
             parent_dir = os.path.dirname(self.current_dir)
             self.show_combined_panel(parent_dir)
         elif selected_item == "[Root Directory]":
             self.show_combined_panel(self.current_dir)
+        elif selected_item == "[Search Project Stylesheets]":
+            self.show_project_files_panel("xsl")
         elif selected_item.endswith(os.path.sep):
             sub_dir = os.path.join(self.current_dir, selected_item[:-1])
             self.show_combined_panel(sub_dir)
         else:
-            self.xsl_path = os.path.join(self.current_dir, selected_item)
+            self.on_xsl_selected(os.path.join(self.current_dir, selected_item))
+
+    def on_xsl_selected(self, xsl_path):
+        self.xsl_path = xsl_path
+        if is_debug():
+            print("DEBUG: XSL path selected:", self.xsl_path)
+        if not os.path.exists(self.xsl_path):
             if is_debug():
-                print("DEBUG: XSL path selected:", self.xsl_path)
-            if not os.path.exists(self.xsl_path):
-                if is_debug():
-                    print("DEBUG: Invalid XSL path:", self.xsl_path)
-                sublime.error_message(get_message("invalid_xsl_path", self.xsl_path))
+                print("DEBUG: Invalid XSL path:", self.xsl_path)
+            sublime.error_message(get_message("invalid_xsl_path", self.xsl_path))
+            return
+        with XmlTransformer_perf.span("xsl.parse"):
+            xsl_info = XmlTransformer_stylesheet.stylesheet_info(self.xsl_path)
+        if xsl_info.well_formed:
+            self.params = xsl_info.param_names
+            if is_debug():
+                print("DEBUG: Detected parameters:", xsl_info.params)
+        else:
+            if is_debug():
+                print("DEBUG: Failed to parse XSL for params:", xsl_info.error)
+            self.params = []
+        if self.params:
+            self.window.show_quick_panel(
+                ["Run without parameters", "Enter parameters manually", "Select variables XML file"],
+                self.on_param_choice
+            )
+        else:
+            self.run_transformation(None)
+
+    def show_project_files_panel(self, kind):
+        """One fuzzy quick panel over every .xsl (kind "xsl") or .xml (kind "xml") file in the project."""
+        index = XmlTransformer_index.project_index(self.window)
+        if index is None:
+            sublime.error_message(get_message("no_project_folders"))
+            return
+        if index.built is None:
+            sublime.status_message(get_message("indexing_project"))
+
+        def show(index):
+            paths = index.xsl_files if kind == "xsl" else index.xml_files
+            if not paths:
+                sublime.error_message(get_message("no_project_files", "." + kind))
                 return
-            try:
-                tree = ET.parse(self.xsl_path)
-                root = tree.getroot()
-                ns = {'xsl': 'http://www.w3.org/1999/XSL/Transform'}
-                self.params = [elem.attrib['name'] for elem in root.findall('xsl:param', ns)]
-                if is_debug():
-                    print("DEBUG: Detected parameters:", self.params)
-            except Exception as e:
-                if is_debug():
-                    print("DEBUG: Failed to parse XSL for params:", str(e))
-                self.params = []
-            if self.params:
-                self.window.show_quick_panel(
-                    ["Run without parameters", "Enter parameters manually", "Select variables XML file"],
-                    self.on_param_choice
-                )
-            else:
-                self.run_transformation(None)
+            on_done = self.on_xsl_selected if kind == "xsl" else self.on_param_file_chosen
+
+            def on_selected(selected):
+                if selected == -1:
+                    sublime.status_message(get_message("param_choice_cancelled" if kind == "xsl" else "param_file_cancelled"))
+                    return
+                on_done(paths[selected])
+            self.window.show_quick_panel([index.relative(path) for path in paths], on_selected)
+        index.refresh(show)
 
     def on_param_choice(self, index):
         if index == -1:
@@ -285,13 +316,18 @@ class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
                 print("DEBUG: Invalid directory:", current_dir)
             sublime.error_message(get_message("invalid_param_dir", current_dir))
             return
+        panel_span = XmlTransformer_perf.span("panel.params")
         sublime.status_message(get_message("select_param_file"))
         self.current_dir = os.path.realpath(current_dir)
         if is_debug():
             print("DEBUG: Showing param file panel for:", self.current_dir)
         items = ["[Parent Directory]" if self.current_dir != os.path.abspath(os.path.sep) else "[Root Directory]"]
-        dirs = sorted([d + os.path.sep for d in os.listdir(current_dir) if os.path.isdir(os.path.join(current_dir, d)) and not d.startswith('.')])
-        param_files = sorted([f for f in os.listdir(current_dir) if f.endswith('.xml')])
+        with XmlTransformer_perf.span("dir.scan", dir=self.current_dir):
+            names = XmlTransformer_index.list_dir(current_dir)
+        dirs = [d + os.path.sep for d in names[0]]
+        param_files = [f for f in names[1] if f.endswith('.xml')]
+        if XmlTransformer_index.project_index(self.window):
+            items.append("[Search Project Parameter Files]")
         items.extend(dirs)
         items.extend(param_files)
         if not dirs and not param_files:
@@ -305,6 +341,7 @@ class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
             items,
             self.on_param_file_selected
         )
+        panel_span.end(items=len(items))
 
     def on_param_file_selected(self, index):
         if is_debug():
@@ -320,43 +357,42 @@ class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
             self.show_param_file_panel(parent_dir)
         elif selected_item == "[Root Directory]":
             self.show_param_file_panel(self.current_dir)
+        elif selected_item == "[Search Project Parameter Files]":
+            self.show_project_files_panel("xml")
         elif selected_item.endswith(os.path.sep):
             sub_dir = os.path.join(self.current_dir, selected_item[:-1])
             self.show_param_file_panel(sub_dir)
         else:
-            param_file = os.path.join(self.current_dir, selected_item)
+            self.on_param_file_chosen(os.path.join(self.current_dir, selected_item))
+
+    def on_param_file_chosen(self, param_file):
+        selected_item = os.path.basename(param_file)
+        if is_debug():
+            print("DEBUG: Param file selected:", param_file)
+        if not os.path.exists(param_file):
             if is_debug():
-                print("DEBUG: Param file selected:", param_file)
-            if not os.path.exists(param_file):
-                if is_debug():
-                    print("DEBUG: Invalid param file:", param_file)
-                sublime.error_message(get_message("invalid_param_file", param_file))
-                return
-            param_values = self.parse_xml_param_file(param_file)
-            if param_values is None:
-                return
-            missing_params = [p for p in self.params if p not in param_values]
-            if missing_params:
-                warning = get_message("missing_params_warning", selected_item, ", ".join(missing_params))
-                if is_debug():
-                    print("DEBUG:", warning)
-                sublime.status_message(warning)
-            settings.set("last_param_filename", selected_item)
-            sublime.save_settings("XmlTransformer.sublime-settings")
+                print("DEBUG: Invalid param file:", param_file)
+            sublime.error_message(get_message("invalid_param_file", param_file))
+            return
+        param_values = self.parse_xml_param_file(param_file)
+        if param_values is None:
+            return
+        missing_params = [p for p in self.params if p not in param_values]
+        if missing_params:
+            warning = get_message("missing_params_warning", selected_item, ", ".join(missing_params))
             if is_debug():
-                print("DEBUG: Exiting on_param_file_selected")
-            self.run_transformation(param_file)
+                print("DEBUG:", warning)
+            sublime.status_message(warning)
+        settings.set("last_param_filename", selected_item)
+        sublime.save_settings("XmlTransformer.sublime-settings")
+        if is_debug():
+            print("DEBUG: Exiting on_param_file_selected")
+        self.run_transformation(param_file)
 
     def parse_xml_param_file(self, param_file):
         try:
-            param_values = {}
             tree = ET.parse(param_file)
-            root = tree.getroot()
-            for param in root.findall('.//param'):
-                name = param.get('name')
-                value = param.get('value', '')
-                if name and value:
-                    param_values[name] = value
+            param_values = collect_params(tree.getroot())
             if is_debug():
                 print("DEBUG: Parsed parameters:", param_values)
             return param_values
@@ -366,92 +402,263 @@ class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
             sublime.error_message(get_message("param_parse_failed", param_file, str(e)))
             return None
 
-    def validate_xml_file(self, file_path):
+    def parse_param_sets(self, param_file):
+        """The named <set>s of a param file as (name, values) pairs, each on top of the shared params."""
         try:
-            ET.parse(file_path)
-            if is_debug():
-                print("DEBUG: Validated %s as well-formed XML/XSL" % file_path)
-            return True
-        except ET.ParseError as e:
+            root = ET.parse(param_file).getroot()
+            shared = collect_params(root)
+            param_sets = []
+            for index, element in enumerate(root.iter('set')):
+                name = element.get('name') or "set{0}".format(index + 1)
+                if any(name == existing for existing, values in param_sets):
+                    raise ValueError("duplicate parameter set name '{0}'".format(name))
+                param_values = dict(shared)
+                param_values.update(collect_params(element))
+                param_sets.append((name, param_values))
             if is_debug():
-                print("DEBUG: Invalid XML/XSL in %s: %s" % (file_path, str(e)))
-            sublime.error_message(get_message("invalid_xml_xsl", file_path, str(e)))
-            return False
+                print("DEBUG: Parsed parameter sets:", param_sets)
+            return param_sets
         except Exception as e:
             if is_debug():
-                print("DEBUG: Unexpected error validating %s: %s" % (file_path, str(e)))
-            sublime.error_message(get_message("validation_error", file_path, str(e)))
-            return False
+                print("DEBUG: Failed to parse param file:", str(e))
+            sublime.error_message(get_message("param_parse_failed", param_file, str(e)))
+            return None
 
-    def get_xsl_output_method(self, xsl_path):
-        try:
-            tree = ET.parse(xsl_path)
-            root = tree.getroot()
-            ns = {'xsl': 'http://www.w3.org/1999/XSL/Transform'}
-            output_elem = root.find('xsl:output', ns)
-            if output_elem is not None and 'method' in output_elem.attrib:
-                method = output_elem.attrib['method'].lower()
-                if is_debug():
-                    print("DEBUG: Parsed <xsl:output method> from XSLT:", method)
-                if method in ['xml', 'html', 'text']:
-                    return method
-                else:
-                    if is_debug():
-                        print("DEBUG: Invalid <xsl:output method> found, defaulting to xml")
-            else:
+    def validate_xml_file(self, file_path, on_valid, on_invalid=None):
+        """Call on_valid once file_path is known to be well-formed; otherwise report why and call on_invalid."""
+        max_size_mb = settings.get("validate_source_max_size_mb", 0)
+        size = 0
+        if settings.get("validate_source", True):
+            try:
+                size = os.path.getsize(file_path)
+            except OSError as e:
+                # Deleted or renamed since it was picked, e.g. by a watch or a stale view.
+                sublime.error_message(get_message("validation_error", file_path, str(e)))
+                if on_invalid:
+                    on_invalid()
+                return
+        if not settings.get("validate_source", True) or (max_size_mb and size > max_size_mb * 1024 * 1024):
+            if is_debug():
+                print("DEBUG: Skipping well-formedness check of %s, Saxon will report errors" % file_path)
+            on_valid()
+            return
+        window_id = self.window.id()
+        previous = active_checks.pop(window_id, None)
+        if previous:
+            previous.cancel()
+        check = None
+        validate_span = XmlTransformer_perf.span("validate.source", size=size)
+
+        def on_progress(percent):
+            sublime.set_timeout(lambda: sublime.status_message(get_message("validating_source", os.path.basename(file_path), percent)), 0)
+
+        def on_done(result):
+            sublime.set_timeout(lambda: finished(result), 0)
+
+        def finished(result):
+            # check stays None on a cache hit, and nothing was registered for it.
+            if check is not None and active_checks.get(window_id) is check:
+                del active_checks[window_id]
+            validate_span.end(well_formed=result.well_formed, cancelled=result.cancelled)
+            if not result.well_formed and on_invalid:
+                on_invalid()
+            if result.cancelled:
+                sublime.status_message(get_message("validation_cancelled"))
+            elif result.well_formed:
                 if is_debug():
-                    print("DEBUG: No <xsl:output> element found, checking content")
-            if root.find('.//html', ns) is not None or root.find('.//xsl:element[@name="html"]', ns) is not None:
+                    print("DEBUG: Validated %s as well-formed XML/XSL" % file_path)
+                on_valid()
+            elif result.io_error:
                 if is_debug():
-                    print("DEBUG: Detected HTML content in XSLT, using html")
-                return 'html'
-            text_templates = root.findall('.//xsl:value-of', ns) + root.findall('.//xsl:text', ns)
-            if text_templates and not root.findall('.//*', ns):
+                    print("DEBUG: Unexpected error validating %s: %s" % (file_path, result.error))
+                sublime.error_message(get_message("validation_error", file_path, result.error))
+            else:
                 if is_debug():
-                    print("DEBUG: Detected text-like content in XSLT, using text")
-                return 'text'
-            if is_debug():
-                print("DEBUG: Defaulting to xml")
-            return 'xml'
-        except Exception as e:
+                    print("DEBUG: Invalid XML/XSL in %s: %s" % (file_path, result.error))
+                sublime.error_message(get_message("invalid_xml_xsl", file_path, result.error))
+
+        check = XmlTransformer_validate.check_source(file_path, on_done, on_progress)
+        if check:
+            active_checks[window_id] = check
+
+    def validate_stylesheet(self, xsl_info):
+        if xsl_info.well_formed:
             if is_debug():
-                print("DEBUG: Failed to parse XSLT for output method:", str(e))
-            return 'xml'
+                print("DEBUG: Validated %s as well-formed XML/XSL" % xsl_info.path)
+            return True
+        if is_debug():
+            print("DEBUG: Invalid XML/XSL in %s: %s" % (xsl_info.path, xsl_info.error))
+        if xsl_info.io_error:
+            sublime.error_message(get_message("validation_error", xsl_info.path, xsl_info.error))
+        else:
+            sublime.error_message(get_message("invalid_xml_xsl", xsl_info.path, xsl_info.error))
+        return False
+
+    def get_xsl_output_method(self, xsl_path):
+        xsl_info = XmlTransformer_stylesheet.stylesheet_info(xsl_path)
+        method = xsl_info.resolved_output_method()
+        if is_debug():
+            print("DEBUG: <xsl:output method> %s, using %s" % (xsl_info.output_method, method))
+        return method
 
     def run_transformation(self, param_file):
-        if not self.validate_xml_file(self.xml_path) or not self.validate_xml_file(self.xsl_path):
+        xsl_info = XmlTransformer_stylesheet.stylesheet_info(self.xsl_path)
+        if not self.validate_stylesheet(xsl_info):
+            return
+        if self.buffer:
+            self.start_buffer_transformation(param_file)
+            return
+        if self.watch:
+            self.window.run_command("xml_transformer_watch", {"xml": self.xml_path, "xsl": self.xsl_path, "param_file": param_file})
             return
+        self.validate_xml_file(self.xml_path, lambda: self.start_transformation(param_file))
+
+    def start_transformation(self, param_file):
+        build_span = XmlTransformer_perf.span("command.build")
         suppress_warnings = settings.get("suppress_warnings", True)
         if is_debug():
             print("DEBUG: suppress_warnings setting:", suppress_warnings)
-        output_method = self.get_xsl_output_method(self.xsl_path)
-        extension = '.xml' if output_method == 'xml' else '.html' if output_method == 'html' else '.txt'
-        output_file = os.path.splitext(self.xml_path)[0] + "-output" + extension
-        cmd = [
-            self.java_bin, "-cp", os.path.normpath(os.path.join(self.jar_path, "Saxon-HE-12.9.jar")) + self.cp_separator +
-                           os.path.normpath(os.path.join(self.jar_path, "xmlresolver-6.0.6.jar")) + self.cp_separator +
-                           os.path.normpath(os.path.join(self.jar_path, "xmlresolver-6.0.6-data.jar")),
-            "net.sf.saxon.Transform",
-            "-s:" + os.path.normpath(self.xml_path),
-            "-xsl:" + os.path.normpath(self.xsl_path),
-            "-o:" + os.path.normpath(output_file)
-        ]
-        if suppress_warnings:
-            cmd.append("-warnings:silent")
+        output_file = self.get_output_file(self.xml_path)
+        classpath = self.get_classpath()
+        param_values = {}
         if param_file:
             param_values = self.parse_xml_param_file(param_file)
             if param_values is None:
                 return
-            for name, value in param_values.items():
-                cmd.append("{0}={1}".format(name, value.replace(" ", "\\ ")))
+        cmd = self.build_saxon_cmd(self.xml_path, output_file, param_values, suppress_warnings)
         if is_debug():
             print("DEBUG: Command:", cmd)
-        self.window.run_command("xml_transformer_exec", {
+        exec_args = {
             "cmd": cmd,
             "file_regex": "^(.+?):([0-9]+):?([0-9]*):?(.*)$",
             "working_dir": self.working_dir,
-            "output_file": output_file
-        })
+            "output_file": output_file,
+            "params": param_values
+        }
+        if settings.get("use_worker", True):
+            exec_args["transform"] = {
+                "java_bin": self.java_bin,
+                "classpath": classpath,
+                "source": os.path.normpath(self.xml_path),
+                "xsl": os.path.normpath(self.xsl_path),
+                "params": param_values,
+                "suppress_warnings": suppress_warnings
+            }
+        if XmlTransformer_results.is_enabled():
+            exec_args["result_cache"] = {
+                "source": self.xml_path,
+                "xsl": self.xsl_path,
+                "params": param_values,
+                "saxon_version": self.toolchain.saxon_version,
+                "suppress_warnings": suppress_warnings,
+                "force": self.force
+            }
+        if self.run_id:
+            exec_args["run_id"] = self.run_id
+        build_span.end()
+        self.window.run_command("xml_transformer_exec", exec_args)
+
+    def start_buffer_transformation(self, param_file):
+        """Send the live buffer to the worker (or to Saxon on stdin) and stream the result into a scratch view."""
+        suppress_warnings = settings.get("suppress_warnings", True)
+        param_values = {}
+        if param_file:
+            param_values = self.parse_xml_param_file(param_file)
+            if param_values is None:
+                return
+        view = self.buffer_view
+        text = view.substr(sublime.Region(0, view.size()))
+        base_path = self.xml_path or os.path.join(self.working_dir, "untitled.xml")
+        title = "{0} - {1}".format(os.path.basename(self.xml_path or view.name() or "untitled"), os.path.basename(self.xsl_path))
+        exec_args = {
+            "cmd": self.build_saxon_cmd("-", None, param_values, suppress_warnings, input_size=len(text)),
+            "working_dir": self.working_dir,
+            "buffer": {
+                "text": text,
+                "base_uri": "file:" + pathname2url(os.path.abspath(base_path)),
+                "xsl": self.xsl_path,
+                "title": title,
+                "output_method": self.get_xsl_output_method(self.xsl_path)
+            }
+        }
+        if settings.get("use_worker", True):
+            exec_args["transform"] = {
+                "java_bin": self.java_bin,
+                "classpath": self.get_classpath(),
+                "xsl": os.path.normpath(self.xsl_path),
+                "params": param_values,
+                "suppress_warnings": suppress_warnings
+            }
+        self.window.run_command("xml_transformer_exec", exec_args)
+
+    def get_output_file(self, xml_path):
+        output_method = self.get_xsl_output_method(self.xsl_path)
+        extension = '.xml' if output_method == 'xml' else '.html' if output_method == 'html' else '.txt'
+        return os.path.splitext(xml_path)[0] + "-output" + extension
+
+    def get_classpath(self):
+        return list(self.toolchain.classpath)
+
+    def build_saxon_cmd(self, xml_path, output_file, param_values, suppress_warnings, input_size=None, xsl_path=None):
+        """A one-shot Saxon command. xml_path "-" reads the source from stdin; without output_file the result goes to stdout.
+        xsl_path defaults to the command's stylesheet."""
+        classpath = self.get_classpath()
+        if input_size is None:
+            try:
+                input_size = os.path.getsize(xml_path)
+            except OSError:
+                input_size = 0
+        cmd = [self.java_bin] + XmlTransformer_jvm.launch_options(self.java_bin, classpath, input_size) + [
+            "-cp", self.cp_separator.join(classpath),
+            "net.sf.saxon.Transform",
+            "-s:" + os.path.normpath(xml_path),
+            "-xsl:" + os.path.normpath(xsl_path or self.xsl_path)
+        ] + XmlTransformer_catalog.saxon_options()
+        if output_file:
+            cmd.append("-o:" + os.path.normpath(output_file))
+        if suppress_warnings:
+            cmd.append("-warnings:silent")
+        for name, value in param_values.items():
+            cmd.append("{0}={1}".format(name, value.replace(" ", "\\ ")))
+        return cmd
+
+    def transform_blocking(self, worker, source, output, param_values, suppress_warnings, job=None, base_uri=None, base_output_uri=None,
+                           xsl_path=None):
+        """Transform source to output on the calling (background) thread; returns (ok, error_text).
+
+        Uses worker when given, falling back to a one-shot Saxon run. Callers fill the resolver cache
+        once for all their sources before the first call. With job (an XmlTransformer_jobs.Job) the
+        run is attached to it, and nothing starts once it is cancelled. base_uri and base_output_uri
+        (worker only; the Saxon command line has no equivalent) make relative URIs resolve as if source
+        and output were elsewhere. xsl_path defaults to the command's stylesheet."""
+        xsl_path = xsl_path or self.xsl_path
+        if job is not None and job.cancelled:
+            return False, "Cancelled"
+        if worker is not None:
+            try:
+                worker_job = worker.transform(source, xsl_path, output, param_values, quiet=suppress_warnings,
+                                              base_uri=base_uri, base_output_uri=base_output_uri)
+                if job is not None:
+                    XmlTransformer_jobs.attach(job.id, worker_job=worker_job)
+                worker_job.finished.wait()
+                return worker_job.returncode == 0, worker_job.error_text()
+            except XmlTransformer_worker.WorkerError as e:
+                if is_debug():
+                    print("DEBUG: Falling back to one-shot Saxon for %s: %s" % (source, e))
+        process = subprocess.Popen(
+            self.build_saxon_cmd(source, output, param_values, suppress_warnings, xsl_path=xsl_path),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=os.path.dirname(source),
+            creationflags=XmlTransformer_worker.creation_flags(),
+            start_new_session=True  # its own process group, so a cancel reaches anything Java starts
+        )
+        if job is not None:
+            XmlTransformer_jobs.attach(job.id, process=process)
+        stdout, stderr = process.communicate()
+        if job is not None and job.cancelled:
+            return False, "Cancelled"
+        return process.returncode == 0, stderr.decode("utf-8", "replace").strip()
 
     def pretty_print_xml(self, elem, level=0):
         indent = "    "
@@ -467,4 +674,13 @@ class XmlTransformerBuildCommand(sublime_plugin.WindowCommand):
                 elem.tail = i
         else:
             if level and (not elem.tail or not elem.tail.strip()):
-                elem.tail = i
\ No newline at end of file
+                elem.tail = i
+
+class XmlTransformerCancelValidationCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        check = active_checks.pop(self.window.id(), None)
+        if check:
+            check.cancel()
+
+    def is_enabled(self):
+        return self.window.id() in active_checks
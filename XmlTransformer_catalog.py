@@ -0,0 +1,294 @@
+import sublime
+import sublime_plugin
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+from urllib.parse import urljoin, urlsplit
+from urllib.request import urlopen, pathname2url
+from xml.sax.saxutils import quoteattr
+from . import XmlTransformer_stylesheet
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+CATALOG_NS = "urn:oasis:names:tc:entity:xmlns:xml:catalog"
+HEAD_BYTES = 64 * 1024
+SYSTEM_ID = re.compile(r'\bSYSTEM\s+["\']([^"\']+)["\']')
+PUBLIC_ID = re.compile(r'\bPUBLIC\s+["\']([^"\']*)["\']\s+["\']([^"\']+)["\']')
+STYLESHEET_HREF = re.compile(r'<[\w.-]+:(?:import|include|import-schema)\b[^>]*?\b(?:href|schema-location)\s*=\s*["\']([^"\']+)["\']')
+FUNCTION_URI = re.compile(r'\b(?:document|doc|unparsed-text|unparsed-text-lines|json-doc)\(\s*["\'](https?://[^"\']+)["\']')
+UNSAFE = re.compile(r'[<>:"|?*\\]')
+
+# Guards the index, _scanned, _failed and _queued, which runs on several threads share
+_lock = threading.Lock()
+# Path -> (mtime, size, references) of files already scanned
+_scanned = {}
+# URL -> time of the last failed fetch
+_failed = {}
+# URLs a background fetch has been started for
+_queued = set()
+_version = [0]
+_index = [None]
+
+def is_debug():
+    return settings.get("debug", False)
+
+def is_enabled():
+    return settings.get("resolver_cache", True)
+
+def cache_dir():
+    return os.path.join(sublime.cache_path(), "XmlTransformer", "resolver")
+
+def catalog_file():
+    """The managed catalog, created empty on first use so Saxon can always be pointed at it."""
+    path = os.path.join(cache_dir(), "catalog.xml")
+    if not os.path.exists(path):
+        write_catalog({})
+    return path
+
+def catalog_uri():
+    return "file:" + pathname2url(os.path.abspath(catalog_file()))
+
+def version():
+    """Bumped whenever this session changes the catalog, so a worker that loaded an older one can be restarted."""
+    return _version[0]
+
+def load_index():
+    """URL -> {path, public_id, size, fetched} of every cached resource, read from disk once per session."""
+    if _index[0] is None:
+        try:
+            with open(os.path.join(cache_dir(), "index.json"), encoding="utf-8") as f:
+                _index[0] = json.load(f)
+        except (OSError, ValueError):
+            _index[0] = {}
+    return _index[0]
+
+def write_catalog(index):
+    os.makedirs(cache_dir(), exist_ok=True)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<catalog xmlns="{0}">'.format(CATALOG_NS)]
+    for url in sorted(index):
+        entry = index[url]
+        uri = quoteattr(entry["path"])
+        lines.append('    <system systemId={0} uri={1}/>'.format(quoteattr(url), uri))
+        lines.append('    <uri name={0} uri={1}/>'.format(quoteattr(url), uri))
+        if entry.get("public_id"):
+            lines.append('    <public publicId={0} uri={1}/>'.format(quoteattr(entry["public_id"]), uri))
+    lines.append('</catalog>')
+    temp = os.path.join(cache_dir(), "catalog.xml.tmp")
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp, os.path.join(cache_dir(), "catalog.xml"))
+    with open(os.path.join(cache_dir(), "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    _index[0] = index
+    _version[0] += 1
+
+def local_path(url):
+    """files/<scheme>/<host>/<path>, mirroring the URL so relative references between cached files still work."""
+    parts = urlsplit(url)
+    segments = [UNSAFE.sub("_", s) for s in parts.path.split("/") if s and s not in (".", "..")]
+    if not segments or parts.path.endswith("/"):
+        segments.append("index")
+    if parts.query:
+        segments[-1] += "_" + hashlib.sha1(parts.query.encode("utf-8")).hexdigest()[:8]
+    return "/".join(["files", parts.scheme, UNSAFE.sub("_", parts.netloc)] + segments)
+
+def scan_text(text, base_url=None, stylesheet=False):
+    """(url, public id) pairs of the external resources text refers to.
+
+    With base_url (a fetched resource) relative references are resolved against it; otherwise only absolute http(s) URLs count."""
+    found = []
+    for public_id, system_id in PUBLIC_ID.findall(text):
+        found.append((system_id, public_id))
+    found.extend((system_id, None) for system_id in SYSTEM_ID.findall(text))
+    if stylesheet:
+        found.extend((href, None) for href in STYLESHEET_HREF.findall(text))
+        found.extend((uri, None) for uri in FUNCTION_URI.findall(text))
+    references = []
+    for url, public_id in found:
+        if base_url:
+            url = urljoin(base_url, url)
+        if url.startswith(("http://", "https://")):
+            references.append((url.split("#", 1)[0], public_id))
+    return references
+
+def scan_file(path, stylesheet):
+    """References in a stylesheet, or in the prolog of a source document, memoized per (mtime, size)."""
+    try:
+        stat = os.stat(path)
+        with _lock:
+            cached = _scanned.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+        with open(path, "rb") as f:
+            data = f.read() if stylesheet else f.read(HEAD_BYTES)
+    except OSError:
+        return []
+    references = scan_text(data.decode("utf-8", "replace"), stylesheet=stylesheet)
+    with _lock:
+        _scanned[path] = (stat.st_mtime, stat.st_size, references)
+    return references
+
+def fetch(url):
+    with urlopen(url, timeout=settings.get("resolver_timeout", 10)) as response:
+        return response.read()
+
+def prepare(sources=(), xsl=None, text=None, wait=False):
+    """Fetch whatever the sources, the stylesheet's import graph or text refer to that is not cached yet.
+
+    Called before every run; it costs a few stat calls and never waits on the network. Missing resources
+    are fetched on a background thread and the run goes ahead with what is cached, so a later run picks
+    them up. With wait (the pre-warm command) they are fetched before returning, and the number fetched
+    is returned. Never raises: a run goes ahead without the cache when it is unusable."""
+    if not is_enabled():
+        return 0
+    try:
+        references = []
+        for source in sources:
+            references.extend(scan_file(source, False))
+        if xsl:
+            for path in XmlTransformer_stylesheet.stylesheet_files(xsl):
+                references.extend(scan_file(path, True))
+        if text:
+            references.extend(scan_text(text[:HEAD_BYTES]))
+        if not references:
+            return 0
+        if wait:
+            return fetch_missing(references)
+        fetch_in_background(references)
+        return 0
+    except OSError as e:
+        print("XmlTransformer: Resolver cache unavailable:", str(e))
+        return 0
+
+def is_due(url, retry_after):
+    """False while a failed fetch of url is too recent to try again. Call with _lock held."""
+    return time.time() - _failed.get(url, 0) >= retry_after
+
+def fetch_in_background(references):
+    """Start one thread fetching the references that are neither cached, queued nor recently failed."""
+    retry_after = settings.get("resolver_retry_after", 300)
+    with _lock:
+        index = load_index()
+        missing = [(url, public_id) for url, public_id in references
+                   if url not in index and url not in _queued and is_due(url, retry_after)]
+        _queued.update(url for url, public_id in missing)
+    if not missing:
+        return
+
+    def run():
+        try:
+            fetch_missing(missing)
+        except OSError as e:
+            print("XmlTransformer: Resolver cache unavailable:", str(e))
+        finally:
+            with _lock:
+                _queued.difference_update(url for url, public_id in missing)
+    threading.Thread(target=run, daemon=True).start()
+
+def fetch_missing(references):
+    """Fetch the references missing from the index without holding the lock, so runs whose resources
+    are all cached never wait on another run's downloads; the lock only guards merging the results."""
+    retry_after = settings.get("resolver_retry_after", 300)
+    with _lock:
+        seen = set(load_index())
+    pending = [(url, public_id) for url, public_id in references if url not in seen]
+    fetched = {}
+    while pending:
+        url, public_id = pending.pop(0)
+        if url in seen:
+            continue
+        with _lock:
+            due = is_due(url, retry_after)
+        if not due:
+            continue
+        seen.add(url)
+        try:
+            data = fetch(url)
+        except Exception as e:
+            with _lock:
+                _failed[url] = time.time()
+            print("XmlTransformer: Could not fetch {0}: {1}".format(url, e))
+            continue
+        path = local_path(url)
+        target = os.path.join(cache_dir(), *path.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Another run may be fetching the same resource; each writes its own copy and renames it into place.
+        temp = "{0}.{1}.tmp".format(target, threading.get_ident())
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, target)
+        fetched[url] = {"path": path, "public_id": public_id, "size": len(data), "fetched": time.time()}
+        if is_debug():
+            print("DEBUG: Cached %s as %s" % (url, path))
+        # DTDs, entity sets and imported stylesheets can pull in more resources.
+        content = data.decode("utf-8", "replace")
+        pending.extend(scan_text(content, base_url=url, stylesheet="XSL/Transform" in content))
+    if fetched:
+        with _lock:
+            index = dict(load_index())
+            # A purge while downloading removed the files; leave those out.
+            index.update((url, entry) for url, entry in fetched.items()
+                         if os.path.exists(os.path.join(cache_dir(), *entry["path"].split("/"))))
+            write_catalog(index)
+    return len(fetched)
+
+def purge():
+    with _lock:
+        shutil.rmtree(cache_dir(), ignore_errors=True)
+        _failed.clear()
+        _scanned.clear()
+        _queued.clear()
+        write_catalog({})
+
+def jvm_options():
+    """System properties pointing the xmlresolver in a long-lived JVM at the managed catalog."""
+    if not is_enabled():
+        return []
+    return ["-Dxml.catalog.files=" + catalog_uri()]
+
+def saxon_options():
+    """Saxon command-line options for a one-shot run."""
+    if not is_enabled():
+        return []
+    return ["-catalog:" + catalog_file()]
+
+class XmlTransformerPrewarmResolverCacheCommand(sublime_plugin.WindowCommand):
+    """Cache the external resources of the current file now, rather than on its first transformation."""
+
+    def run(self):
+        path = self.window.active_view().file_name()
+        is_xsl = path.lower().endswith((".xsl", ".xslt"))
+        sublime.status_message("XmlTransformer: Caching external resources of {0}...".format(os.path.basename(path)))
+
+        def prewarm():
+            fetched = prepare([] if is_xsl else [path], xsl=path if is_xsl else None, wait=True)
+            sublime.set_timeout(lambda: sublime.status_message(
+                "XmlTransformer: {0} new resource{1} cached, {2} in the cache".format(fetched, "" if fetched == 1 else "s", len(load_index()))), 0)
+        sublime.set_timeout_async(prewarm, 0)
+
+    def is_enabled(self):
+        view = self.window.active_view()
+        return is_enabled() and bool(view and view.file_name())
+
+class XmlTransformerListResolverCacheCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        index = load_index()
+        lines = ["XmlTransformer resolver cache: {0}".format(catalog_file()), ""]
+        for url in sorted(index):
+            entry = index[url]
+            lines.append("{0}  ({1} bytes, {2})".format(url, entry.get("size", 0), time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.get("fetched", 0)))))
+            lines.append("    " + os.path.join(cache_dir(), *entry["path"].split("/")))
+        if not index:
+            lines.append("Empty. Resources are cached on the first transformation that needs them, or with XmlTransformer: Pre-warm Resolver Cache.")
+        panel = self.window.create_output_panel("xml_transformer_resolver")
+        panel.run_command("append", {"characters": "\n".join(lines)})
+        self.window.run_command("show_panel", {"panel": "output.xml_transformer_resolver"})
+
+class XmlTransformerPurgeResolverCacheCommand(sublime_plugin.ApplicationCommand):
+    def run(self):
+        purge()
+        sublime.status_message("XmlTransformer: Resolver cache purged")
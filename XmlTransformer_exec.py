@@ -3,70 +3,391 @@ import sublime_plugin
 import os
 import time
 import re
+import codecs
+import subprocess
+import threading
+from . import XmlTransformer_worker
+from . import XmlTransformer_results
+from . import XmlTransformer_perf
+from . import XmlTransformer_output
+from . import XmlTransformer_jobs
+from . import XmlTransformer_catalog
 
 print("DEBUG: XmlTransformer_exec.py loaded")
 
+OUTPUT_SYNTAXES = {
+    "html": "Packages/HTML/HTML.sublime-syntax",
+    "xml": "Packages/XML/XML.sublime-syntax"
+}
+XML_ENCODING = re.compile(r'^\s*<\?xml[^>]*\bencoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+# run_id -> callback for whoever is waiting on that transformation (see XmlTransformer_watch)
+finish_callbacks = {}
+
+def on_finished(run_id, callback):
+    finish_callbacks[run_id] = callback
+
+def notify_finished(kwargs):
+    XmlTransformer_jobs.finished(kwargs.get("job_id"))
+    callback = finish_callbacks.pop(kwargs.get("run_id"), None)
+    if callback:
+        callback()
+
+class ProcessRunner(object):
+    """Runs a command, streams its output as it arrives and reports the real exit code.
+
+    on_output(text) and on_exit(returncode, output, elapsed) are called from a reader thread.
+    With input_bytes the command reads them on stdin; with separate_stderr, stdout alone is
+    streamed and stderr is collected in stderr_text for on_exit to use."""
+
+    def __init__(self, cmd, working_dir, on_output, on_exit, input_bytes=None, separate_stderr=False):
+        self.cmd = cmd
+        self.working_dir = working_dir
+        self.on_output = on_output
+        self.on_exit = on_exit
+        self.input_bytes = input_bytes
+        self.separate_stderr = separate_stderr
+        self.stderr_text = ""
+        self.process = None
+        self.killed = False
+
+    def start(self):
+        self.started = time.time()
+        self.run_span = XmlTransformer_perf.span("saxon.run")
+        # Only the fork/exec; JVM startup itself is part of saxon.run.
+        spawn_span = XmlTransformer_perf.span("process.spawn")
+        try:
+            self.process = subprocess.Popen(
+                self.cmd,
+                stdin=subprocess.DEVNULL if self.input_bytes is None else subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE if self.separate_stderr else subprocess.STDOUT,
+                cwd=self.working_dir,
+                creationflags=XmlTransformer_worker.creation_flags(),
+                start_new_session=True  # its own process group, so kill() reaches anything Java starts
+            )
+        except OSError as e:
+            spawn_span.end(error=type(e).__name__)
+            self.run_span.end(error=type(e).__name__)
+            raise
+        spawn_span.end()
+        if self.input_bytes is not None:
+            threading.Thread(target=self._write, daemon=True).start()
+        if self.separate_stderr:
+            self.stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+            self.stderr_reader.start()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _write(self):
+        try:
+            self.process.stdin.write(self.input_bytes)
+        except OSError:
+            pass  # the process exited early; its exit code and output tell why
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def _read_stderr(self):
+        self.stderr_text = self.process.stderr.read().decode("utf-8", "replace").replace("\r\n", "\n")
+
+    def _read(self):
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        chunks = []
+        fd = self.process.stdout.fileno()
+        while True:
+            data = os.read(fd, 8192)
+            text = decoder.decode(data, final=not data).replace("\r\n", "\n")
+            if text:
+                chunks.append(text)
+                self.on_output(text)
+            if not data:
+                break
+        returncode = self.process.wait()
+        if self.separate_stderr:
+            self.stderr_reader.join()
+        self.run_span.end(returncode=returncode, killed=self.killed)
+        self.on_exit(returncode, "".join(chunks), time.time() - self.started)
+
+    def kill(self):
+        self.killed = True
+        if self.process is not None:
+            XmlTransformer_worker.kill_tree(self.process)
+
 class XmlTransformerExecCommand(sublime_plugin.WindowCommand):
     def run(self, **kwargs):
         print("DEBUG: XmlTransformerExecCommand run() called")
         cmd = kwargs.get("cmd")
         output_file = kwargs.get("output_file")
         xsl_path = None
+        source = None
         for arg in cmd:
             if arg.startswith("-xsl:"):
                 xsl_path = arg.split(":", 1)[1]
-                break
+            elif arg.startswith("-s:"):
+                source = arg.split(":", 1)[1]
+        if kwargs.get("buffer"):
+            key = None
+            label = kwargs["buffer"]["title"]
+        else:
+            # Not the command line: its JVM options depend on the input size and on whether the CDS archive exists yet.
+            params = kwargs.get("params") or {}
+            key = (os.path.normpath(source or ""), os.path.normpath(xsl_path or ""), tuple(sorted(params.items())))
+            label = XmlTransformer_jobs.label(source, xsl_path)
+        XmlTransformer_jobs.submit(
+            self.window.id(), key, label,
+            lambda job: self.begin(dict(kwargs, job_id=job.id), output_file, xsl_path),
+            lambda: notify_finished(kwargs),
+            run_id=kwargs.get("run_id")
+        )
+
+    def begin(self, kwargs, output_file, xsl_path):
+        """Start the transformation once the scheduler has given it a slot."""
+        if kwargs.get("buffer"):
+            self.run_buffer(kwargs, xsl_path)
+            return
         print("DEBUG: Output file:", output_file)
-        self.output_file = output_file
-        self.xsl_path = xsl_path
-        self.window.run_command("exec", {
-            "cmd": cmd,
-            "file_regex": kwargs.get("file_regex"),
-            "working_dir": kwargs.get("working_dir")
-        })
-        sublime.set_timeout(lambda: self.check_output(output_file, attempts=20), 500)
-
-    def check_output(self, output_file, attempts):
-        output_view = self.window.find_output_panel("exec")
-        finished = False
-        error_text = ""
-        if output_view:
-            full_text = output_view.substr(sublime.Region(0, output_view.size()))
-            lines = full_text.splitlines()
-            content_lines = lines
-            if lines and lines[0].startswith("Running "):
-                content_lines = lines[1:]
-            if content_lines and content_lines[-1].startswith("[Finished "):
-                finished = True
-                content_lines = content_lines[:-1]
-            error_text = '\n'.join(content_lines).strip()
-        has_error = bool(error_text) and ("Exception in thread" in error_text or 
-                                         "Error" in error_text or 
-                                         "Warning" in error_text or 
-                                         "Fatal Error" in error_text)
-        if has_error:
+        sublime.set_timeout_async(lambda: self.guarded(kwargs, lambda: self.start(kwargs, output_file, xsl_path)), 0)
+
+    def guarded(self, kwargs, run):
+        """Call run on the async thread; if it fails, the job still gives up its scheduler slot."""
+        try:
+            run()
+        except Exception as e:
+            notify_finished(kwargs)
+            message = "XmlTransformer: Transformation failed: {0}".format(e)
+            sublime.set_timeout(lambda: sublime.status_message(message), 0)
+            raise
+
+    def run_buffer(self, kwargs, xsl_path):
+        """Transform buffer text and stream the result into a new scratch view; nothing touches the disk."""
+        buffer = kwargs["buffer"]
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name(buffer["title"])
+        syntax = OUTPUT_SYNTAXES.get(buffer.get("output_method"))
+        if syntax:
+            view.set_syntax_file(syntax)
+        started = time.time()
+
+        def on_chunk(text):
+            sublime.set_timeout(lambda: view.run_command("append", {"characters": text, "force": True}), 0)
+
+        def on_finished(returncode, error_text, messages):
+            sublime.set_timeout(lambda: self.on_buffer_done(returncode, error_text, messages, time.time() - started, kwargs, xsl_path), 0)
+
+        sublime.set_timeout_async(lambda: self.guarded(kwargs, lambda: self.transform_buffer(kwargs, buffer, on_chunk, on_finished)), 0)
+
+    def transform_buffer(self, kwargs, buffer, on_chunk, on_finished):
+        XmlTransformer_catalog.prepare(xsl=buffer["xsl"], text=buffer["text"])
+        transform = kwargs.get("transform")
+        if transform:
+            worker = XmlTransformer_worker.get_worker(transform["java_bin"], transform["classpath"])
+            if worker is not None:
+                try:
+                    job = worker.transform_text(
+                        buffer["text"],
+                        buffer["base_uri"],
+                        transform["xsl"],
+                        transform.get("params") or {},
+                        quiet=transform.get("suppress_warnings", True),
+                        on_chunk=on_chunk,
+                        on_done=lambda job: on_finished(job.returncode, job.error_text(), job.messages)
+                    )
+                    XmlTransformer_jobs.attach(kwargs.get("job_id"), worker_job=job)
+                    return
+                except XmlTransformer_worker.WorkerError as e:
+                    print("DEBUG: Saxon worker request failed, running Saxon directly:", str(e))
+        # One-shot Saxon reads the buffer on stdin (-s:-) and writes the result to stdout.
+        text = buffer["text"]
+        match = XML_ENCODING.match(text)
+        try:
+            data = text.encode(match.group(1) if match else "utf-8", "xmlcharrefreplace")
+        except LookupError:
+            data = text.encode("utf-8")
+        def on_exit(returncode, output, elapsed):
+            if runner.killed:
+                on_chunk("\n[Cancelled]")
+                notify_finished(kwargs)
+                return
+            on_finished(returncode, runner.stderr_text.strip(), [])
+        runner = ProcessRunner(kwargs.get("cmd"), kwargs.get("working_dir"), on_chunk, on_exit,
+                               input_bytes=data, separate_stderr=True)
+        runner.kwargs = kwargs
+        try:
+            runner.start()
+        except OSError as e:
+            on_finished(1, "Fatal Error: {0}".format(e), [])
+            return
+        XmlTransformer_jobs.attach(kwargs.get("job_id"), runner=runner)
+
+    def on_buffer_done(self, returncode, error_text, messages, elapsed, kwargs, xsl_path):
+        print("DEBUG: Buffer transformation finished with code %d in %.3fs" % (returncode, elapsed))
+        scheduled = XmlTransformer_jobs.get(kwargs.get("job_id"))
+        if scheduled is not None and scheduled.cancelled:
+            sublime.status_message("XmlTransformer: Cancelled")
+            notify_finished(kwargs)
+            return
+        if messages:
+            output_panel = self.create_output_panel(kwargs)
+            output_panel.run_command("append", {"characters": "\n".join(messages)})
+            self.window.run_command("show_panel", {"panel": "output.xml_transformer"})
+        if returncode != 0:
+            self.handle_result("", xsl_path, error_text, True)
+        else:
+            sublime.status_message("XmlTransformer: Finished in %.1fs" % elapsed)
+        notify_finished(kwargs)
+
+    def start(self, kwargs, output_file, xsl_path):
+        source = next((arg[3:] for arg in kwargs.get("cmd") or [] if arg.startswith("-s:")), None)
+        with XmlTransformer_perf.span("resolver.prefetch"):
+            XmlTransformer_catalog.prepare([source] if source else [], xsl=xsl_path)
+        result_cache = kwargs.get("result_cache")
+        if result_cache:
+            lookup_span = XmlTransformer_perf.span("result_cache.lookup")
+            try:
+                key = XmlTransformer_results.result_key(
+                    result_cache["source"], result_cache["xsl"], result_cache.get("params") or {},
+                    result_cache["saxon_version"], output_file, result_cache.get("suppress_warnings", True))
+                if key is not None and not result_cache.get("force") and XmlTransformer_results.restore(key, output_file):
+                    lookup_span.end(hit=True)
+                    sublime.set_timeout(lambda: self.on_cache_hit(kwargs, output_file, xsl_path), 0)
+                    return
+                lookup_span.end(hit=False, cacheable=key is not None)
+                if key is not None:
+                    kwargs = dict(kwargs, result_key=key)
+            except OSError as e:
+                print("DEBUG: Result cache unavailable:", str(e))
+        transform = kwargs.get("transform")
+        if transform:
+            self.run_in_worker(transform, kwargs, output_file, xsl_path)
+        else:
+            sublime.set_timeout(lambda: self.run_process(kwargs, output_file, xsl_path), 0)
+
+    def on_cache_hit(self, kwargs, output_file, xsl_path):
+        output_panel = self.create_output_panel(kwargs)
+        output_panel.run_command("append", {"characters": "[Restored from result cache]"})
+        sublime.status_message("XmlTransformer: Output restored from result cache")
+        self.handle_result(output_file, xsl_path, "", False)
+        notify_finished(kwargs)
+
+    def store_result(self, kwargs, output_file):
+        key = kwargs.get("result_key")
+        if key:
+            sublime.set_timeout_async(lambda: XmlTransformer_results.store(key, output_file), 0)
+
+    def create_output_panel(self, kwargs):
+        output_panel = self.window.create_output_panel("xml_transformer")
+        output_panel.settings().set("result_file_regex", kwargs.get("file_regex") or "")
+        output_panel.settings().set("result_base_dir", kwargs.get("working_dir") or "")
+        return output_panel
+
+    def run_process(self, kwargs, output_file, xsl_path):
+        output_panel = self.create_output_panel(kwargs)
+        self.window.run_command("show_panel", {"panel": "output.xml_transformer"})
+
+        def on_output(text):
+            sublime.set_timeout(lambda: output_panel.run_command("append", {"characters": text, "force": True, "scroll_to_end": True}), 0)
+
+        def on_exit(returncode, output, elapsed):
+            sublime.set_timeout(lambda: self.on_process_exit(runner, output_panel, returncode, output, elapsed, output_file, xsl_path), 0)
+
+        runner = ProcessRunner(kwargs.get("cmd"), kwargs.get("working_dir"), on_output, on_exit)
+        runner.kwargs = kwargs
+        try:
+            runner.start()
+        except OSError as e:
+            self.on_process_exit(runner, output_panel, 1, "Fatal Error: {0}".format(e), 0.0, output_file, xsl_path)
+            return
+        # After start: a cancel that arrived while it was launching kills the process as it is attached.
+        XmlTransformer_jobs.attach(kwargs.get("job_id"), runner=runner)
+
+    def on_process_exit(self, runner, output_panel, returncode, output, elapsed, output_file, xsl_path):
+        if runner.killed:
+            output_panel.run_command("append", {"characters": "\n[Cancelled]", "force": True, "scroll_to_end": True})
+            notify_finished(runner.kwargs)
+            return
+        print("DEBUG: Saxon exited with code %d in %.3fs" % (returncode, elapsed))
+        finished = "[Finished in %.1fs]" % elapsed if returncode == 0 else "[Finished in %.1fs with exit code %d]" % (elapsed, returncode)
+        output_panel.run_command("append", {"characters": ("\n" if output else "") + finished, "force": True, "scroll_to_end": True})
+        if returncode == 0:
+            self.store_result(runner.kwargs, output_file)
+        if not self.handle_result(output_file, xsl_path, output.strip(), returncode != 0):
+            print("DEBUG: Output file not found:", output_file)
+            sublime.error_message("XmlTransformer transformation failed, check the xml_transformer_errors panel for details.")
+        notify_finished(runner.kwargs)
+
+    def run_in_worker(self, transform, kwargs, output_file, xsl_path):
+        worker = XmlTransformer_worker.get_worker(transform["java_bin"], transform["classpath"])
+        if worker is None:
+            print("DEBUG: Saxon worker unavailable, running Saxon directly")
+            sublime.set_timeout(lambda: self.run_process(kwargs, output_file, xsl_path), 0)
+            return
+        sublime.status_message("XmlTransformer: Transforming with Saxon worker...")
+        started = time.time()
+        worker_span = XmlTransformer_perf.span("worker.run")
+
+        def on_done(job):
+            worker_span.end(returncode=job.returncode, saxon_ms=dict(job.timings))
+            sublime.set_timeout(lambda: self.on_worker_done(job, time.time() - started, kwargs, output_file, xsl_path), 0)
+        try:
+            job = worker.transform(
+                transform["source"],
+                transform["xsl"],
+                output_file,
+                transform.get("params") or {},
+                quiet=transform.get("suppress_warnings", True),
+                on_done=on_done
+            )
+            XmlTransformer_jobs.attach(kwargs.get("job_id"), worker_job=job)
+        except XmlTransformer_worker.WorkerError as e:
+            print("DEBUG: Saxon worker request failed, running Saxon directly:", str(e))
+            sublime.set_timeout(lambda: self.run_process(kwargs, output_file, xsl_path), 0)
+
+    def on_worker_done(self, job, elapsed, kwargs, output_file, xsl_path):
+        print("DEBUG: Saxon worker finished in %.3fs, timings: %s, info: %s" % (elapsed, job.timings, job.info))
+        output_panel = self.create_output_panel(kwargs)
+        scheduled = XmlTransformer_jobs.get(kwargs.get("job_id"))
+        if scheduled is not None and scheduled.cancelled:
+            output_panel.run_command("append", {"characters": "[Cancelled]"})
+            notify_finished(kwargs)
+            return
+        lines = job.messages + ["[Finished in %.2fs%s]" % (elapsed, "" if job.returncode == 0 else " with errors")]
+        output_panel.run_command("append", {"characters": "\n".join(lines)})
+        if job.messages:
+            self.window.run_command("show_panel", {"panel": "output.xml_transformer"})
+        if job.returncode == 0:
+            self.store_result(kwargs, output_file)
+        if not self.handle_result(output_file, xsl_path, job.error_text(), job.returncode != 0):
+            print("DEBUG: Output file not found:", output_file)
+            sublime.error_message("XmlTransformer transformation failed, check the xml_transformer_errors panel for details.")
+        notify_finished(kwargs)
+
+    def handle_result(self, output_file, xsl_path, error_text, failed):
+        """Report errors and open the output. Returns False when there is neither."""
+        with XmlTransformer_perf.span("output.open", failed=failed):
+            return self.report_result(output_file, xsl_path, error_text, failed)
+
+    def report_result(self, output_file, xsl_path, error_text, failed):
+        if failed:
             print("DEBUG: Transformation error:", error_text)
             error_panel = self.window.create_output_panel("xml_transformer_errors")
             error_panel.set_syntax_file("Packages/XML/XML.sublime-syntax")
             error_panel.run_command("append", {"characters": "XmlTransformer Error:\n" + error_text})
             self.window.run_command("show_panel", {"panel": "output.xml_transformer_errors"})
-            if "Error on line" in error_text and self.xsl_path:
+            if "Error on line" in error_text and xsl_path:
                 match = re.search(r"Error on line (\d+) column (\d+)", error_text)
                 if match:
                     line, col = match.groups()
-                    self.window.open_file("{0}:{1}:{2}".format(self.xsl_path, line, col), sublime.ENCODED_POSITION)
+                    self.window.open_file("{0}:{1}:{2}".format(xsl_path, line, col), sublime.ENCODED_POSITION)
                 else:
-                    self.window.open_file("{0}:1:1".format(self.xsl_path), sublime.ENCODED_POSITION)
+                    self.window.open_file("{0}:1:1".format(xsl_path), sublime.ENCODED_POSITION)
             if os.path.exists(output_file):
                 print("DEBUG: Opening output file despite error:", output_file)
-                self.window.open_file(output_file)
-            return
+                XmlTransformer_output.open_output(self.window, output_file, xsl_path)
+            return True
         if os.path.exists(output_file):
             print("DEBUG: Opening output file:", output_file)
-            self.window.open_file(output_file)
-            return
-        if attempts <= 0 or finished:
-            print("DEBUG: Output file not found:", output_file)
-            sublime.error_message("XmlTransformer transformation failed, check the xml_transformer_errors panel for details.")
-            return
-        sublime.set_timeout(lambda: self.check_output(output_file, attempts - 1), 500)
\ No newline at end of file
+            XmlTransformer_output.open_output(self.window, output_file, xsl_path)
+            return True
+        return False
@@ -0,0 +1,159 @@
+import sublime
+import sublime_plugin
+import os
+import time
+import threading
+import collections
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+MAX_CACHED_DIRS = 256
+
+# realpath -> (mtime, dirs, files); a directory's mtime changes whenever an entry is added or removed.
+_listings = collections.OrderedDict()
+# tuple of project folders -> ProjectIndex
+_indexes = {}
+_lock = threading.Lock()
+
+def is_debug():
+    return settings.get("debug", False)
+
+def _scan(path):
+    dirs = []
+    files = []
+    if hasattr(os, "scandir"):
+        # d_type comes with the entry, so no extra stat per file (Python 3.5+, i.e. Sublime Text 4).
+        for entry in os.scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            (dirs if is_dir else files).append(entry.name)
+    else:
+        for name in os.listdir(path):
+            (dirs if os.path.isdir(os.path.join(path, name)) else files).append(name)
+    return sorted(dirs), sorted(files)
+
+def list_dir(path):
+    """(dirs, files) of path from one directory scan, cached until the directory's mtime changes.
+
+    Hidden entries are left out."""
+    path = os.path.realpath(path)
+    mtime = os.stat(path).st_mtime
+    with _lock:
+        cached = _listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            _listings.move_to_end(path)
+            return cached[1], cached[2]
+    dirs, files = _scan(path)
+    dirs = [d for d in dirs if not d.startswith('.')]
+    files = [f for f in files if not f.startswith('.')]
+    with _lock:
+        _listings[path] = (mtime, dirs, files)
+        while len(_listings) > MAX_CACHED_DIRS:
+            _listings.popitem(last=False)
+    return dirs, files
+
+class ProjectIndex(object):
+    """Every .xsl and .xml file under a window's project folders, built in the background."""
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.xsl_files = []
+        self.xml_files = []
+        self.built = None
+        self.building = False
+        self.callbacks = []
+
+    def is_stale(self):
+        return self.built is None or time.time() - self.built > settings.get("project_index_max_age", 60)
+
+    def refresh(self, callback=None):
+        """Rebuild if stale; callback(index) runs on the UI thread once a complete index exists."""
+        with _lock:
+            if callback:
+                if self.built is not None:
+                    sublime.set_timeout(lambda: callback(self), 0)
+                else:
+                    self.callbacks.append(callback)
+            if self.building or not self.is_stale():
+                return
+            self.building = True
+        sublime.set_timeout_async(self.build, 0)
+
+    def build(self):
+        started = time.time()
+        limit = settings.get("project_index_max_files", 50000)
+        xsl_files = []
+        xml_files = []
+        for folder in self.folders:
+            for root, dirs, names in os.walk(folder):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in names:
+                    if name.endswith('.xsl'):
+                        xsl_files.append(os.path.join(root, name))
+                    elif name.endswith('.xml') and not name.endswith('-output.xml'):
+                        xml_files.append(os.path.join(root, name))
+                if len(xsl_files) + len(xml_files) >= limit:
+                    break
+            if len(xsl_files) + len(xml_files) >= limit:
+                if is_debug():
+                    print("DEBUG: Project index stopped at project_index_max_files =", limit)
+                break
+        with _lock:
+            self.xsl_files = sorted(xsl_files)
+            self.xml_files = sorted(xml_files)
+            self.built = time.time()
+            self.building = False
+            callbacks, self.callbacks = self.callbacks, []
+        if is_debug():
+            print("DEBUG: Indexed %d stylesheets and %d XML files in %.3fs" % (len(xsl_files), len(xml_files), time.time() - started))
+        for callback in callbacks:
+            sublime.set_timeout(lambda callback=callback: callback(self), 0)
+
+    def add(self, path):
+        with _lock:
+            if self.built is None:
+                return
+            if path.endswith('.xsl') and path not in self.xsl_files:
+                self.xsl_files = sorted(self.xsl_files + [path])
+            elif path.endswith('.xml') and not path.endswith('-output.xml') and path not in self.xml_files:
+                self.xml_files = sorted(self.xml_files + [path])
+
+    def relative(self, path):
+        for folder in self.folders:
+            if path.startswith(folder + os.path.sep):
+                return os.path.relpath(path, os.path.dirname(folder)) if len(self.folders) > 1 else os.path.relpath(path, folder)
+        return path
+
+def is_enabled():
+    return settings.get("index_project_files", True)
+
+def project_index(window):
+    """The index for window's project folders, or None when there are none or indexing is off."""
+    folders = tuple(os.path.realpath(f) for f in window.folders())
+    if not folders or not is_enabled():
+        return None
+    with _lock:
+        index = _indexes.get(folders)
+        if index is None:
+            index = _indexes[folders] = ProjectIndex(folders)
+    return index
+
+def plugin_loaded():
+    for window in sublime.windows():
+        index = project_index(window)
+        if index:
+            index.refresh()
+
+class XmlTransformerIndexListener(sublime_plugin.EventListener):
+    def on_post_save_async(self, view):
+        path = view.file_name()
+        if not path or not (path.endswith('.xsl') or path.endswith('.xml')):
+            return
+        path = os.path.realpath(path)
+        with _lock:
+            indexes = list(_indexes.values())
+        for index in indexes:
+            if any(path.startswith(folder + os.path.sep) for folder in index.folders):
+                index.add(path)
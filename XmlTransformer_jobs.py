@@ -0,0 +1,210 @@
+import sublime
+import sublime_plugin
+import os
+import itertools
+import threading
+import multiprocessing
+from . import XmlTransformer_worker
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+STATUS_KEY = "xml_transformer_jobs"
+
+# Window ID -> jobs waiting to start, oldest first
+queues = {}
+running = []
+_lock = threading.RLock()
+_ids = itertools.count(1)
+
+def is_debug():
+    return settings.get("debug", False)
+
+def max_jobs():
+    jobs = settings.get("max_concurrent_jobs", 0)
+    return jobs if jobs and jobs > 0 else multiprocessing.cpu_count()
+
+class Job(object):
+    """One transformation waiting for, or holding, a scheduler slot.
+
+    start(job) is called on the UI thread when the job gets its slot, and whoever runs it must call
+    finished(job.id) at the end. dropped() is called instead when the job is cancelled or replaced
+    before it started. Runners (ProcessRunners), plain processes and worker jobs are attached once the
+    work is under way so cancel() can stop them; a job such as a batch may attach many. Whatever is
+    attached after a cancel is stopped right away."""
+
+    def __init__(self, window_id, key, label, start, dropped, run_id=None):
+        self.id = next(_ids)
+        self.window_id = window_id
+        self.key = key
+        self.label = label
+        self.start = start
+        self.dropped = dropped
+        self.run_id = run_id
+        self.runners = []
+        self.processes = []
+        self.worker_jobs = []
+        self.cancelled = False
+
+def submit(window_id, key, label, start, dropped, run_id=None):
+    """Queue a job for the window. A queued job with the same key takes over the new request instead."""
+    with _lock:
+        queue = queues.setdefault(window_id, [])
+        duplicate = next((job for job in queue if key is not None and job.key == key), None)
+        if duplicate is not None:
+            if is_debug():
+                print("DEBUG: Replacing queued duplicate job", duplicate.id, duplicate.label)
+            replaced = duplicate.dropped
+            duplicate.label, duplicate.start, duplicate.dropped, duplicate.run_id = label, start, dropped, run_id
+        else:
+            queue.append(Job(window_id, key, label, start, dropped, run_id))
+    if duplicate is not None:
+        replaced()
+    pump()
+
+def pump():
+    """Start queued jobs while there are free slots: one job per window at a time, oldest first across windows."""
+    started = []
+    with _lock:
+        while len(running) < max_jobs():
+            busy = set(job.window_id for job in running)
+            heads = [queue[0] for window_id, queue in queues.items() if queue and window_id not in busy]
+            if not heads:
+                break
+            job = min(heads, key=lambda job: job.id)
+            queues[job.window_id].pop(0)
+            running.append(job)
+            started.append(job)
+    for job in started:
+        sublime.set_timeout(lambda job=job: run(job), 0)
+    update_status()
+
+def run(job):
+    if is_debug():
+        print("DEBUG: Starting job", job.id, job.label)
+    try:
+        job.start(job)
+    except Exception:
+        finished(job.id)
+        raise
+
+def get(job_id):
+    with _lock:
+        return next((job for job in running if job.id == job_id), None)
+
+def attach(job_id, runner=None, process=None, worker_job=None):
+    job = get(job_id)
+    if job is None:
+        return
+    with _lock:
+        # Forget finished work so long batches do not accumulate it.
+        job.runners = [r for r in job.runners if r.process.poll() is None] + ([runner] if runner else [])
+        job.processes = [p for p in job.processes if p.poll() is None] + ([process] if process else [])
+        job.worker_jobs = [w for w in job.worker_jobs if not w.finished.is_set()] + ([worker_job] if worker_job else [])
+    if job.cancelled:
+        stop(job)
+
+def finished(job_id):
+    if job_id is None:
+        return
+    with _lock:
+        running[:] = [job for job in running if job.id != job_id]
+    pump()
+
+def window_jobs(window_id):
+    with _lock:
+        return [job for job in running if job.window_id == window_id], list(queues.get(window_id, []))
+
+def stop(job):
+    with _lock:
+        runners, processes, worker_jobs = list(job.runners), list(job.processes), list(job.worker_jobs)
+    for runner in runners:
+        runner.kill()
+    for process in processes:
+        XmlTransformer_worker.kill_tree(process)
+    for worker_job in worker_jobs:
+        # Only this request is cancelled; the worker keeps serving other windows.
+        sublime.set_timeout_async(lambda worker_job=worker_job: XmlTransformer_worker.cancel_job(worker_job), 0)
+
+def cancel(job):
+    """Drop a queued job, or stop a running one: kill its Java process tree, or cancel its worker request."""
+    with _lock:
+        queue = queues.get(job.window_id, [])
+        queued = job in queue
+        if queued:
+            queue.remove(job)
+    if queued:
+        job.dropped()
+        update_status()
+        return
+    job.cancelled = True
+    stop(job)
+
+def find(predicate):
+    with _lock:
+        return [job for job in running if predicate(job)] + [job for queue in queues.values() for job in queue if predicate(job)]
+
+def status_text(window_id):
+    window_running, window_queued = window_jobs(window_id)
+    with _lock:
+        total_running = len(running)
+        total_queued = sum(len(queue) for queue in queues.values())
+    if not window_running and not window_queued:
+        return None
+    parts = []
+    if window_running:
+        parts.append("transforming " + window_running[0].label)
+    if window_queued:
+        parts.append("{0} queued".format(len(window_queued)))
+    text = "XmlTransformer: " + ", ".join(parts)
+    if total_running + total_queued > len(window_running) + len(window_queued):
+        text += " [all windows: {0}/{1} running, {2} queued]".format(total_running, max_jobs(), total_queued)
+    return text
+
+def show_status(view, window):
+    text = status_text(window.id()) if window else None
+    if text:
+        view.set_status(STATUS_KEY, text)
+    else:
+        view.erase_status(STATUS_KEY)
+
+def update_status():
+    def update():
+        for window in sublime.windows():
+            view = window.active_view()
+            if view is not None:
+                show_status(view, window)
+    sublime.set_timeout(update, 0)
+
+def submit_work(window_id, label, run):
+    """Queue run(job) to be called on the async thread once the window gets a slot; the slot is released when it returns.
+
+    For commands that drive many transformations themselves, such as batch or sweep runs."""
+    def start(job):
+        def work():
+            try:
+                run(job)
+            finally:
+                finished(job.id)
+        sublime.set_timeout_async(work, 0)
+    submit(window_id, None, label, start, lambda: sublime.status_message("XmlTransformer: Cancelled " + label))
+
+def label(xml_path, xsl_path):
+    return "{0} with {1}".format(os.path.basename(xml_path or "buffer"), os.path.basename(xsl_path or "?"))
+
+class XmlTransformerCancelTransformationCommand(sublime_plugin.WindowCommand):
+    """Stop the window's running transformation and drop its queued ones."""
+
+    def run(self):
+        window_running, window_queued = window_jobs(self.window.id())
+        for job in window_queued + window_running:
+            cancel(job)
+        cancelled = len(window_queued) + len(window_running)
+        sublime.status_message("XmlTransformer: Cancelled {0} transformation{1}".format(cancelled, "" if cancelled == 1 else "s"))
+
+    def is_enabled(self):
+        window_running, window_queued = window_jobs(self.window.id())
+        return bool(window_running or window_queued)
+
+class XmlTransformerJobStatusListener(sublime_plugin.EventListener):
+    def on_activated(self, view):
+        show_status(view, view.window())
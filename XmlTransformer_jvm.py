@@ -0,0 +1,172 @@
+import sublime
+import os
+import glob
+import hashlib
+import shutil
+import subprocess
+import threading
+import ctypes
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+DEFAULT_LAUNCH_PROFILES = [
+    {"max_input_mb": 1, "options": ["-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC", "-XX:-UsePerfData"]},
+    {"max_input_mb": 100, "options": ["-XX:+UseSerialGC", "-XX:-UsePerfData"]},
+    {"options": ["-XX:+UseParallelGC"]}
+]
+
+# A tiny transform whose class loading matches a real Saxon run closely enough to train the archive.
+TRAINING_XML = "<?xml version=\"1.0\"?><root><item n=\"1\">a</item><item n=\"2\">b</item></root>"
+TRAINING_XSL = """<?xml version="1.0"?>
+<xsl:stylesheet version="3.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+    <xsl:output method="html"/>
+    <xsl:param name="p"/>
+    <xsl:template match="/">
+        <html><body><xsl:for-each select="//item"><p><xsl:value-of select="concat(@n, ., $p)"/></p></xsl:for-each></body></html>
+    </xsl:template>
+</xsl:stylesheet>
+"""
+
+_building = set()
+_building_lock = threading.Lock()
+_physical_memory = []
+
+def is_debug():
+    return settings.get("debug", False)
+
+def cds_dir():
+    return os.path.join(sublime.cache_path(), "XmlTransformer", "cds")
+
+def cds_key(java_bin, classpath):
+    """Changes whenever the Java binary or any JAR is replaced, so a stale archive is never used."""
+    digest = hashlib.sha1()
+    resolved = shutil.which(java_bin) or java_bin
+    for path in [os.path.realpath(resolved)] + list(classpath):
+        try:
+            st = os.stat(path)
+            digest.update("{0}|{1}|{2}\n".format(path, st.st_size, st.st_mtime).encode("utf-8"))
+        except OSError:
+            digest.update("{0}|missing\n".format(path).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def build_cds_archive(java_bin, classpath, key):
+    """Train a class list on a small transform, then dump it into an AppCDS archive (JDK 10+)."""
+    directory = cds_dir()
+    os.makedirs(directory, exist_ok=True)
+    class_list = os.path.join(directory, key + ".classlist")
+    archive = os.path.join(directory, key + ".jsa")
+    training_xml = os.path.join(directory, "training.xml")
+    training_xsl = os.path.join(directory, "training.xsl")
+    with open(training_xml, "w", encoding="utf-8") as f:
+        f.write(TRAINING_XML)
+    with open(training_xsl, "w", encoding="utf-8") as f:
+        f.write(TRAINING_XSL)
+    cp = os.pathsep.join(classpath)
+    steps = [
+        [java_bin, "-Xshare:off", "-XX:DumpLoadedClassList=" + class_list, "-cp", cp, "net.sf.saxon.Transform",
+         "-s:" + training_xml, "-xsl:" + training_xsl, "-o:" + os.path.join(directory, "training-output.html"), "p=x"],
+        [java_bin, "-Xshare:dump", "-XX:SharedClassListFile=" + class_list, "-XX:SharedArchiveFile=" + archive, "-cp", cp]
+    ]
+    creation_flags = 0
+    if sublime.platform() == "windows":
+        creation_flags = 0x08000000  # subprocess.CREATE_NO_WINDOW
+    for step in steps:
+        process = subprocess.Popen(step, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creation_flags)
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            raise OSError("{0} failed: {1}".format(step[1], stderr.decode("utf-8", "replace").strip()))
+    # Archives for replaced JARs or JDKs are useless now.
+    for stale in glob.glob(os.path.join(directory, "*.jsa")) + glob.glob(os.path.join(directory, "*.classlist")):
+        if not os.path.basename(stale).startswith(key):
+            os.remove(stale)
+
+def _build_in_background(java_bin, classpath, key):
+    try:
+        build_cds_archive(java_bin, classpath, key)
+        if is_debug():
+            print("DEBUG: Built AppCDS archive", key)
+    except OSError as e:
+        if is_debug():
+            print("DEBUG: AppCDS archive not supported by this JVM:", str(e))
+        # Remember the failure so unsupported JVMs (e.g. Java 8) are not retried on every build.
+        with open(os.path.join(cds_dir(), key + ".unsupported"), "w") as f:
+            f.write(str(e))
+    finally:
+        with _building_lock:
+            _building.discard(key)
+
+def cds_options(java_bin, classpath):
+    """-XX:SharedArchiveFile for the current JARs, or nothing while the archive is being built."""
+    if not settings.get("use_cds", True):
+        return []
+    key = cds_key(java_bin, classpath)
+    archive = os.path.join(cds_dir(), key + ".jsa")
+    if os.path.exists(archive):
+        return ["-Xshare:auto", "-XX:SharedArchiveFile=" + archive]
+    if os.path.exists(os.path.join(cds_dir(), key + ".unsupported")):
+        return []
+    with _building_lock:
+        if key in _building:
+            return []
+        _building.add(key)
+    threading.Thread(target=_build_in_background, args=(java_bin, classpath, key), daemon=True).start()
+    return []
+
+def launch_profile(input_size):
+    input_mb = input_size / (1024.0 * 1024.0)
+    for profile in settings.get("jvm_launch_profiles", DEFAULT_LAUNCH_PROFILES):
+        if profile.get("max_input_mb") is None or input_mb <= profile["max_input_mb"]:
+            return profile
+    return {"options": []}
+
+def physical_memory_mb():
+    """Installed RAM, or None when it cannot be read."""
+    if not _physical_memory:
+        memory = None
+        try:
+            if sublime.platform() == "windows":
+                class MemoryStatus(ctypes.Structure):
+                    _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                                ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                                ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                                ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                                ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+                status = MemoryStatus()
+                status.dwLength = ctypes.sizeof(MemoryStatus)
+                if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                    memory = status.ullTotalPhys // (1024 * 1024)
+            else:
+                memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+        except (AttributeError, ValueError, OSError):
+            pass
+        _physical_memory.append(memory)
+    return _physical_memory[0]
+
+def heap_options(input_size):
+    """-Xmx for input_size, only when it raises the heap above Java's default of a quarter of RAM.
+
+    jvm_max_heap_mb of 0 clamps it to three quarters of RAM instead, leaving room for everything else."""
+    factor = settings.get("jvm_heap_per_input_mb", 8)
+    if not factor:
+        return []
+    input_mb = input_size // (1024 * 1024)
+    heap_mb = max(settings.get("jvm_min_heap_mb", 256), input_mb * factor)
+    max_heap_mb = settings.get("jvm_max_heap_mb", 0)
+    if max_heap_mb:
+        heap_mb = min(max_heap_mb, heap_mb)
+    memory = physical_memory_mb()
+    if memory:
+        if not max_heap_mb:
+            heap_mb = min(memory * 3 // 4, heap_mb)
+        if heap_mb <= memory // 4:
+            return []
+    return ["-Xmx{0}m".format(heap_mb)]
+
+def launch_options(java_bin, classpath, input_size):
+    """JVM options for a one-shot Saxon run on an input of input_size bytes."""
+    options = list(launch_profile(input_size).get("options", []))
+    options.extend(heap_options(input_size))
+    options.extend(cds_options(java_bin, classpath))
+    if is_debug():
+        print("DEBUG: JVM launch options:", options)
+    return options
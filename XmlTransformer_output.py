@@ -0,0 +1,253 @@
+import sublime
+import sublime_plugin
+import os
+import re
+import codecs
+import subprocess
+from . import XmlTransformer_stylesheet
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+PLAIN_TEXT = "Packages/Text/Plain text.tmLanguage"
+COUNT_CHUNK = 1024 * 1024
+LINE_SEARCH = 64 * 1024
+HEAD_BYTES = 4096
+DECLARED_ENCODING = re.compile(br'^\s*<\?xml[^>]*?\bencoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+META_CHARSET = re.compile(br'<meta\b[^>]*?\bcharset\s*=\s*["\']?([A-Za-z0-9._-]+)', re.IGNORECASE)
+# Byte order marks, then "<?" of an XML declaration without one (XML 1.0 appendix F). Checked in
+# order: the UTF-32 LE mark starts with the UTF-16 LE one.
+SIGNATURES = [(codecs.BOM_UTF32_LE, "utf-32-le"), (codecs.BOM_UTF32_BE, "utf-32-be"), (codecs.BOM_UTF8, "utf-8"),
+              (codecs.BOM_UTF16_LE, "utf-16-le"), (codecs.BOM_UTF16_BE, "utf-16-be"),
+              (b"<\x00\x00\x00?\x00\x00\x00", "utf-32-le"), (b"\x00\x00\x00<\x00\x00\x00?", "utf-32-be"),
+              (b"<\x00?\x00", "utf-16-le"), (b"\x00<\x00?", "utf-16-be")]
+
+# Output path -> line count, once the counting pass has finished
+line_counts = {}
+
+def is_debug():
+    return settings.get("debug", False)
+
+def format_size(size):
+    for unit, scale in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024)):
+        if size >= scale:
+            return "{0:.1f} {1}".format(size / float(scale), unit)
+    return "{0} bytes".format(size)
+
+def count_lines(path):
+    """Newlines in path, counted in fixed-size chunks so memory stays flat."""
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COUNT_CHUNK), b""):
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    return lines + (0 if last == b"\n" else 1)
+
+def declared_encoding(data, default="UTF-8"):
+    """The encoding an output declares (BOM, XML declaration or HTML meta charset), default otherwise."""
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "UTF-16"
+    match = DECLARED_ENCODING.match(data) or META_CHARSET.search(data[:HEAD_BYTES])
+    if match:
+        encoding = match.group(1).decode("ascii")
+        try:
+            codecs.lookup(encoding)
+            return encoding
+        except LookupError:
+            pass
+    return default
+
+def output_encoding(path, fallback=None):
+    """The codec to decode any part of path with: its BOM or signature, else what it declares, else
+    fallback (the stylesheet's xsl:output encoding), else UTF-8. UTF-16 and UTF-32 always come with a
+    byte order."""
+    with open(path, "rb") as f:
+        head = f.read(HEAD_BYTES)
+    for signature, name in SIGNATURES:
+        if head.startswith(signature):
+            return name
+    try:
+        name = codecs.lookup(declared_encoding(head, None) or fallback or "utf-8").name
+    except LookupError:
+        return "utf-8"
+    # Without a byte order mark UTF-16 and UTF-32 are big-endian.
+    return name + "-be" if name in ("utf-16", "utf-32") else name
+
+def code_unit(encoding):
+    name = codecs.lookup(encoding).name
+    return 4 if name.startswith("utf-32") else 2 if name.startswith("utf-16") else 1
+
+def read_text(f, start, end, encoding="utf-8"):
+    f.seek(start)
+    text = f.read(max(0, end - start)).decode(encoding, "replace")
+    return text.lstrip("\ufeff") if start == 0 else text
+
+def line_boundary(f, offset, size, limit=LINE_SEARCH, encoding="utf-8"):
+    """The first line start within limit bytes of offset.
+
+    Output without indentation is often a single line; then the cut is at offset, moved forward to the
+    next character start. Keep limit below the distance between two cuts so ranges never overlap."""
+    if offset <= 0:
+        return 0
+    if offset >= size:
+        return size
+    unit = code_unit(encoding)
+    offset -= offset % unit
+    f.seek(offset - unit)
+    block = f.read(limit + unit)
+    # A newline is only one where a code unit starts; in UTF-16 and UTF-32 its bytes also occur inside others.
+    newline = "\n".encode(encoding)
+    index = block.find(newline)
+    while index != -1 and index % unit:
+        index = block.find(newline, index + 1)
+    if index != -1:
+        return offset + index
+    if unit == 2 and len(block) >= 4:
+        # Do not cut a surrogate pair in two.
+        value = int.from_bytes(block[2:4], "little" if codecs.lookup(encoding).name.endswith("le") else "big")
+        return offset + 2 if 0xDC00 <= value <= 0xDFFF else offset
+    if unit > 1 or codecs.lookup(encoding).name != "utf-8":
+        return offset
+    # block[1] is the byte at offset; skip at most three continuation bytes.
+    position = 1
+    while position < min(4, len(block)) and block[position] & 0xC0 == 0x80:
+        position += 1
+    return offset + position - 1
+
+def page_range(f, size, page, page_size, encoding="utf-8"):
+    limit = min(LINE_SEARCH, page_size // 2)
+    return (line_boundary(f, page * page_size, size, limit, encoding),
+            line_boundary(f, (page + 1) * page_size, size, limit, encoding))
+
+def page_count(size, page_size):
+    return max(1, (size + page_size - 1) // page_size)
+
+def preview_text(path, size, preview_bytes, lines=None, encoding="utf-8"):
+    with open(path, "rb") as f:
+        limit = min(LINE_SEARCH, preview_bytes // 2)
+        head_end = line_boundary(f, preview_bytes, size, limit, encoding)
+        tail_start = max(head_end, line_boundary(f, size - preview_bytes, size, limit, encoding))
+        head = read_text(f, 0, head_end, encoding)
+        tail = read_text(f, tail_start, size, encoding)
+    header = "XmlTransformer: {0} is {1}, {2}. Showing the first and last {3}.\n".format(
+        path, format_size(size), "{0:,} lines".format(lines) if lines is not None else "counting lines...",
+        format_size(preview_bytes))
+    if tail_start > head_end:
+        middle = "\n[... {0} not shown ...]\n\n".format(format_size(tail_start - head_end))
+    else:
+        middle = ""
+    return header + "\n" + head + middle + tail
+
+def open_external(path):
+    viewer = settings.get("large_output_external_viewer", [])
+    if viewer:
+        subprocess.Popen(list(viewer) + [path])
+    elif sublime.platform() == "windows":
+        os.startfile(path)
+    elif sublime.platform() == "osx":
+        subprocess.Popen(["open", path])
+    else:
+        subprocess.Popen(["xdg-open", path])
+
+def scratch_view(window, name):
+    view = window.new_file()
+    view.set_scratch(True)
+    view.set_name(name)
+    view.set_syntax_file(PLAIN_TEXT)
+    return view
+
+def set_content(view, text):
+    view.set_read_only(False)
+    view.run_command("xml_transformer_set_content", {"text": text})
+    view.set_read_only(True)
+
+def open_output(window, path, xsl_path=None):
+    """Open a transformation result, or a plain-text preview when it is over the size threshold.
+
+    The preview and pages decode the output as it declares, or as xsl_path's xsl:output says."""
+    threshold_mb = settings.get("large_output_threshold_mb", 20)
+    size = os.path.getsize(path)
+    if not threshold_mb or size <= threshold_mb * 1024 * 1024:
+        window.open_file(path)
+        return
+    if is_debug():
+        print("DEBUG: Output %s is %s, showing a preview" % (path, format_size(size)))
+    preview_bytes = settings.get("large_output_preview_kb", 64) * 1024
+    encoding = output_encoding(path, XmlTransformer_stylesheet.stylesheet_info(xsl_path).output_encoding if xsl_path else None)
+    view = scratch_view(window, "{0} (preview)".format(os.path.basename(path)))
+    view.settings().set("xml_transformer_output", path)
+    view.settings().set("xml_transformer_encoding", encoding)
+    set_content(view, preview_text(path, size, preview_bytes, line_counts.get((path, size)), encoding))
+
+    def count():
+        lines = count_lines(path)
+        line_counts[(path, size)] = lines
+        sublime.set_timeout(lambda: on_counted(lines), 0)
+
+    def on_counted(lines):
+        if view.is_valid():
+            set_content(view, preview_text(path, size, preview_bytes, lines, encoding))
+        sublime.status_message("XmlTransformer: {0} is {1}, {2:,} lines".format(os.path.basename(path), format_size(size), lines))
+
+    if (path, size) not in line_counts:
+        sublime.set_timeout_async(count, 0)
+    window.show_quick_panel(
+        [
+            ["Keep the preview", "First and last {0} of {1}".format(format_size(preview_bytes), format_size(size))],
+            ["Open the full file", "May take a long time in Sublime Text"],
+            ["Open in external viewer", " ".join(settings.get("large_output_external_viewer", [])) or "System default application"],
+            ["Page through in chunks", "{0} pages of about {1}".format(
+                page_count(size, page_size()), format_size(page_size()))]
+        ],
+        lambda index: on_action(window, path, index, encoding)
+    )
+
+def page_size():
+    return max(1, settings.get("large_output_page_kb", 1024)) * 1024
+
+def on_action(window, path, index, encoding):
+    if index == 1:
+        window.open_file(path)
+    elif index == 2:
+        open_external(path)
+    elif index == 3:
+        window.run_command("xml_transformer_output_page", {"path": path, "page": 0, "encoding": encoding})
+
+class XmlTransformerSetContentCommand(sublime_plugin.TextCommand):
+    def run(self, edit, text):
+        self.view.replace(edit, sublime.Region(0, self.view.size()), text)
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(0, 0))
+
+class XmlTransformerOutputPageCommand(sublime_plugin.WindowCommand):
+    """Show one page of a large output in a read-only view; with delta, move the active page view."""
+
+    def run(self, path=None, page=None, delta=None, encoding=None):
+        view = self.window.active_view()
+        if path is None:
+            if not view or view.settings().get("xml_transformer_page") is None:
+                return
+            path = view.settings().get("xml_transformer_output")
+            page = view.settings().get("xml_transformer_page") + (delta or 0)
+        elif not (view and view.settings().get("xml_transformer_output") == path
+                  and view.settings().get("xml_transformer_page") is not None):
+            view = scratch_view(self.window, os.path.basename(path))
+            view.settings().set("xml_transformer_output", path)
+        encoding = encoding or view.settings().get("xml_transformer_encoding") or output_encoding(path)
+        view.settings().set("xml_transformer_encoding", encoding)
+        size = os.path.getsize(path)
+        pages = page_count(size, page_size())
+        page = max(0, min(pages - 1, page or 0))
+        with open(path, "rb") as f:
+            start, end = page_range(f, size, page, page_size(), encoding)
+            text = read_text(f, start, end, encoding)
+        view.settings().set("xml_transformer_page", page)
+        view.set_name("{0} (page {1}/{2})".format(os.path.basename(path), page + 1, pages))
+        set_content(view, text)
+        sublime.status_message("XmlTransformer: page {0} of {1}, bytes {2:,}-{3:,} of {4:,}".format(page + 1, pages, start, end, size))
+
+    def is_enabled(self, path=None, page=None, delta=None, encoding=None):
+        if path is not None:
+            return True
+        view = self.window.active_view()
+        return bool(view and view.settings().get("xml_transformer_page") is not None)
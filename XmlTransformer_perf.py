@@ -0,0 +1,160 @@
+import sublime
+import sublime_plugin
+import os
+import json
+import math
+import time
+import threading
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+STAGE_ORDER = ["panel.xsl", "panel.params", "dir.scan", "xsl.parse", "validate.source", "command.build",
+               "resolver.prefetch", "result_cache.lookup", "process.spawn", "saxon.run", "worker.run", "pipeline.stage", "output.open"]
+
+_pending = []
+_lock = threading.Lock()
+_flush_scheduled = False
+
+def is_enabled():
+    return settings.get("performance_log", False)
+
+def log_file():
+    return os.path.join(sublime.cache_path(), "XmlTransformer", "perf.jsonl")
+
+class Span(object):
+    """A timed stage. End it with end(**fields) or use it as a context manager."""
+
+    __slots__ = ("name", "fields", "started")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.started = time.perf_counter()
+
+    def end(self, **fields):
+        elapsed_ms = (time.perf_counter() - self.started) * 1000.0
+        self.fields.update(fields)
+        record(self.name, elapsed_ms, self.fields)
+        return elapsed_ms
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        self.end()
+
+class NoopSpan(object):
+    """Returned while logging is off, so instrumented code pays one settings lookup and nothing else."""
+
+    __slots__ = ()
+
+    def end(self, **fields):
+        return 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NOOP = NoopSpan()
+
+def span(name, **fields):
+    if not is_enabled():
+        return NOOP
+    return Span(name, fields)
+
+def record(name, elapsed_ms, fields):
+    global _flush_scheduled
+    entry = dict(fields, stage=name, ms=round(elapsed_ms, 3), ts=round(time.time(), 3))
+    with _lock:
+        _pending.append(json.dumps(entry))
+        if _flush_scheduled:
+            return
+        _flush_scheduled = True
+    # Batch the writes and keep file I/O off whichever thread ended the span.
+    sublime.set_timeout_async(flush, 500)
+
+def flush():
+    global _flush_scheduled
+    with _lock:
+        lines = list(_pending)
+        del _pending[:]
+        _flush_scheduled = False
+    if not lines:
+        return
+    path = log_file()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) > settings.get("performance_log_max_kb", 1024) * 1024:
+            os.replace(path, path + ".1")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    except OSError as e:
+        if settings.get("debug", False):
+            print("DEBUG: Could not write performance log:", str(e))
+
+def load_records():
+    """Entries from the rolled-over and the current log, oldest first."""
+    records = []
+    for path in (log_file() + ".1", log_file()):
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return records
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def report(records, runs):
+    by_stage = {}
+    for entry in records:
+        by_stage.setdefault(entry.get("stage"), []).append(entry.get("ms", 0.0))
+    stages = [s for s in STAGE_ORDER if s in by_stage] + sorted(s for s in by_stage if s not in STAGE_ORDER)
+    lines = [
+        "XmlTransformer performance, last {0} runs per stage (ms)".format(runs),
+        "",
+        "{0:<22}{1:>7}{2:>11}{3:>11}{4:>11}{5:>11}{6:>11}".format("stage", "count", "p50", "p90", "p99", "max", "last")
+    ]
+    for stage in stages:
+        recent = by_stage[stage][-runs:]
+        ordered = sorted(recent)
+        lines.append("{0:<22}{1:>7}{2:>11.1f}{3:>11.1f}{4:>11.1f}{5:>11.1f}{6:>11.1f}".format(
+            stage, len(recent), percentile(ordered, 0.5), percentile(ordered, 0.9), percentile(ordered, 0.99),
+            ordered[-1], recent[-1]))
+    return lines
+
+class XmlTransformerPerformanceReportCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        sublime.set_timeout_async(self.collect, 0)
+
+    def collect(self):
+        flush()
+        records = load_records()
+        if records:
+            lines = report(records, settings.get("performance_report_runs", 100))
+        else:
+            lines = ["No timings recorded yet." + ("" if is_enabled() else " Set \"performance_log\": true and run a few builds.")]
+        sublime.set_timeout(lambda: self.show(lines), 0)
+
+    def show(self, lines):
+        panel = self.window.create_output_panel("xml_transformer_perf")
+        panel.run_command("append", {"characters": "\n".join(lines)})
+        self.window.run_command("show_panel", {"panel": "output.xml_transformer_perf"})
+
+class XmlTransformerClearPerformanceLogCommand(sublime_plugin.ApplicationCommand):
+    def run(self):
+        for path in (log_file(), log_file() + ".1"):
+            if os.path.exists(path):
+                os.remove(path)
+        sublime.status_message("XmlTransformer: Performance log cleared")
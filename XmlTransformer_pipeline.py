@@ -0,0 +1,198 @@
+import sublime
+import os
+import glob
+import json
+import time
+import tempfile
+import xml.etree.ElementTree as ET
+from . import XmlTransformer_build
+from . import XmlTransformer_stylesheet
+from . import XmlTransformer_worker
+from . import XmlTransformer_output
+from . import XmlTransformer_perf
+from . import XmlTransformer_catalog
+from . import XmlTransformer_jobs
+from .XmlTransformer_build import settings, is_debug, get_message, collect_params
+
+PIPELINE_SUFFIX = ".pipeline.json"
+
+class Pipeline(object):
+    """Ordered stylesheets with their parameters, read from a *.pipeline.json file."""
+
+    def __init__(self, path, stages, output):
+        self.path = path
+        self.stages = stages
+        self.output = output
+
+def load_pipeline(path):
+    """Parse a pipeline definition. Paths are relative to the definition's directory.
+
+    Raises ValueError (or OSError/ET.ParseError for a stage's param_file) when it is not usable."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("not a JSON object")
+    if not isinstance(data.get("stages", []), list):
+        raise ValueError("\"stages\" is not a list")
+    base = os.path.dirname(os.path.abspath(path))
+    stages = []
+    for index, stage in enumerate(data.get("stages", [])):
+        if not isinstance(stage, dict) or not isinstance(stage.get("xsl"), str) or not stage["xsl"]:
+            raise ValueError("stage {0} has no \"xsl\"".format(index + 1))
+        if not isinstance(stage.get("params", {}), dict):
+            raise ValueError("\"params\" of stage {0} is not an object".format(index + 1))
+        if not isinstance(stage.get("param_file", ""), str):
+            raise ValueError("\"param_file\" of stage {0} is not a path".format(index + 1))
+        xsl = os.path.normpath(os.path.join(base, os.path.expanduser(stage["xsl"])))
+        params = {}
+        if stage.get("param_file"):
+            params = collect_params(ET.parse(os.path.join(base, stage["param_file"])).getroot())
+        params.update((name, str(value)) for name, value in stage.get("params", {}).items())
+        stages.append((xsl, params))
+    if not stages:
+        raise ValueError("no \"stages\"")
+    output = data.get("output")
+    if output is not None and not isinstance(output, str):
+        raise ValueError("\"output\" is not a path")
+    return Pipeline(path, stages, os.path.normpath(os.path.join(base, output)) if output else None)
+
+def stage_file(source, index):
+    """A new hidden file for an intermediate result, in the source's directory when it is writable."""
+    prefix = ".{0}.stage-{1}-".format(os.path.splitext(os.path.basename(source))[0], index + 1)
+    try:
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix=".xml", dir=os.path.dirname(os.path.abspath(source)))
+    except OSError:
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix=".xml")
+    os.close(fd)
+    return path
+
+def find_pipelines(directory):
+    return sorted(glob.glob(os.path.join(directory, "*" + PIPELINE_SUFFIX)))
+
+class XmlTransformerPipelineCommand(XmlTransformer_build.XmlTransformerBuildCommand):
+    """Run the current file through a multi-stage pipeline in one job.
+
+    The worker passes intermediate results between stages in memory and writes only the final output."""
+
+    def run(self, pipeline=None):
+        if not self.use_toolchain(lambda: self.run(pipeline)):
+            return
+        view = self.window.active_view()
+        if not view or view.file_name() is None:
+            sublime.error_message(get_message("no_xml_file"))
+            return
+        self.xml_path = view.file_name()
+        self.working_dir = os.path.dirname(self.xml_path)
+        if pipeline:
+            self.on_pipeline_selected(os.path.join(self.working_dir, pipeline))
+            return
+        pipelines = find_pipelines(self.working_dir)
+        if not pipelines:
+            sublime.error_message(get_message("no_pipelines", self.working_dir, PIPELINE_SUFFIX))
+        elif len(pipelines) == 1:
+            self.on_pipeline_selected(pipelines[0])
+        else:
+            self.window.show_quick_panel(
+                [os.path.basename(path) for path in pipelines],
+                lambda index: index != -1 and self.on_pipeline_selected(pipelines[index])
+            )
+
+    def on_pipeline_selected(self, path):
+        try:
+            pipeline = load_pipeline(path)
+        except (OSError, ValueError, ET.ParseError) as e:
+            sublime.error_message(get_message("pipeline_invalid", path, str(e)))
+            return
+        for xsl, params in pipeline.stages:
+            if not self.validate_stylesheet(XmlTransformer_stylesheet.stylesheet_info(xsl)):
+                return
+        # The last stage decides the output method, as the only stylesheet of a build would.
+        self.xsl_path = pipeline.stages[-1][0]
+        output_file = pipeline.output or self.get_output_file(self.xml_path)
+        self.validate_xml_file(self.xml_path, lambda: self.start_pipeline(pipeline, output_file))
+
+    def start_pipeline(self, pipeline, output_file):
+        sublime.status_message(get_message("pipeline_running", os.path.basename(pipeline.path), len(pipeline.stages)))
+        suppress_warnings = settings.get("suppress_warnings", True)
+        label = "pipeline {0} on {1}".format(os.path.basename(pipeline.path), os.path.basename(self.xml_path))
+        XmlTransformer_jobs.submit_work(self.window.id(), label, lambda job: self.run_pipeline(pipeline, output_file, suppress_warnings, job))
+
+    def run_pipeline(self, pipeline, output_file, suppress_warnings, job):
+        started = time.time()
+        result = None
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        for index, (xsl, params) in enumerate(pipeline.stages):
+            XmlTransformer_catalog.prepare([self.xml_path] if index == 0 else [], xsl=xsl)
+        worker = None
+        if settings.get("use_worker", True):
+            worker = XmlTransformer_worker.get_worker(self.java_bin, self.get_classpath())
+        if worker is not None:
+            try:
+                worker_job = worker.pipeline(os.path.normpath(self.xml_path), os.path.normpath(output_file), pipeline.stages, quiet=suppress_warnings)
+                XmlTransformer_jobs.attach(job.id, worker_job=worker_job)
+                worker_job.finished.wait()
+                timings = [int(fields[1]) for event, fields in worker_job.info if event == "STAGE" and len(fields) == 2]
+                result = (timings, worker_job.returncode == 0, worker_job.error_text())
+            except XmlTransformer_worker.WorkerError as e:
+                if is_debug():
+                    print("DEBUG: Falling back to one-shot Saxon runs for the pipeline:", str(e))
+        if result is None:
+            result = self.run_stages_one_shot(pipeline, output_file, suppress_warnings, job)
+        timings, ok, error_text = result
+        if XmlTransformer_perf.is_enabled():
+            for (xsl, params), ms in zip(pipeline.stages, timings):
+                XmlTransformer_perf.record("pipeline.stage", ms, {"xsl": os.path.basename(xsl)})
+        elapsed = time.time() - started
+        if is_debug():
+            print("DEBUG: Pipeline %s on %s: %s in %.3fs" % (pipeline.path, self.xml_path, timings, elapsed))
+        sublime.set_timeout(lambda: self.show_result(pipeline, output_file, timings, ok, error_text, elapsed), 0)
+
+    def run_stages_one_shot(self, pipeline, output_file, suppress_warnings, job):
+        """Without the worker each stage is a separate Saxon run and intermediate results go through files.
+
+        The files are hidden ones next to the source, so relative URIs in later stages resolve against
+        the source's directory as they do in the worker."""
+        temp_files = []
+        timings = []
+        source = self.xml_path
+        try:
+            for index, (xsl, params) in enumerate(pipeline.stages):
+                last = index == len(pipeline.stages) - 1
+                if last:
+                    output = output_file
+                else:
+                    output = stage_file(self.xml_path, index)
+                    temp_files.append(output)
+                stage_started = time.time()
+                ok, error_text = self.transform_blocking(None, source, output, params, suppress_warnings, job, xsl_path=xsl)
+                if not ok:
+                    return timings, False, error_text
+                timings.append(int((time.time() - stage_started) * 1000))
+                source = output
+            return timings, True, ""
+        finally:
+            for path in temp_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def show_result(self, pipeline, output_file, timings, ok, error_text, elapsed):
+        lines = ["XmlTransformer pipeline: {0}".format(pipeline.path), "Source: {0}".format(self.xml_path), ""]
+        for index, (xsl, params) in enumerate(pipeline.stages):
+            if index < len(timings):
+                state = "{0:>8} ms".format(timings[index])
+            elif index == len(timings) and not ok:
+                state = "{0:>11}".format("FAILED")
+            else:
+                state = "{0:>11}".format("skipped")
+            lines.append("{0}. {1}  {2}".format(index + 1, state, xsl))
+        lines.extend(["", get_message("pipeline_summary", len(timings), len(pipeline.stages), "%.1f" % elapsed)])
+        if not ok:
+            lines.extend(["", "XmlTransformer Error:"] + (error_text or "unknown error").splitlines())
+        panel = self.window.create_output_panel("xml_transformer_pipeline")
+        panel.run_command("append", {"characters": "\n".join(lines)})
+        self.window.run_command("show_panel", {"panel": "output.xml_transformer_pipeline"})
+        sublime.status_message(lines[-1] if ok else get_message("pipeline_failed", len(timings) + 1))
+        if ok and os.path.exists(output_file):
+            XmlTransformer_output.open_output(self.window, output_file, pipeline.stages[-1][0])
@@ -0,0 +1,318 @@
+import sublime
+import sublime_plugin
+import os
+import re
+import json
+import time
+import hashlib
+import subprocess
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from urllib.parse import urlparse, unquote
+from . import XmlTransformer_build
+from . import XmlTransformer_worker
+from . import XmlTransformer_output
+from . import XmlTransformer_catalog
+from . import XmlTransformer_jobs
+from .XmlTransformer_build import settings, is_debug, get_message
+
+SORT_KEYS = [
+    ("net", "Total net time"),
+    ("gross", "Total gross time"),
+    ("count", "Calls"),
+    ("avg_net", "Average net time")
+]
+TIMES = [
+    ("compile", re.compile(r"Stylesheet compilation time:\s*([\d.]+)\s*(ms|s)\b")),
+    ("parse", re.compile(r"Tree built in\s*([\d.]+)\s*(ms|s)\b")),
+    ("execute", re.compile(r"Execution time:\s*([\d.]+)\s*(ms|s)\b"))
+]
+PANEL_REGEX = r"^\s*[\d.]+\s+[\d.]+\s+\d+\s+[\d.]+\s+(.+?):(\d+)  "
+
+# Window ID -> (Profile, previous run's saved profile) last shown in that window's panel
+profiles = {}
+
+class Profile(object):
+    """Saxon -t stage times (ms) and -TP entries for one run."""
+
+    def __init__(self, xsl_path, source, times, entries):
+        self.xsl_path = xsl_path
+        self.source = source
+        self.times = times
+        self.entries = entries
+
+    def to_json(self):
+        return {"xsl": self.xsl_path, "source": self.source, "times": self.times, "entries": self.entries, "created": time.time()}
+
+def parse_times(stderr):
+    times = {}
+    for name, pattern in TIMES:
+        match = pattern.search(stderr)
+        if match:
+            value = float(match.group(1))
+            times[name] = value * 1000.0 if match.group(2) == "s" else value
+    return times
+
+def uri_to_path(uri):
+    if not uri.startswith("file:"):
+        return uri
+    path = unquote(urlparse(uri).path)
+    if re.match(r"^/[A-Za-z]:", path):
+        path = path[1:]  # file:/C:/... on Windows
+    return os.path.normpath(path)
+
+class ProfileTableParser(HTMLParser):
+    """Rows of the table in Saxon's -TP HTML report, as lists of cell texts."""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.rows = []
+        self.row = None
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.row = []
+        elif tag in ("td", "th") and self.row is not None:
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self.cell is not None:
+            self.row.append(" ".join("".join(self.cell).split()))
+            self.cell = None
+        elif tag == "tr" and self.row is not None:
+            if self.row:
+                self.rows.append(self.row)
+            self.row = None
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+def column(header, *words):
+    for index, name in enumerate(header):
+        name = name.lower().replace("average", "avg")
+        if all(word in name for word in words):
+            return index
+    return None
+
+def number(text):
+    try:
+        return float(text.replace(",", ""))
+    except ValueError:
+        return 0.0
+
+def parse_html_profile(text):
+    parser = ProfileTableParser()
+    parser.feed(text)
+    parser.close()
+    entries = []
+    header = None
+    for row in parser.rows:
+        if header is None:
+            if any("line" == cell.lower() for cell in row):
+                header = row
+                columns = {
+                    "file": column(header, "file"),
+                    "line": column(header, "line"),
+                    "instruction": column(header, "instruction"),
+                    "count": column(header, "count"),
+                    "gross": column(header, "total", "gross"),
+                    "net": column(header, "total", "net"),
+                    "avg_net": column(header, "avg", "net")
+                }
+            continue
+        if len(row) < len(header):
+            continue
+        entry = {}
+        for key, index in columns.items():
+            value = row[index] if index is not None else ""
+            entry[key] = value if key in ("file", "instruction") else number(value)
+        entry["file"] = uri_to_path(entry["file"])
+        entry["line"] = int(entry["line"])
+        entry["count"] = int(entry["count"])
+        entries.append(entry)
+    return entries
+
+def parse_xml_profile(text):
+    """The raw TimingTraceListener XML (<fn construct= file= line= count= t-sum= t-sum-net= .../>)."""
+    entries = []
+    for fn in ET.fromstring(text).iter("fn"):
+        name = fn.get("name") or fn.get("match") or ""
+        entries.append({
+            "file": uri_to_path(fn.get("file", "")),
+            "line": int(fn.get("line", "0") or 0),
+            "instruction": "{0} {1}".format(fn.get("construct", ""), name).strip(),
+            "count": int(fn.get("count", "0") or 0),
+            "gross": number(fn.get("t-sum", "0")),
+            "net": number(fn.get("t-sum-net", "0")),
+            "avg_net": number(fn.get("t-avg-net", "0"))
+        })
+    return entries
+
+def parse_profile(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if "<html" in text[:2000].lower():
+        return parse_html_profile(text)
+    return parse_xml_profile(text)
+
+def profile_dir():
+    return os.path.join(sublime.cache_path(), "XmlTransformer", "profiles")
+
+def profile_suffix(xsl_path):
+    """Ends the names of a stylesheet's profile files, so finding and pruning them needs no file reads."""
+    return "-" + hashlib.sha1(os.path.normpath(xsl_path).encode("utf-8")).hexdigest()[:8]
+
+def profile_files(xsl_path):
+    """Base paths (without extension) of a stylesheet's saved profiles, newest first."""
+    suffix = profile_suffix(xsl_path)
+    try:
+        names = os.listdir(profile_dir())
+    except OSError:
+        return []
+    bases = set(os.path.splitext(name)[0] for name in names if os.path.splitext(name)[0].endswith(suffix))
+    return [os.path.join(profile_dir(), base) for base in sorted(bases, reverse=True)]
+
+def prune_profiles(xsl_path):
+    for base in profile_files(xsl_path)[max(1, settings.get("profile_history", 10)):]:
+        for extension in (".html", ".json"):
+            try:
+                os.remove(base + extension)
+            except OSError:
+                pass
+
+def previous_profile(xsl_path):
+    """The last saved profile of the same stylesheet, for comparing stage times."""
+    for base in profile_files(xsl_path):
+        name = base + ".json"
+        if not os.path.exists(name):
+            continue
+        try:
+            with open(name, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if data.get("xsl") == xsl_path:
+            return data
+    return None
+
+def render(profile, sort_key, previous=None):
+    lines = ["XmlTransformer profile: {0}".format(profile.xsl_path), "Source: {0}".format(profile.source), ""]
+    for name, pattern in TIMES:
+        if name not in profile.times:
+            continue
+        line = "{0:<8} {1:>10.1f} ms".format(name, profile.times[name])
+        if previous and name in previous.get("times", {}):
+            line += "   (previous run {0:.1f} ms)".format(previous["times"][name])
+        lines.append(line)
+    label = dict(SORT_KEYS)[sort_key]
+    lines.extend([
+        "",
+        "Sorted by {0}. Double-click a row to open the stylesheet at that line; XmlTransformer: Sort Profile re-sorts.".format(label.lower()),
+        "{0:>10} {1:>10} {2:>8} {3:>9}  {4}".format("net ms", "gross ms", "calls", "avg net", "location  instruction")
+    ])
+    for entry in sorted(profile.entries, key=lambda e: e[sort_key], reverse=True):
+        lines.append("{0:>10.2f} {1:>10.2f} {2:>8d} {3:>9.3f}  {4}:{5}  {6}".format(
+            entry["net"], entry["gross"], entry["count"], entry["avg_net"], entry["file"], entry["line"], entry["instruction"]))
+    return lines
+
+def show_profile(window, profile, sort_key, previous=None):
+    panel = window.create_output_panel("xml_transformer_profile")
+    panel.settings().set("result_file_regex", PANEL_REGEX)
+    panel.run_command("append", {"characters": "\n".join(render(profile, sort_key, previous))})
+    window.run_command("show_panel", {"panel": "output.xml_transformer_profile"})
+
+class XmlTransformerProfileCommand(XmlTransformer_build.XmlTransformerBuildCommand):
+    """Run a one-shot Saxon with -t and -TP and show the most expensive templates and functions.
+
+    Picks the XSL and params with the build command's panels; only the final step differs."""
+
+    def start_transformation(self, param_file):
+        param_values = {}
+        if param_file:
+            param_values = self.parse_xml_param_file(param_file)
+            if param_values is None:
+                return
+        output_file = self.get_output_file(self.xml_path)
+        os.makedirs(profile_dir(), exist_ok=True)
+        # Microseconds keep two runs in the same second apart; names still sort by time.
+        now = time.time()
+        stamp = "{0}-{1:06d}".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(now)), int(now % 1 * 1000000))
+        base = os.path.join(profile_dir(), "{0}-{1}{2}".format(
+            stamp, os.path.splitext(os.path.basename(self.xsl_path))[0], profile_suffix(self.xsl_path)))
+        cmd = self.build_saxon_cmd(self.xml_path, output_file, param_values, settings.get("suppress_warnings", True))
+        # Options go before the name=value parameters.
+        position = next(i for i, arg in enumerate(cmd) if arg.startswith("-o:")) + 1
+        cmd[position:position] = ["-t", "-TP:" + base + ".html"]
+        if is_debug():
+            print("DEBUG: Profiling command:", cmd)
+        sublime.status_message(get_message("profiling", os.path.basename(self.xsl_path)))
+        label = "profile of " + XmlTransformer_jobs.label(self.xml_path, self.xsl_path)
+        XmlTransformer_jobs.submit_work(self.window.id(), label, lambda job: self.run_profile(cmd, base, output_file, job))
+
+    def run_profile(self, cmd, base, output_file, job):
+        XmlTransformer_catalog.prepare([self.xml_path], xsl=self.xsl_path)
+        cancelled = lambda: sublime.set_timeout(lambda: sublime.status_message("XmlTransformer: Profiling cancelled"), 0)
+        if job.cancelled:
+            cancelled()
+            return
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.working_dir,
+                creationflags=XmlTransformer_worker.creation_flags(),
+                start_new_session=True
+            )
+            XmlTransformer_jobs.attach(job.id, process=process)
+            stdout, stderr = process.communicate()
+            if job.cancelled:
+                cancelled()
+                return
+            stderr = stderr.decode("utf-8", "replace")
+            returncode = process.returncode
+        except OSError as e:
+            stderr, returncode = str(e), 1
+        profile = None
+        if returncode == 0:
+            try:
+                profile = Profile(os.path.normpath(self.xsl_path), os.path.normpath(self.xml_path),
+                                  parse_times(stderr), parse_profile(base + ".html"))
+            except (OSError, ValueError, ET.ParseError) as e:
+                stderr, returncode = get_message("profile_unreadable", base + ".html", str(e)), 1
+        previous = None
+        if profile is not None:
+            previous = previous_profile(profile.xsl_path)
+            try:
+                with open(base + ".json", "w", encoding="utf-8") as f:
+                    json.dump(profile.to_json(), f)
+            except OSError as e:
+                # The panel still shows this run; only the comparison next time is lost.
+                print("XmlTransformer: Could not save the profile:", str(e))
+            prune_profiles(profile.xsl_path)
+        sublime.set_timeout(lambda: self.finish(profile, previous, stderr, output_file), 0)
+
+    def finish(self, profile, previous, stderr, output_file):
+        if profile is None:
+            error_panel = self.window.create_output_panel("xml_transformer_errors")
+            error_panel.run_command("append", {"characters": "XmlTransformer Error:\n" + stderr.strip()})
+            self.window.run_command("show_panel", {"panel": "output.xml_transformer_errors"})
+            return
+        profiles[self.window.id()] = (profile, previous)
+        sort_key = settings.get("profile_sort", "net")
+        show_profile(self.window, profile, sort_key if sort_key in dict(SORT_KEYS) else "net", previous)
+        if os.path.exists(output_file):
+            XmlTransformer_output.open_output(self.window, output_file, self.xsl_path)
+
+class XmlTransformerSortProfileCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        profile, previous = profiles[self.window.id()]
+        self.window.show_quick_panel(
+            [label for key, label in SORT_KEYS],
+            lambda index: index != -1 and show_profile(self.window, profile, SORT_KEYS[index][0], previous)
+        )
+
+    def is_enabled(self):
+        return self.window.id() in profiles
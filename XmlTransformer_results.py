@@ -0,0 +1,155 @@
+import sublime
+import sublime_plugin
+import os
+import shutil
+import hashlib
+import threading
+import collections
+from . import XmlTransformer_stylesheet
+from . import XmlTransformer_catalog
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+CHUNK_SIZE = 1024 * 1024
+MAX_CACHED_DIGESTS = 1024
+
+# path -> ((mtime, size), sha256 hex); files are only re-hashed when they change.
+_digests = collections.OrderedDict()
+# Entry path -> [mtime, size]: read from disk once, then kept current so storing never walks the cache.
+_entries = [None]
+_lock = threading.Lock()
+
+def is_debug():
+    return settings.get("debug", False)
+
+def is_enabled():
+    return settings.get("result_cache_size_mb", 256) > 0
+
+def cache_dir():
+    return os.path.join(sublime.cache_path(), "XmlTransformer", "results")
+
+def file_digest(path):
+    stamp = XmlTransformer_stylesheet.file_stamp(path)
+    with _lock:
+        cached = _digests.get(path)
+        if cached is not None and cached[0] == stamp:
+            _digests.move_to_end(path)
+            return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    result = digest.hexdigest()
+    with _lock:
+        _digests[path] = (stamp, result)
+        while len(_digests) > MAX_CACHED_DIGESTS:
+            _digests.popitem(last=False)
+    return result
+
+def result_key(source, xsl_path, params, saxon_version, output_file, suppress_warnings=True):
+    """Hash of everything that determines the output: source bytes, every stylesheet in the
+    import graph, the resolved parameters, the Saxon version and options, the output method and
+    the resolver catalog.
+
+    None when a stylesheet writes xsl:result-document outputs: only the primary output is cached,
+    so such runs always go to Saxon."""
+    stylesheets = XmlTransformer_stylesheet.stylesheet_files(xsl_path)
+    infos = [XmlTransformer_stylesheet.stylesheet_info(path) for path in stylesheets]
+    if any(info.has_result_documents for info in infos):
+        return None
+    digest = hashlib.sha256()
+    digest.update("source {0}\n".format(file_digest(source)).encode("utf-8"))
+    for path in stylesheets:
+        digest.update("xsl {0}\n".format(file_digest(path)).encode("utf-8"))
+    for name in sorted(params):
+        digest.update("param {0}={1}\n".format(name, params[name]).encode("utf-8"))
+    digest.update("saxon {0} quiet={1}\n".format(saxon_version, bool(suppress_warnings)).encode("utf-8"))
+    digest.update("output {0} {1} {2}\n".format(infos[0].resolved_output_method(), infos[0].output_encoding,
+                                                 os.path.splitext(output_file)[1]).encode("utf-8"))
+    if XmlTransformer_catalog.is_enabled():
+        digest.update("catalog {0}\n".format(file_digest(XmlTransformer_catalog.catalog_file())).encode("utf-8"))
+    return digest.hexdigest()
+
+def entry_path(key):
+    return os.path.join(cache_dir(), key[:2], key)
+
+def restore(key, output_file):
+    """Put the cached output for key at output_file. Returns False on a cache miss."""
+    entry = entry_path(key)
+    if not os.path.exists(entry):
+        return False
+    os.utime(entry, None)  # most recently used
+    with _lock:
+        if _entries[0] is not None and entry in _entries[0]:
+            _entries[0][entry][0] = os.path.getmtime(entry)
+    if not (os.path.exists(output_file) and os.path.getsize(output_file) == os.path.getsize(entry)
+            and file_digest(output_file) == file_digest(entry)):
+        shutil.copyfile(entry, output_file)
+    if is_debug():
+        print("DEBUG: Result cache hit", key, "->", output_file)
+    return True
+
+def store(key, output_file):
+    """Copy a fresh output into the cache, then evict least recently used entries over the cap."""
+    if not os.path.exists(output_file):
+        return
+    entry = entry_path(key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    temp = entry + ".tmp"
+    shutil.copyfile(output_file, temp)
+    os.replace(temp, entry)
+    st = os.stat(entry)
+    with _lock:
+        load_entries()[entry] = [st.st_mtime, st.st_size]
+    evict(settings.get("result_cache_size_mb", 256) * 1024 * 1024)
+
+def load_entries():
+    """The entry index, built by walking the cache on first use. Call with _lock held."""
+    if _entries[0] is None:
+        _entries[0] = dict((path, [mtime, size]) for mtime, size, path in entries())
+    return _entries[0]
+
+def entries():
+    result = []
+    for root, dirs, names in os.walk(cache_dir()):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result.append((st.st_mtime, st.st_size, path))
+    return result
+
+def evict(max_bytes):
+    with _lock:
+        index = load_entries()
+        total = sum(size for mtime, size in index.values())
+        if total <= max_bytes:
+            return
+        cached = sorted((mtime, size, path) for path, (mtime, size) in index.items())
+        evicted = []
+        for mtime, size, path in cached:
+            if total <= max_bytes:
+                break
+            del index[path]
+            evicted.append(path)
+            total -= size
+    for path in evicted:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        if is_debug():
+            print("DEBUG: Result cache evicted", path)
+
+def clear():
+    shutil.rmtree(cache_dir(), ignore_errors=True)
+    with _lock:
+        _digests.clear()
+        _entries[0] = None
+
+class XmlTransformerClearResultCacheCommand(sublime_plugin.ApplicationCommand):
+    def run(self):
+        clear()
+        sublime.status_message("XmlTransformer: Result cache cleared")
@@ -0,0 +1,262 @@
+import sublime
+import os
+import re
+import time
+import shutil
+import tempfile
+import collections
+import threading
+import multiprocessing
+from urllib.request import pathname2url
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from . import XmlTransformer_build
+from . import XmlTransformer_worker
+from . import XmlTransformer_catalog
+from . import XmlTransformer_jobs
+from . import XmlTransformer_output
+from . import XmlTransformer_stylesheet
+from .XmlTransformer_build import settings, is_debug, get_message
+
+XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>\s*')
+DOCUMENT_ELEMENT = re.compile(r'^\s*(?:<!--.*?-->\s*|<\?.*?\?>\s*|<!DOCTYPE[^>]*>\s*)*<([^\s/>]+)([^>]*?)(/?)>', re.DOTALL)
+NAMESPACE_DECLARATION = re.compile(r'\sxmlns(?::[^\s=]+)?\s*=\s*(["\']).*?\1', re.DOTALL)
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def matches(tag, record):
+    return tag == record or local_name(tag) == record
+
+def guess_record_element(path, sample=50):
+    """Most common local name among the first children of the document element."""
+    counts = collections.Counter()
+    depth = 0
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        depth += 1 if event == "start" else -1
+        if event == "start" and depth == 2:
+            counts[local_name(elem.tag)] += 1
+            if sum(counts.values()) >= sample:
+                break
+    return counts.most_common(1)[0][0] if counts else None
+
+def split_records(path, record, records_per_chunk, skipped=None):
+    """Yield (index, chunk) elements: a copy of the document element holding up to records_per_chunk records.
+
+    Elements are dropped from the source tree as soon as they are moved into a chunk, so memory is bounded
+    by one chunk. Children of the document element that are not records are left out and counted by local
+    name in the skipped Counter."""
+    root = None
+    chunk = None
+    index = 0
+    depth = 0
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = elem
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if matches(elem.tag, record):
+            if chunk is None:
+                chunk = ET.Element(root.tag, root.attrib)
+            chunk.append(elem)
+        elif skipped is not None:
+            skipped[local_name(elem.tag)] += 1
+        del root[:]
+        if chunk is not None and len(chunk) >= records_per_chunk:
+            yield index, chunk
+            index += 1
+            chunk = None
+    if chunk is not None:
+        yield index, chunk
+
+def unwrap(text):
+    """The content of text's document element, without the XML declaration or the element's own tags."""
+    text = XML_DECLARATION.sub('', text, count=1)
+    match = DOCUMENT_ELEMENT.match(text)
+    if not match:
+        return text
+    if match.group(3):
+        return ''
+    end = text.rfind('</')
+    return text[match.end():end] if end >= match.end() else text[match.end():]
+
+def document_element(path):
+    """(QName, namespace declarations) of path's document element as written, from its first 64K."""
+    with open(path, "rb") as f:
+        data = f.read(64 * 1024)
+    text = XML_DECLARATION.sub('', data.decode(XmlTransformer_output.declared_encoding(data), "replace").lstrip("\ufeff"), count=1)
+    match = DOCUMENT_ELEMENT.match(text)
+    if not match:
+        return None, ""
+    return match.group(1), "".join(m.group(0) for m in NAMESPACE_DECLARATION.finditer(match.group(2)))
+
+def merge(outputs, output_file, wrapper, declarations=""):
+    """Concatenate chunk outputs in order, one chunk in memory at a time.
+
+    Each output is decoded with the encoding it declares (as set by xsl:output) and the merged file is
+    written in the first output's encoding. Without a wrapper every output after the first loses its XML
+    declaration; with one, each output's document element is unwrapped and everything goes under
+    <wrapper declarations>. The merged file only replaces output_file once it is complete."""
+    temp = output_file + ".part"
+    out = None
+    try:
+        for index, path in enumerate(outputs):
+            with open(path, "rb") as f:
+                data = f.read()
+            encoding = XmlTransformer_output.declared_encoding(data)
+            text = data.decode(encoding).lstrip("\ufeff")
+            if out is None:
+                out = open(temp, "w", encoding=encoding, errors="xmlcharrefreplace", newline="")
+                if wrapper:
+                    out.write('<?xml version="1.0" encoding="{0}"?>\n<{1}{2}>'.format(encoding, wrapper, declarations))
+            if wrapper:
+                out.write(unwrap(text))
+            else:
+                out.write(text if index == 0 else XML_DECLARATION.sub('', text, count=1))
+        if out is not None:
+            if wrapper:
+                out.write('</{0}>\n'.format(wrapper))
+            out.close()
+            os.replace(temp, output_file)
+    except:
+        if out is not None:
+            out.close()
+            os.remove(temp)
+        raise
+
+def split_threads():
+    threads = settings.get("split_threads", 0)
+    return threads if threads and threads > 0 else multiprocessing.cpu_count()
+
+class XmlTransformerSplitCommand(XmlTransformer_build.XmlTransformerBuildCommand):
+    """Split a large record-oriented source into chunks, transform them in parallel and merge the outputs.
+
+    Picks the XSL and params with the build command's panels; only the final step differs."""
+
+    def run(self, record=None, **kwargs):
+        self.record = record or settings.get("split_record_element", "")
+        XmlTransformer_build.XmlTransformerBuildCommand.run(self, record=record, **kwargs)
+
+    def start_transformation(self, param_file):
+        if self.record:
+            self.on_record_entered(self.record, param_file)
+            return
+        try:
+            guess = guess_record_element(self.xml_path) or ""
+        except ET.ParseError:
+            guess = ""
+        self.window.show_input_panel(
+            get_message("enter_split_record"),
+            guess,
+            lambda record: self.on_record_entered(record.strip(), param_file),
+            None,
+            None
+        )
+
+    def on_record_entered(self, record, param_file):
+        if not record:
+            return
+        param_values = {}
+        if param_file:
+            param_values = self.parse_xml_param_file(param_file)
+            if param_values is None:
+                return
+        output_file = self.get_output_file(self.xml_path)
+        suppress_warnings = settings.get("suppress_warnings", True)
+        label = "split of " + XmlTransformer_jobs.label(self.xml_path, self.xsl_path)
+        XmlTransformer_jobs.submit_work(self.window.id(), label, lambda job: self.run_split(record, output_file, param_values, suppress_warnings, job))
+
+    def run_split(self, record, output_file, param_values, suppress_warnings, job):
+        started = time.time()
+        records_per_chunk = max(1, settings.get("split_records_per_chunk", 10000))
+        wrapper = settings.get("split_wrapper", "")
+        worker = None
+        XmlTransformer_catalog.prepare(xsl=self.xsl_path)
+        if settings.get("use_worker", True):
+            worker = XmlTransformer_worker.get_worker(self.java_bin, self.get_classpath())
+        temp_dir = tempfile.mkdtemp(prefix="xmltransformer-split-")
+        threads = split_threads()
+        # Chunks waiting for a thread hold their records in memory, so only a few may be queued.
+        slots = threading.BoundedSemaphore(threads * 2)
+        extension = os.path.splitext(output_file)[1]
+        futures = []
+        outputs = []
+        failures = []
+        skipped = collections.Counter()
+        done = [0]
+        lock = threading.Lock()
+        # Chunks live in a temporary directory; relative URIs (document(@href, .), xsl:result-document) still
+        # resolve against the original source and output.
+        base_uri = "file:" + pathname2url(os.path.abspath(self.xml_path))
+        base_output_uri = "file:" + pathname2url(os.path.abspath(output_file))
+
+        def transform_chunk(index, source, output):
+            try:
+                ok, error_text = self.transform_blocking(worker, source, output, param_values, suppress_warnings, job,
+                                                         base_uri=base_uri, base_output_uri=base_output_uri)
+            finally:
+                os.remove(source)
+                slots.release()
+            with lock:
+                done[0] += 1
+                if not ok:
+                    failures.append((index, error_text))
+                message = get_message("split_progress", done[0], len(outputs), len(failures))
+            sublime.set_timeout(lambda: sublime.status_message(message), 0)
+
+        try:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                for index, chunk in split_records(self.xml_path, record, records_per_chunk, skipped):
+                    if job.cancelled:
+                        failures.append((None, "Cancelled"))
+                        break
+                    source = os.path.join(temp_dir, "chunk-{0:06d}.xml".format(index))
+                    output = os.path.join(temp_dir, "chunk-{0:06d}-output{1}".format(index, extension))
+                    slots.acquire()
+                    ET.ElementTree(chunk).write(source, encoding="utf-8", xml_declaration=True)
+                    outputs.append(output)
+                    futures.append(pool.submit(transform_chunk, index, source, output))
+            for future in futures:
+                future.result()
+            if not outputs:
+                failures.append((None, get_message("no_split_records", record)))
+            elif not failures:
+                declarations = ""
+                if not wrapper and len(outputs) > 1 and self.output_method() == "xml":
+                    # Several XML documents concatenated are not well-formed; put them back under the source's root.
+                    wrapper, declarations = document_element(self.xml_path)
+                merge(outputs, output_file, wrapper, declarations)
+        except (ET.ParseError, OSError, UnicodeError) as e:
+            failures.append((None, str(e)))
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        elapsed = time.time() - started
+        if is_debug():
+            print("DEBUG: Split transform of %s: %d chunks in %.3fs" % (self.xml_path, len(outputs), elapsed))
+        sublime.set_timeout(lambda: self.show_result(output_file, len(outputs), sorted(failures, key=lambda f: f[0] or 0), elapsed, skipped), 0)
+
+    def output_method(self):
+        info = XmlTransformer_stylesheet.stylesheet_info(self.xsl_path)
+        return info.resolved_output_method()
+
+    def show_result(self, output_file, chunks, failures, elapsed, skipped):
+        if not failures:
+            if skipped:
+                names = ", ".join("{0} <{1}>".format(count, name) for name, count in skipped.most_common())
+                sublime.status_message(get_message("split_summary_skipped", chunks, "%.1f" % elapsed, names))
+            else:
+                sublime.status_message(get_message("split_summary", chunks, "%.1f" % elapsed))
+            XmlTransformer_output.open_output(self.window, output_file, self.xsl_path)
+            return
+        lines = ["XmlTransformer Error:"]
+        for index, error_text in failures:
+            if index is not None:
+                lines.append("Chunk {0}:".format(index + 1))
+            lines.extend("  " + line for line in (error_text or "unknown error").splitlines())
+        error_panel = self.window.create_output_panel("xml_transformer_errors")
+        error_panel.run_command("append", {"characters": "\n".join(lines)})
+        self.window.run_command("show_panel", {"panel": "output.xml_transformer_errors"})
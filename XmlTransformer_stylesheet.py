@@ -0,0 +1,150 @@
+import os
+import hashlib
+import threading
+import collections
+import xml.parsers.expat
+from urllib.parse import urlparse, unquote
+from urllib.request import url2pathname
+
+XSL_NS = "http://www.w3.org/1999/XSL/Transform"
+
+MAX_CACHED_INFOS = 256
+
+# path -> ((mtime, size), StylesheetInfo); a file is only re-read when its stamp changes.
+_info_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+class StylesheetInfo(object):
+    """Everything the build needs from a stylesheet, gathered in one parse."""
+
+    def __init__(self, path):
+        self.path = path
+        self.well_formed = False
+        self.error = None
+        self.io_error = False
+        self.params = []
+        self.output_method = None
+        self.output_encoding = None
+        self.imports = []
+        self.has_html = False
+        self.has_result_documents = False
+
+    @property
+    def param_names(self):
+        return [name for name, default in self.params]
+
+    def resolved_output_method(self):
+        """xsl:output method if it is xml/html/text, else html when the stylesheet builds an html element."""
+        if self.output_method in ("xml", "html", "text"):
+            return self.output_method
+        return "html" if self.has_html else "xml"
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def read_stylesheet_info(path):
+    """Parse the stylesheet once with expat, without building a tree.
+
+    Only the top-level declarations are recorded, but the whole file is read because
+    well-formedness can only be decided at the end; callers share the memoized result."""
+    info = StylesheetInfo(path)
+    depth = [0]
+    param = [None]
+    parser = xml.parsers.expat.ParserCreate(namespace_separator=" ")
+    parser.buffer_text = True
+
+    def start(name, attrs):
+        depth[0] += 1
+        if name == "html" or (name == XSL_NS + " element" and attrs.get("name") == "html"):
+            info.has_html = True
+        elif name == XSL_NS + " result-document":
+            info.has_result_documents = True
+        if depth[0] != 2:
+            return
+        if name == XSL_NS + " param" and "name" in attrs:
+            param[0] = [attrs["name"], attrs.get("select"), []]
+        elif name == XSL_NS + " output":
+            if "method" in attrs:
+                info.output_method = attrs["method"].lower()
+            info.output_encoding = attrs.get("encoding")
+        elif name in (XSL_NS + " import", XSL_NS + " include") and "href" in attrs:
+            info.imports.append(attrs["href"])
+
+    def end(name):
+        if depth[0] == 2 and param[0] is not None:
+            param_name, select, text = param[0]
+            info.params.append((param_name, select if select is not None else "".join(text).strip()))
+            param[0] = None
+        depth[0] -= 1
+
+    def text(data):
+        if param[0] is not None:
+            param[0][2].append(data)
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text
+    try:
+        with open(path, "rb") as f:
+            parser.ParseFile(f)
+        info.well_formed = True
+    except xml.parsers.expat.ExpatError as e:
+        info.error = "{0}: line {1}, column {2}".format(xml.parsers.expat.ErrorString(e.code), e.lineno, e.offset)
+    except OSError as e:
+        info.io_error = True
+        info.error = str(e)
+    return info
+
+def stylesheet_info(path):
+    """Memoized read_stylesheet_info, keyed by path and (mtime, size)."""
+    stamp = file_stamp(path)
+    with _cache_lock:
+        cached = _info_cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            _info_cache.move_to_end(path)
+            return cached[1]
+    info = read_stylesheet_info(path)
+    with _cache_lock:
+        _info_cache[path] = (stamp, info)
+        while len(_info_cache) > MAX_CACHED_INFOS:
+            _info_cache.popitem(last=False)
+    return info
+
+def imports_of(path):
+    return stylesheet_info(path).imports
+
+def resolve_href(base_path, href):
+    """Resolve an import href against the importing file. Returns None for non-file URIs."""
+    parsed = urlparse(href)
+    if parsed.scheme == "file":
+        return os.path.normpath(url2pathname(unquote(parsed.path)))
+    if parsed.scheme and len(parsed.scheme) > 1:
+        return None  # http:, urn:, ... (a one-letter scheme is a Windows drive)
+    return os.path.normpath(os.path.join(os.path.dirname(base_path), url2pathname(unquote(href))))
+
+def stylesheet_files(xsl_path):
+    """The stylesheet followed by every file it transitively imports or includes."""
+    root = os.path.normpath(os.path.abspath(xsl_path))
+    files = [root]
+    seen = set(files)
+    index = 0
+    while index < len(files):
+        current = files[index]
+        index += 1
+        for href in imports_of(current):
+            resolved = resolve_href(current, href)
+            if resolved and resolved not in seen:
+                seen.add(resolved)
+                files.append(resolved)
+    return files
+
+def stylesheet_cache_key(xsl_path):
+    """A key that changes whenever the stylesheet or anything it imports changes."""
+    digest = hashlib.sha1()
+    for path in stylesheet_files(xsl_path):
+        digest.update("{0}|{1}\n".format(path, file_stamp(path)).encode("utf-8"))
+    return digest.hexdigest()
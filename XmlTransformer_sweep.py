@@ -0,0 +1,119 @@
+import sublime
+import os
+import re
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from . import XmlTransformer_build
+from . import XmlTransformer_stylesheet
+from . import XmlTransformer_worker
+from . import XmlTransformer_catalog
+from . import XmlTransformer_jobs
+from .XmlTransformer_build import settings, is_debug, get_message
+
+def sweep_threads():
+    threads = settings.get("sweep_threads", 0)
+    return threads if threads and threads > 0 else multiprocessing.cpu_count()
+
+def sweep_output_file(output_file, name):
+    """<xml_file>-output.<set name>.<ext>, with the set name reduced to safe file name characters."""
+    base, extension = os.path.splitext(output_file)
+    return "{0}.{1}{2}".format(base, re.sub(r"[^\w.-]+", "_", name), extension)
+
+def sweep_results(job, sets):
+    """(name, output, ok, error_text, ms) per set of a finished SWEEP job."""
+    finished = {}
+    for event, fields in job.info:
+        if event == "SET" and len(fields) == 3:
+            finished[int(fields[0])] = (fields[1] == "0", int(fields[2]))
+    results = []
+    for index, (name, output, param_values) in enumerate(sets):
+        label = "[{0}] ".format(name)
+        if index in finished:
+            ok, ms = finished[index]
+            error_text = "\n".join(error[len(label):] for error in job.errors if error.startswith(label))
+        else:
+            # The whole request failed before this set ran, e.g. on a stylesheet or source error.
+            ok, ms, error_text = False, None, job.error_text()
+        results.append((name, output, ok, error_text, ms))
+    return results
+
+class XmlTransformerSweepCommand(XmlTransformer_build.XmlTransformerBuildCommand):
+    """Transform the current file once per named parameter set of a param file, in a single job.
+
+    With the worker, the stylesheet is compiled and the source parsed once for all sets."""
+
+    def on_xsl_selected(self, xsl_path):
+        if not os.path.exists(xsl_path):
+            sublime.error_message(get_message("invalid_xsl_path", xsl_path))
+            return
+        self.xsl_path = xsl_path
+        xsl_info = XmlTransformer_stylesheet.stylesheet_info(xsl_path)
+        self.params = xsl_info.param_names if xsl_info.well_formed else []
+        # A sweep always needs a param file holding the sets.
+        self.show_param_file_panel(self.working_dir)
+
+    def start_transformation(self, param_file):
+        param_sets = self.parse_param_sets(param_file)
+        if param_sets is None:
+            return
+        if not param_sets:
+            sublime.error_message(get_message("no_param_sets", param_file))
+            return
+        output_file = self.get_output_file(self.xml_path)
+        sets = [(name, sweep_output_file(output_file, name), param_values) for name, param_values in param_sets]
+        if len(set(output for name, output, param_values in sets)) < len(sets):
+            sublime.error_message(get_message("param_parse_failed", param_file, "two set names map to the same output file name"))
+            return
+        sublime.status_message(get_message("sweeping", len(sets), os.path.basename(self.xml_path)))
+        suppress_warnings = settings.get("suppress_warnings", True)
+        label = "sweep of {0} sets over {1}".format(len(sets), XmlTransformer_jobs.label(self.xml_path, self.xsl_path))
+        XmlTransformer_jobs.submit_work(self.window.id(), label, lambda job: self.run_sweep(sets, suppress_warnings, job))
+
+    def run_sweep(self, sets, suppress_warnings, job):
+        started = time.time()
+        results = None
+        timings = {}
+        XmlTransformer_catalog.prepare([self.xml_path], xsl=self.xsl_path)
+        if settings.get("use_worker", True):
+            worker = XmlTransformer_worker.get_worker(self.java_bin, self.get_classpath())
+            if worker is not None:
+                try:
+                    worker_job = worker.sweep(self.xml_path, self.xsl_path, sets, sweep_threads(), quiet=suppress_warnings)
+                    XmlTransformer_jobs.attach(job.id, worker_job=worker_job)
+                    worker_job.finished.wait()
+                    results = sweep_results(worker_job, sets)
+                    timings = worker_job.timings
+                except XmlTransformer_worker.WorkerError as e:
+                    if is_debug():
+                        print("DEBUG: Falling back to one-shot Saxon runs for the sweep:", str(e))
+        if results is None:
+            with ThreadPoolExecutor(max_workers=sweep_threads()) as pool:
+                futures = [pool.submit(self.transform_blocking, None, self.xml_path, output, param_values, suppress_warnings, job)
+                           for name, output, param_values in sets]
+                results = [(name, output) + future.result() + (None,) for (name, output, param_values), future in zip(sets, futures)]
+        elapsed = time.time() - started
+        if is_debug():
+            print("DEBUG: Sweep of %s over %d sets in %.3fs" % (self.xml_path, len(sets), elapsed))
+        sublime.set_timeout(lambda: self.show_summary(results, timings, elapsed), 0)
+
+    def show_summary(self, results, timings, elapsed):
+        failures = [r for r in results if not r[2]]
+        lines = [
+            "XmlTransformer sweep: {0} with {1}".format(self.xml_path, self.xsl_path),
+            get_message("sweep_summary", len(results) - len(failures), len(failures), "%.1f" % elapsed)
+        ]
+        if timings:
+            lines.append("Shared: compile {0} ms, parse {1} ms".format(timings.get("compile", "?"), timings.get("parse", "?")))
+        lines.append("")
+        for name, output, ok, error_text, ms in results:
+            took = "" if ms is None else " ({0} ms)".format(ms)
+            if ok:
+                lines.append("  {0}: {1}{2}".format(name, output, took))
+            else:
+                lines.append("  {0}: FAILED{1}".format(name, took))
+                lines.extend("    " + line for line in (error_text or "unknown error").splitlines())
+        panel = self.window.create_output_panel("xml_transformer_sweep")
+        panel.run_command("append", {"characters": "\n".join(lines)})
+        self.window.run_command("show_panel", {"panel": "output.xml_transformer_sweep"})
+        sublime.status_message(lines[1])
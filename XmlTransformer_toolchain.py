@@ -0,0 +1,138 @@
+import sublime
+import sublime_plugin
+import os
+import json
+import shutil
+import subprocess
+import threading
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+SAXON_VERSION = "12.9"
+REQUIRED_JARS = ["Saxon-HE-12.9.jar", "xmlresolver-6.0.6.jar", "xmlresolver-6.0.6-data.jar"]
+MACOS_JAVA_PATHS = [
+    "/opt/homebrew/opt/openjdk@11/bin/java",  # Apple Silicon
+    "/usr/local/opt/openjdk@11/bin/java"      # Intel
+]
+
+_toolchain = None
+_lock = threading.Lock()
+
+def is_debug():
+    return settings.get("debug", False)
+
+class Toolchain(object):
+    """The resolved Java binary, its version and the Saxon classpath, shared by every command."""
+
+    def __init__(self, java_bin, jar_path, java_version):
+        self.system = sublime.platform()
+        self.java_bin = java_bin
+        self.jar_path = jar_path
+        self.java_version = java_version
+        self.saxon_version = SAXON_VERSION
+        self.classpath = [os.path.normpath(os.path.join(jar_path, jar)) for jar in REQUIRED_JARS]
+        self.cp_separator = ";" if self.system == "windows" else ":"
+        self.java_available = java_version is not None
+        self.jars_available = all(os.path.exists(path) for path in self.classpath)
+
+def platform_defaults():
+    system = sublime.platform()
+    if system == "windows":
+        return "java", os.path.join(os.environ["ProgramFiles"], "Saxon")  # Windows typically has java in PATH
+    if system == "osx":
+        for path in MACOS_JAVA_PATHS:
+            if os.path.exists(path):
+                return path, os.path.expanduser("~/Library/Saxon")
+        return "java", os.path.expanduser("~/Library/Saxon")  # Fallback to PATH
+    return "java", "/usr/local/lib/saxon"
+
+def fingerprint(java_bin, classpath):
+    """Paths, sizes and mtimes of the Java binary and JARs; a changed install changes the fingerprint."""
+    entries = []
+    resolved = shutil.which(java_bin)
+    for path in [os.path.realpath(resolved) if resolved else java_bin] + list(classpath):
+        try:
+            st = os.stat(path)
+            entries.append([path, st.st_size, st.st_mtime])
+        except OSError:
+            entries.append([path, None, None])
+    return entries
+
+def probe_java_version(java_bin):
+    creation_flags = 0
+    if sublime.platform() == "windows":
+        creation_flags = 0x08000000  # subprocess.CREATE_NO_WINDOW
+    process = subprocess.Popen([java_bin, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creation_flags)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, [java_bin, "-version"])
+    # java -version prints to stderr
+    return (stderr or stdout).decode("utf-8", "replace").strip().split("\n")[0]
+
+def cache_file():
+    return os.path.join(sublime.cache_path(), "XmlTransformer", "toolchain.json")
+
+def load_cached():
+    try:
+        with open(cache_file(), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_cached(data):
+    try:
+        os.makedirs(os.path.dirname(cache_file()), exist_ok=True)
+        with open(cache_file(), "w", encoding="utf-8") as f:
+            json.dump(data, f)
+    except OSError as e:
+        if is_debug():
+            print("DEBUG: Could not persist toolchain cache:", str(e))
+
+def resolve(force=False):
+    """Resolve the toolchain, spawning `java -version` only when the install changed.
+
+    Blocks on the probe, so call it off the UI thread (see resolve_async)."""
+    global _toolchain
+    with _lock:
+        if _toolchain is not None and not force:
+            return _toolchain
+        java_bin, jar_path = platform_defaults()
+        classpath = [os.path.normpath(os.path.join(jar_path, jar)) for jar in REQUIRED_JARS]
+        current = fingerprint(java_bin, classpath)
+        cached = load_cached()
+        if not force and cached and cached.get("fingerprint") == current:
+            java_version = cached.get("java_version")
+            if is_debug():
+                print("DEBUG: Reusing cached toolchain:", java_bin, java_version)
+        else:
+            try:
+                java_version = probe_java_version(java_bin)
+                if is_debug():
+                    print("DEBUG: Java found: %s" % java_version)
+            except (subprocess.CalledProcessError, OSError) as e:
+                if is_debug():
+                    print("DEBUG: Java not found:", str(e))
+                java_version = None
+            save_cached({"fingerprint": current, "java_bin": java_bin, "java_version": java_version})
+        _toolchain = Toolchain(java_bin, jar_path, java_version)
+        return _toolchain
+
+def current():
+    """The resolved toolchain, or None while detection is still running."""
+    return _toolchain
+
+def resolve_async(callback=None, force=False):
+    """Resolve in the background and call callback(toolchain) on the UI thread."""
+    def task():
+        toolchain = resolve(force)
+        if callback:
+            sublime.set_timeout(lambda: callback(toolchain), 0)
+    sublime.set_timeout_async(task, 0)
+
+class XmlTransformerDetectToolchainCommand(sublime_plugin.ApplicationCommand):
+    def run(self):
+        def report(toolchain):
+            sublime.status_message("XmlTransformer: Java {0}, JARs {1}".format(
+                toolchain.java_version or "not found",
+                "found" if toolchain.jars_available else "missing in " + toolchain.jar_path))
+        resolve_async(report, force=True)
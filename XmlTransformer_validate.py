@@ -0,0 +1,103 @@
+import os
+import threading
+import collections
+import time
+import xml.parsers.expat
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 0.25
+MAX_CACHED_RESULTS = 256
+
+# path -> ((mtime, size), CheckResult); unchanged files are never re-scanned.
+_results = collections.OrderedDict()
+_results_lock = threading.Lock()
+
+class CheckResult(object):
+    def __init__(self, path, well_formed, error=None, io_error=False, cancelled=False):
+        self.path = path
+        self.well_formed = well_formed
+        self.error = error
+        self.io_error = io_error
+        self.cancelled = cancelled
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def cached_result(path, stamp):
+    with _results_lock:
+        cached = _results.get(path)
+        if cached is not None and cached[0] == stamp:
+            _results.move_to_end(path)
+            return cached[1]
+    return None
+
+def remember(path, stamp, result):
+    with _results_lock:
+        _results[path] = (stamp, result)
+        while len(_results) > MAX_CACHED_RESULTS:
+            _results.popitem(last=False)
+
+class SourceCheck(threading.Thread):
+    """Well-formedness check that feeds expat fixed-size chunks, so memory stays flat.
+
+    on_progress(percent) and on_done(CheckResult) are called from the checking thread."""
+
+    def __init__(self, path, on_done, on_progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.chunk_size = chunk_size
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        stamp = file_stamp(self.path)
+        result = self.check(stamp[1] if stamp else 0)
+        if not result.cancelled and not result.io_error:
+            remember(self.path, stamp, result)
+        self.on_done(result)
+
+    def check(self, total):
+        # Namespace processing on, as in ElementTree, so undeclared prefixes are reported too.
+        parser = xml.parsers.expat.ParserCreate(namespace_separator="}")
+        done = 0
+        last_report = time.time()
+        try:
+            with open(self.path, "rb") as f:
+                while True:
+                    if self.cancelled.is_set():
+                        return CheckResult(self.path, False, cancelled=True)
+                    chunk = f.read(self.chunk_size)
+                    parser.Parse(chunk, not chunk)
+                    if not chunk:
+                        break
+                    done += len(chunk)
+                    if self.on_progress and total and time.time() - last_report >= PROGRESS_INTERVAL:
+                        last_report = time.time()
+                        self.on_progress(min(99, done * 100 // total))
+        except xml.parsers.expat.ExpatError as e:
+            error = "{0}: line {1}, column {2}".format(xml.parsers.expat.ErrorString(e.code), e.lineno, e.offset)
+            return CheckResult(self.path, False, error)
+        except OSError as e:
+            return CheckResult(self.path, False, str(e), io_error=True)
+        return CheckResult(self.path, True)
+
+def check_source(path, on_done, on_progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Check path in the background, or call on_done at once when the file is unchanged.
+
+    Returns the running SourceCheck (which can be cancelled), or None for a cache hit."""
+    cached = cached_result(path, file_stamp(path))
+    if cached is not None:
+        on_done(cached)
+        return None
+    check = SourceCheck(path, on_done, on_progress, chunk_size)
+    check.start()
+    return check
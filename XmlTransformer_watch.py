@@ -0,0 +1,116 @@
+import sublime
+import sublime_plugin
+import os
+import itertools
+from . import XmlTransformer_build
+from . import XmlTransformer_exec
+from . import XmlTransformer_jobs
+from . import XmlTransformer_stylesheet
+from .XmlTransformer_build import settings, is_debug, get_message
+
+# Window ID -> {source realpath -> Binding}
+bindings = {}
+run_ids = itertools.count(1)
+
+class Binding(object):
+    """An (XML, XSL, params) triple re-transformed whenever one of its files is saved.
+
+    generation debounces saves; run_id is the run in flight (from source validation until the transformation
+    finishes), pending a newer one waiting for it."""
+
+    def __init__(self, window, xml_path, xsl_path, param_file):
+        self.window = window
+        self.xml_path = xml_path
+        self.xsl_path = xsl_path
+        self.param_file = param_file
+        self.generation = 0
+        self.run_id = None
+        self.pending = False
+
+    def dependencies(self):
+        paths = [self.xml_path] + XmlTransformer_stylesheet.stylesheet_files(self.xsl_path)
+        if self.param_file:
+            paths.append(self.param_file)
+        return set(os.path.realpath(path) for path in paths)
+
+def schedule(binding):
+    binding.generation += 1
+    generation = binding.generation
+    sublime.set_timeout(lambda: fire(binding, generation), settings.get("watch_debounce_ms", 300))
+
+def fire(binding, generation):
+    if generation != binding.generation:
+        return  # a later save restarted the debounce
+    if binding.run_id is not None:
+        # Only the newest run matters: stop the stale one and start again when it has finished.
+        binding.pending = True
+        for job in XmlTransformer_jobs.find(lambda job: job.run_id == binding.run_id):
+            XmlTransformer_jobs.cancel(job)
+            if is_debug():
+                print("DEBUG: Watch cancelled stale run", binding.run_id)
+        return
+    start(binding)
+
+def start(binding):
+    command = XmlTransformer_build.XmlTransformerBuildCommand(binding.window)
+    if not command.use_toolchain(lambda: start(binding)):
+        return
+    # Busy from here on, so saves during the source check wait for this run instead of starting another.
+    run_id = "watch-{0}".format(next(run_ids))
+    binding.run_id = run_id
+    command.xml_path = binding.xml_path
+    command.working_dir = os.path.dirname(binding.xml_path)
+    command.xsl_path = binding.xsl_path
+    if not command.validate_stylesheet(XmlTransformer_stylesheet.stylesheet_info(binding.xsl_path)):
+        finished(binding, run_id)
+        return
+    if binding.param_file and command.parse_xml_param_file(binding.param_file) is None:
+        finished(binding, run_id)
+        return
+
+    def dispatch():
+        if is_debug():
+            print("DEBUG: Watch transforming %s (%s)" % (binding.xml_path, run_id))
+        command.run_id = run_id
+        XmlTransformer_exec.on_finished(run_id, lambda: finished(binding, run_id))
+        command.start_transformation(binding.param_file)
+    command.validate_xml_file(binding.xml_path, dispatch, lambda: finished(binding, run_id))
+
+def finished(binding, run_id):
+    if binding.run_id != run_id:
+        return
+    binding.run_id = None
+    if binding.pending and binding.xml_path in bindings.get(binding.window.id(), {}):
+        binding.pending = False
+        start(binding)
+
+class XmlTransformerWatchCommand(sublime_plugin.WindowCommand):
+    """Bind a source to a stylesheet and params, transform now and again on every relevant save.
+
+    Run by xml_transformer_build with {"watch": true} once the panels have picked the XSL and params."""
+
+    def run(self, xml, xsl, param_file=None):
+        xml_path = os.path.realpath(xml)
+        binding = Binding(self.window, xml_path, xsl, param_file)
+        bindings.setdefault(self.window.id(), {})[xml_path] = binding
+        sublime.status_message(get_message("watching", os.path.basename(xml_path), os.path.basename(xsl)))
+        start(binding)
+
+class XmlTransformerStopWatchingCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        stopped = bindings.pop(self.window.id(), {})
+        sublime.status_message(get_message("watch_stopped", len(stopped)))
+
+    def is_enabled(self):
+        return bool(bindings.get(self.window.id()))
+
+class XmlTransformerWatchListener(sublime_plugin.EventListener):
+    def on_post_save(self, view):
+        window = view.window()
+        path = view.file_name()
+        if window is None or path is None or not bindings.get(window.id()):
+            return
+        path = os.path.realpath(path)
+        for binding in list(bindings[window.id()].values()):
+            if path in binding.dependencies():
+                schedule(binding)
@@ -0,0 +1,420 @@
+import sublime
+import sublime_plugin
+import os
+import signal
+import subprocess
+import threading
+import itertools
+import hashlib
+import shutil
+import time
+import multiprocessing
+from . import XmlTransformer_stylesheet
+from . import XmlTransformer_jvm
+from . import XmlTransformer_catalog
+
+settings = sublime.load_settings("XmlTransformer.sublime-settings")
+
+WORKER_CLASS = "XmlTransformerWorker"
+WORKER_SOURCE = "Packages/XmlTransformer/java/XmlTransformerWorker.java"
+MAX_START_FAILURES = 3
+
+def is_debug():
+    return settings.get("debug", False)
+
+def creation_flags():
+    if sublime.platform() == "windows":
+        return 0x08000000  # subprocess.CREATE_NO_WINDOW
+    return 0
+
+def kill_tree(process):
+    """Kill a process started with start_new_session=True together with anything it started."""
+    if process.poll() is not None:
+        return
+    if sublime.platform() == "windows":
+        subprocess.call(["taskkill", "/T", "/F", "/PID", str(process.pid)],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=creation_flags())
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        process.kill()
+
+def escape_field(value):
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def unescape_field(value):
+    result = []
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c == "\\" and i + 1 < len(value):
+            i += 1
+            c = {"t": "\t", "n": "\n", "r": "\r"}.get(value[i], value[i])
+        result.append(c)
+        i += 1
+    return "".join(result)
+
+class WorkerError(Exception):
+    pass
+
+class WorkerJob(object):
+    """Events collected for one request sent to the worker."""
+
+    def __init__(self, request_id, on_done=None, on_chunk=None):
+        self.id = request_id
+        self.returncode = None
+        self.errors = []
+        self.messages = []
+        self.timings = {}
+        self.info = []
+        self.on_done = on_done
+        self.on_chunk = on_chunk
+        self.process = None
+        self.finished = threading.Event()
+
+    def error_text(self):
+        return "\n".join(self.errors)
+
+    def handle(self, event, fields):
+        if event == "ERR":
+            self.errors.extend(fields)
+        elif event == "MSG":
+            self.messages.extend(fields)
+        elif event == "TIME" and len(fields) == 2:
+            self.timings[fields[0]] = int(fields[1])
+        elif event == "CHUNK":
+            if self.on_chunk:
+                self.on_chunk("".join(fields))
+        elif event == "DONE":
+            self.finish(int(fields[0]) if fields else 1)
+        else:
+            self.info.append((event, fields))
+
+    def finish(self, returncode):
+        if self.finished.is_set():
+            return
+        self.returncode = returncode
+        self.finished.set()
+        if self.on_done:
+            self.on_done(self)
+
+class SaxonWorker(object):
+    """A warm Saxon JVM that serves transform requests over its stdin/stdout pipes."""
+
+    def __init__(self, java_bin, classpath, launch_cmd):
+        self.java_bin = java_bin
+        self.classpath = classpath
+        self.launch_cmd = launch_cmd
+        self.process = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.last_used = time.time()
+        self.idle_timer = None
+        self.saxon_version = None
+        self.catalog_version = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        if is_debug():
+            print("DEBUG: Starting Saxon worker:", self.launch_cmd)
+        self.process = subprocess.Popen(
+            self.launch_cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            creationflags=creation_flags()
+        )
+        process = self.process
+        threading.Thread(target=self._read_events, args=(process,), daemon=True).start()
+        threading.Thread(target=self._drain_stderr, args=(process,), daemon=True).start()
+        try:
+            job = self._send("PING", [], timeout=settings.get("worker_start_timeout", 30))
+        except WorkerError:
+            self.stop()
+            raise
+        if job.returncode != 0:
+            self.stop()
+            raise WorkerError(job.error_text() or "Saxon worker did not answer")
+        for event, fields in job.info:
+            if event == "PONG" and len(fields) > 1:
+                self.saxon_version = fields[1]
+        if is_debug():
+            print("DEBUG: Saxon worker ready, Saxon version:", self.saxon_version)
+
+    def stop(self):
+        with self.lock:
+            process = self.process
+            self.process = None
+            if self.idle_timer:
+                self.idle_timer.cancel()
+                self.idle_timer = None
+        if process is None or process.poll() is not None:
+            return
+        try:
+            process.stdin.write(b"QUIT\t0\n")
+            process.stdin.flush()
+            process.wait(timeout=2)
+        except Exception:
+            process.kill()
+        if is_debug():
+            print("DEBUG: Saxon worker stopped")
+
+    def ping(self, timeout=5):
+        try:
+            return self._send("PING", [], timeout=timeout).returncode == 0
+        except WorkerError:
+            return False
+
+    def cancel(self, job):
+        """Ask the worker to abandon one request; it still ends with DONE, with the error "Cancelled"."""
+        with self.lock:
+            if job.process is not self.process or job.id not in self.jobs:
+                return False
+        try:
+            self._send("CANCEL", [("target", job.id)])
+        except WorkerError:
+            return False
+        return True
+
+    def submit(self, op, options, on_done=None, on_chunk=None):
+        """Send a request without waiting. options is a list of (key, value) pairs."""
+        return self._send(op, options, on_done=on_done, on_chunk=on_chunk)
+
+    def transform(self, source, xsl, output, params, quiet=True, on_done=None, base_uri=None, base_output_uri=None):
+        """Transform the source file to output. base_uri and base_output_uri let a temporary file stand in for
+        another location when relative URIs are resolved."""
+        options = [("source", source), ("xsl", xsl), ("output", output), ("quiet", "1" if quiet else "0")]
+        if base_uri:
+            options.append(("base_uri", base_uri))
+        if base_output_uri:
+            options.append(("base_output_uri", base_output_uri))
+        options.extend(stylesheet_cache_options(xsl))
+        options.extend(("p." + name, value) for name, value in params.items())
+        return self.submit("TRANSFORM", options, on_done=on_done)
+
+    def transform_text(self, text, base_uri, xsl, params, quiet=True, on_chunk=None, on_done=None):
+        """Transform source text (e.g. an unsaved buffer) and stream the output back to on_chunk."""
+        options = [("source_text", text), ("base_uri", base_uri), ("xsl", xsl), ("stream", "1"), ("quiet", "1" if quiet else "0")]
+        options.extend(stylesheet_cache_options(xsl))
+        options.extend(("p." + name, value) for name, value in params.items())
+        return self.submit("TRANSFORM", options, on_done=on_done, on_chunk=on_chunk)
+
+    def sweep(self, source, xsl, sets, threads, quiet=True, on_done=None):
+        """Run each (name, output, params) of sets against source, sharing the compiled stylesheet and parsed tree."""
+        options = [("source", source), ("xsl", xsl), ("threads", str(threads)), ("quiet", "1" if quiet else "0")]
+        options.extend(stylesheet_cache_options(xsl))
+        for index, (name, output, params) in enumerate(sets):
+            prefix = "set.{0}.".format(index)
+            options.extend([(prefix + "name", name), (prefix + "output", output)])
+            options.extend((prefix + "p." + key, value) for key, value in params.items())
+        return self.submit("SWEEP", options, on_done=on_done)
+
+    def pipeline(self, source, output, stages, quiet=True, on_done=None):
+        """Chain the (xsl, params) stages over source in memory and write the last result to output."""
+        options = [("source", source), ("output", output), ("quiet", "1" if quiet else "0")]
+        for index, (xsl, params) in enumerate(stages):
+            prefix = "stage.{0}.".format(index)
+            options.append((prefix + "xsl", xsl))
+            options.extend((prefix + key, value) for key, value in stylesheet_cache_options(xsl))
+            options.extend((prefix + "p." + name, value) for name, value in params.items())
+        return self.submit("PIPELINE", options, on_done=on_done)
+
+    def _send(self, op, options, on_done=None, on_chunk=None, timeout=None):
+        with self.lock:
+            if not self.is_alive():
+                raise WorkerError("Saxon worker is not running")
+            job = WorkerJob(str(next(self.ids)), on_done, on_chunk)
+            job.process = self.process
+            self.jobs[job.id] = job
+            self.last_used = time.time()
+            fields = [op, job.id] + ["{0}={1}".format(key, value) for key, value in options]
+            line = "\t".join(escape_field(field) for field in fields) + "\n"
+            try:
+                self.process.stdin.write(line.encode("utf-8"))
+                self.process.stdin.flush()
+            except (OSError, ValueError) as e:
+                del self.jobs[job.id]
+                raise WorkerError("Saxon worker pipe closed: {0}".format(e))
+        if timeout is not None and not job.finished.wait(timeout):
+            with self.lock:
+                self.jobs.pop(job.id, None)
+            raise WorkerError("Saxon worker did not answer within {0}s".format(timeout))
+        return job
+
+    def _read_events(self, process):
+        for raw in iter(process.stdout.readline, b""):
+            fields = [unescape_field(f) for f in raw.decode("utf-8").rstrip("\n").split("\t")]
+            if len(fields) < 2:
+                continue
+            with self.lock:
+                job = self.jobs.get(fields[0])
+                if job is not None and fields[1] == "DONE":
+                    del self.jobs[fields[0]]
+            if job is not None:
+                job.handle(fields[1], fields[2:])
+                if fields[1] == "DONE":
+                    self._schedule_idle_shutdown()
+        # The process exited: fail whatever it still had in flight so callers never hang.
+        with self.lock:
+            pending = [job for job in self.jobs.values() if job.process is process]
+            for job in pending:
+                del self.jobs[job.id]
+        for job in pending:
+            job.errors.append("Fatal Error: Saxon worker exited unexpectedly (exit code {0})".format(process.wait()))
+            job.finish(1)
+        if is_debug():
+            print("DEBUG: Saxon worker output closed")
+
+    def _drain_stderr(self, process):
+        for raw in iter(process.stderr.readline, b""):
+            if is_debug():
+                print("DEBUG: Saxon worker:", raw.decode("utf-8", "replace").rstrip())
+
+    def _schedule_idle_shutdown(self):
+        idle_timeout = settings.get("worker_idle_timeout", 600)
+        if not idle_timeout:
+            return
+        with self.lock:
+            if self.idle_timer:
+                self.idle_timer.cancel()
+            self.idle_timer = threading.Timer(idle_timeout, self._idle_check)
+            self.idle_timer.daemon = True
+            self.idle_timer.start()
+
+    def _idle_check(self):
+        idle_timeout = settings.get("worker_idle_timeout", 600)
+        with self.lock:
+            busy = bool(self.jobs)
+        if not busy and time.time() - self.last_used >= idle_timeout:
+            if is_debug():
+                print("DEBUG: Saxon worker idle for {0}s, shutting down".format(idle_timeout))
+            self.stop()
+
+_worker = None
+_worker_lock = threading.Lock()
+_start_failures = 0
+
+def worker_threads():
+    threads = settings.get("worker_threads", 0)
+    return threads if threads and threads > 0 else multiprocessing.cpu_count()
+
+def stylesheet_cache_options(xsl):
+    """Request options that let the worker reuse a compiled stylesheet until its import graph changes."""
+    if settings.get("stylesheet_cache_size", 16) <= 0:
+        return []
+    return [("cache_key", XmlTransformer_stylesheet.stylesheet_cache_key(xsl))]
+
+def find_javac(java_bin):
+    resolved = shutil.which(java_bin)
+    if resolved:
+        candidate = os.path.join(os.path.dirname(os.path.realpath(resolved)), "javac")
+        if sublime.platform() == "windows":
+            candidate += ".exe"
+        if os.path.exists(candidate):
+            return candidate
+    return shutil.which("javac")
+
+def worker_launch_cmd(java_bin, classpath):
+    """Compile the worker once per source revision and return the command that starts it.
+
+    The compiled classes live in Sublime's cache directory. Without a javac the Java 11+
+    single-file source launcher is used instead, which needs no separate compile step."""
+    source = sublime.load_resource(WORKER_SOURCE)
+    digest = hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+    class_dir = os.path.join(sublime.cache_path(), "XmlTransformer", "worker", digest)
+    source_file = os.path.join(class_dir, WORKER_CLASS + ".java")
+    class_file = os.path.join(class_dir, WORKER_CLASS + ".class")
+    jars = os.pathsep.join(classpath)
+    if not os.path.exists(source_file):
+        os.makedirs(class_dir, exist_ok=True)
+        with open(source_file, "w", encoding="utf-8") as f:
+            f.write(source)
+    if not os.path.exists(class_file):
+        javac = find_javac(java_bin)
+        if javac:
+            process = subprocess.Popen(
+                [javac, "-cp", jars, "-d", class_dir, source_file],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=creation_flags()
+            )
+            stdout, stderr = process.communicate()
+            if process.returncode != 0:
+                raise WorkerError("javac failed: " + stderr.decode("utf-8", "replace"))
+        else:
+            if is_debug():
+                print("DEBUG: javac not found, using the Java source launcher for the worker")
+            return [java_bin] + XmlTransformer_catalog.jvm_options() + ["-cp", jars, source_file, str(worker_threads()), str(settings.get("stylesheet_cache_size", 16))]
+    return ([java_bin] + XmlTransformer_jvm.cds_options(java_bin, classpath) + XmlTransformer_catalog.jvm_options() +
+            ["-cp", jars + os.pathsep + class_dir, WORKER_CLASS, str(worker_threads()), str(settings.get("stylesheet_cache_size", 16))])
+
+def get_worker(java_bin, classpath):
+    """Return a running worker for this toolchain, starting or restarting it as needed.
+
+    Blocks while the JVM starts, so call it off the UI thread. Returns None when the
+    worker is disabled or keeps failing to start; callers then fall back to a one-shot run."""
+    global _worker, _start_failures
+    if not settings.get("use_worker", True) or _start_failures >= MAX_START_FAILURES:
+        return None
+    with _worker_lock:
+        worker = _worker
+        if worker is not None and (worker.java_bin != java_bin or worker.classpath != classpath):
+            worker.stop()
+            worker = None
+        if worker is not None and worker.catalog_version != XmlTransformer_catalog.version():
+            with worker.lock:
+                busy = bool(worker.jobs)
+            # The JVM read the catalog when it started; pick up newly cached resources once it is idle.
+            if not busy:
+                if is_debug():
+                    print("DEBUG: Resolver catalog changed, restarting the Saxon worker")
+                worker.stop()
+                worker = None
+        if worker is not None and worker.is_alive():
+            if time.time() - worker.last_used < settings.get("worker_health_check_interval", 60) or worker.ping():
+                return worker
+            if is_debug():
+                print("DEBUG: Saxon worker failed its health check, restarting")
+            worker.stop()
+        try:
+            if worker is None:
+                worker = SaxonWorker(java_bin, classpath, worker_launch_cmd(java_bin, classpath))
+                worker.catalog_version = XmlTransformer_catalog.version()
+            worker.start()
+            _start_failures = 0
+            _worker = worker
+            return worker
+        except (WorkerError, OSError) as e:
+            _start_failures += 1
+            _worker = None
+            if is_debug():
+                print("DEBUG: Saxon worker unavailable ({0}/{1}): {2}".format(_start_failures, MAX_START_FAILURES, e))
+            return None
+
+def stop_worker():
+    global _worker
+    with _worker_lock:
+        worker = _worker
+        _worker = None
+    if worker is not None:
+        worker.stop()
+
+def cancel_job(job):
+    """Cancel one request of the running worker, leaving its other requests alone."""
+    worker = _worker
+    return worker is not None and worker.cancel(job)
+
+def plugin_unloaded():
+    stop_worker()
+
+class XmlTransformerStopWorkerCommand(sublime_plugin.ApplicationCommand):
+    def run(self):
+        global _start_failures
+        stop_worker()
+        _start_failures = 0
+        sublime.status_message("XmlTransformer: Saxon worker stopped")
+
+    def is_enabled(self):
+        return _worker is not None and _worker.is_alive()
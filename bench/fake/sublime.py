@@ -0,0 +1,183 @@
+"""Headless stand-in for Sublime Text's sublime module.
+
+Covers what the XmlTransformer plugin calls. Callbacks scheduled with a zero delay run inline, so a
+benchmark sees the whole build pipeline on its own thread; windows record what the plugin showed."""
+import json
+import os
+import sys
+import threading
+
+ENCODED_POSITION = 1
+
+_package_dir = None
+_cache_dir = None
+_overrides = {}
+_settings = {}
+_windows = []
+messages = []
+errors = []
+
+def configure(package_dir, cache_dir, overrides=None):
+    """Point the stand-in at a package checkout; overrides replace keys of any loaded settings file."""
+    global _package_dir, _cache_dir, _overrides
+    _package_dir = package_dir
+    _cache_dir = cache_dir
+    _overrides = dict(overrides or {})
+    _settings.clear()
+
+class Settings(object):
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+def load_settings(name):
+    if name not in _settings:
+        values = {}
+        path = os.path.join(_package_dir, name)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                values = json.load(f)
+        values.update(_overrides)
+        _settings[name] = Settings(values)
+    return _settings[name]
+
+def save_settings(name):
+    pass
+
+def platform():
+    if sys.platform.startswith("win"):
+        return "windows"
+    return "osx" if sys.platform == "darwin" else "linux"
+
+def cache_path():
+    return _cache_dir
+
+def load_resource(name):
+    relative = name.split("/", 2)[2]  # Packages/<package>/...
+    with open(os.path.join(_package_dir, relative), encoding="utf-8") as f:
+        return f.read()
+
+def status_message(message):
+    messages.append(message)
+
+def error_message(message):
+    errors.append(message)
+
+def _schedule(callback, delay):
+    if delay:
+        timer = threading.Timer(delay / 1000.0, callback)
+        timer.daemon = True
+        timer.start()
+    else:
+        callback()
+
+def set_timeout(callback, delay=0):
+    _schedule(callback, delay)
+
+def set_timeout_async(callback, delay=0):
+    _schedule(callback, delay)
+
+def windows():
+    return list(_windows)
+
+class View(object):
+    def __init__(self, file_name=None, name=None, window=None):
+        self._file_name = file_name
+        self._window = window
+        self.name = name
+        self.text = []
+        self.status = {}
+        self._settings = Settings({})
+
+    def file_name(self):
+        return self._file_name
+
+    def window(self):
+        return self._window
+
+    def settings(self):
+        return self._settings
+
+    def set_syntax_file(self, syntax):
+        pass
+
+    def set_status(self, key, value):
+        self.status[key] = value
+
+    def erase_status(self, key):
+        self.status.pop(key, None)
+
+    def run_command(self, command, args=None):
+        if command == "append":
+            self.text.append((args or {}).get("characters", ""))
+
+class Window(object):
+    """A window whose quick panels and input panels answer from scripted choices.
+
+    pick(items) returns the index to select; input_text(caption, initial) the text to enter. Both
+    default to cancelling and to accepting the initial text. Every opened file is recorded and
+    on_open, when set, is called with its path."""
+
+    _ids = 0
+
+    def __init__(self, folders=None, active_file=None):
+        Window._ids += 1
+        self._id = Window._ids
+        self._folders = list(folders or [])
+        self._active_view = View(active_file, window=self) if active_file else None
+        self.panels = {}
+        self.opened = []
+        self.quick_panels = []
+        self.commands = []
+        self.pick = lambda items: -1
+        self.input_text = lambda caption, initial: initial
+        self.on_open = None
+        self.intercept = {}
+        _windows.append(self)
+
+    def id(self):
+        return self._id
+
+    def folders(self):
+        return self._folders
+
+    def active_view(self):
+        return self._active_view
+
+    def create_output_panel(self, name):
+        self.panels[name] = View(name=name, window=self)
+        return self.panels[name]
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1, on_highlight=None):
+        self.quick_panels.append(items)
+        on_select(self.pick(items))
+
+    def show_input_panel(self, caption, initial_text, on_done, on_change, on_cancel):
+        text = self.input_text(caption, initial_text)
+        if text is None:
+            if on_cancel:
+                on_cancel()
+        else:
+            on_done(text)
+
+    def open_file(self, path, flags=0):
+        self.opened.append(path)
+        if self.on_open:
+            self.on_open(path)
+        return View(path, window=self)
+
+    def run_command(self, command, args=None):
+        """Run a plugin WindowCommand by its snake_case name, or hand it to intercept[command]."""
+        self.commands.append((command, args))
+        if command in self.intercept:
+            self.intercept[command](args or {})
+            return
+        import sublime_plugin
+        cls = sublime_plugin.find_command(command, sublime_plugin.WindowCommand)
+        if cls is not None:
+            cls(self).run(**(args or {}))
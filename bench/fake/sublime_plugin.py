@@ -0,0 +1,33 @@
+"""Headless stand-in for Sublime Text's sublime_plugin module."""
+import re
+
+class WindowCommand(object):
+    def __init__(self, window):
+        self.window = window
+
+class ApplicationCommand(object):
+    pass
+
+class TextCommand(object):
+    def __init__(self, view):
+        self.view = view
+
+class EventListener(object):
+    pass
+
+class ViewEventListener(object):
+    def __init__(self, view):
+        self.view = view
+
+def command_name(cls):
+    name = re.sub(r"Command$", "", cls.__name__)
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+def find_command(name, base):
+    pending = list(base.__subclasses__())
+    while pending:
+        cls = pending.pop()
+        if command_name(cls) == name:
+            return cls
+        pending.extend(cls.__subclasses__())
+    return None
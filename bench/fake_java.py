@@ -0,0 +1,34 @@
+"""Stand-in for `java` that answers `-version` and fakes a net.sf.saxon.Transform run.
+
+The "transform" reads the whole source (so I/O cost scales with input size), optionally sleeps
+FAKE_JAVA_DELAY seconds to model JVM start-up, and writes a small HTML document to -o:."""
+import os
+import sys
+import time
+
+def main(args):
+    if "-version" in args:
+        sys.stderr.write('openjdk version "11.0.0" 2018-09-25 (XmlTransformer benchmark stand-in)\n')
+        return 0
+    if "net.sf.saxon.Transform" not in args:
+        sys.stderr.write("fake_java: unsupported invocation: {0}\n".format(" ".join(args)))
+        return 2
+    options = dict(arg[1:].split(":", 1) for arg in args if arg.startswith("-") and ":" in arg)
+    source = options.get("s")
+    output = options.get("o")
+    if not source or not output:
+        sys.stderr.write("fake_java: -s: and -o: are required\n")
+        return 2
+    delay = float(os.environ.get("FAKE_JAVA_DELAY", "0"))
+    if delay:
+        time.sleep(delay)
+    size = 0
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            size += len(chunk)
+    with open(output, "w", encoding="utf-8") as f:
+        f.write("<html><body><p>{0} bytes</p></body></html>\n".format(size))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,378 @@
+"""Benchmark the XmlTransformer build pipeline headlessly.
+
+Loads the plugin against the stand-in sublime/sublime_plugin modules in bench/fake and a fake `java`
+(bench/fake_java.py), generates synthetic inputs and times each stage of a build:
+
+    directory_listing  list_dir cold and warm, and the XSL quick panel
+    metadata           stylesheet_info, the import graph, get_xsl_output_method, parse_xml_param_file
+    validation         the background well-formedness check of the source
+    command_build      start_transformation up to the xml_transformer_exec call
+    process_wait       xml_transformer_exec until the output is opened
+    output_open        handle_result on a finished output
+    watch              re-transforming a watched, unchanged source when only its stylesheet is saved
+    resolver           caching a DTD and its entity set from a local HTTP stand-in, cold and warm
+
+Usage:
+    python3 bench/run.py [--sizes 1K,1M,100M,1G] [--repeat 5] [--output results.json]
+    python3 bench/run.py --compare baseline.json --output current.json
+"""
+import argparse
+import datetime
+import http.server
+import json
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import importlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "fake"))
+sys.path.insert(0, BENCH_DIR)
+
+import sublime
+import synthetic
+
+SETTINGS = {
+    "use_worker": False,
+    "use_cds": False,
+    "result_cache_size_mb": 0,
+    "index_project_files": False,
+    "jvm_heap_per_input_mb": 0,
+    "large_output_threshold_mb": 0,
+    "watch_debounce_ms": 0,
+    "debug": False
+}
+
+def load_plugin(cache_dir):
+    """Import the plugin modules as the XmlTransformer package, the way Sublime Text would."""
+    sublime.configure(PACKAGE_DIR, cache_dir, SETTINGS)
+    package = types.ModuleType("XmlTransformer")
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules["XmlTransformer"] = package
+    plugin = types.SimpleNamespace()
+    for name in ("build", "exec", "index", "stylesheet", "validate", "toolchain", "catalog", "watch"):
+        setattr(plugin, name, importlib.import_module("XmlTransformer.XmlTransformer_" + name))
+    return plugin
+
+def fake_java(work_dir):
+    """An executable `java` that runs fake_java.py with this interpreter."""
+    if sys.platform.startswith("win"):
+        path = os.path.join(work_dir, "java.bat")
+        with open(path, "w") as f:
+            f.write('@"{0}" "{1}" %*\n'.format(sys.executable, os.path.join(BENCH_DIR, "fake_java.py")))
+        return path
+    path = os.path.join(work_dir, "java")
+    with open(path, "w") as f:
+        f.write('#!/bin/sh\nexec "{0}" "{1}" "$@"\n'.format(sys.executable, os.path.join(BENCH_DIR, "fake_java.py")))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+def install_toolchain(plugin, work_dir):
+    jar_dir = os.path.join(work_dir, "jars")
+    os.makedirs(jar_dir, exist_ok=True)
+    for jar in plugin.toolchain.REQUIRED_JARS:
+        open(os.path.join(jar_dir, jar), "a").close()
+    java_bin = fake_java(work_dir)
+    version = plugin.toolchain.probe_java_version(java_bin)
+    plugin.toolchain._toolchain = plugin.toolchain.Toolchain(java_bin, jar_dir, version)
+
+def summarize(stage, case, runs):
+    ordered = sorted(runs)
+    middle = len(ordered) // 2
+    median = ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2.0
+    return {
+        "stage": stage,
+        "case": case,
+        "runs": runs,
+        "min": ordered[0],
+        "median": median,
+        "mean": sum(runs) / len(runs),
+        "max": ordered[-1]
+    }
+
+class Bench(object):
+    def __init__(self, plugin, work_dir, repeat):
+        self.plugin = plugin
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self.results = []
+
+    def measure(self, stage, case, run, setup=None):
+        runs = []
+        for i in range(self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            run()
+            runs.append(time.perf_counter() - started)
+        self.results.append(summarize(stage, case, runs))
+        print("{0:<18} {1:<28} median {2:9.4f}s".format(stage, case, self.results[-1]["median"]))
+
+    def command(self, xml_path, xsl_path):
+        window = sublime.Window(folders=[self.work_dir], active_file=xml_path)
+        command = self.plugin.build.XmlTransformerBuildCommand(window)
+        if not command.use_toolchain(lambda: None):
+            raise RuntimeError("fake toolchain not available: " + " ".join(sublime.errors))
+        command.xml_path = xml_path
+        command.working_dir = os.path.dirname(xml_path)
+        command.xsl_path = xsl_path
+        return window, command
+
+    def directory_listing(self, files, subdirs):
+        directory = synthetic.make_directory(os.path.join(self.work_dir, "dir-{0}".format(files)), files, subdirs)
+        case = "{0} files, {1} dirs".format(files, subdirs)
+        listings = self.plugin.index._listings
+        self.measure("directory_listing", "cold " + case, lambda: self.plugin.index.list_dir(directory), setup=listings.clear)
+        self.measure("directory_listing", "warm " + case, lambda: self.plugin.index.list_dir(directory))
+        window, command = self.command(os.path.join(directory, "file000001.xml"), None)
+        self.measure("directory_listing", "panel " + case, lambda: command.show_combined_panel(directory))
+
+    def metadata(self, name, xsl_path, param_file):
+        stylesheet = self.plugin.stylesheet
+        self.measure("metadata", "stylesheet_info " + name, lambda: stylesheet.stylesheet_info(xsl_path), setup=stylesheet._info_cache.clear)
+        self.measure("metadata", "import graph " + name, lambda: stylesheet.stylesheet_files(xsl_path), setup=stylesheet._info_cache.clear)
+        window, command = self.command(xsl_path, xsl_path)
+        self.measure("metadata", "output method " + name, lambda: command.get_xsl_output_method(xsl_path), setup=stylesheet._info_cache.clear)
+        if param_file:
+            self.measure("metadata", "param file " + name, lambda: command.parse_xml_param_file(param_file))
+
+    def validation(self, name, xml_path):
+        validate = self.plugin.validate
+
+        def run():
+            done = threading.Event()
+            validate.check_source(xml_path, lambda result: done.set())
+            done.wait()
+        self.measure("validation", name, run, setup=validate._results.clear)
+
+        window, command = self.command(xml_path, None)
+
+        def run_command():
+            valid = threading.Event()
+            command.validate_xml_file(xml_path, valid.set)
+            if not valid.wait(600):
+                raise RuntimeError("validate_xml_file did not accept {0}: {1}".format(xml_path, sublime.errors))
+        # Validating an unchanged file again answers from the result cache without starting a check.
+        self.measure("validation", "cached " + name, run_command, setup=run_command)
+
+        def run_missing():
+            # A source deleted since it was picked is reported, not raised.
+            rejected = []
+            del sublime.errors[:]
+            command.validate_xml_file(xml_path + ".missing", lambda: rejected.append(False), lambda: rejected.append(True))
+            if rejected != [True] or not sublime.errors:
+                raise RuntimeError("validate_xml_file did not report the missing source {0}.missing".format(xml_path))
+        self.measure("validation", "missing " + name, run_missing)
+        del sublime.errors[:]
+
+    def watch(self, name, xml_path, xsl_path):
+        """Watch xml_path, then save only the stylesheet: the source is unchanged, so its validation comes from the cache."""
+        window, command = self.command(xml_path, xsl_path)
+        transformed = threading.Event()
+
+        def exec_command(args):
+            transformed.set()
+            self.plugin.exec.notify_finished(args)
+        window.intercept["xml_transformer_exec"] = exec_command
+        window.run_command("xml_transformer_watch", {"xml": xml_path, "xsl": xsl_path})
+        if not transformed.is_set():
+            raise RuntimeError("watching {0} did not transform it: {1}".format(xml_path, sublime.errors))
+        listener = self.plugin.watch.XmlTransformerWatchListener()
+
+        def save_stylesheet():
+            transformed.clear()
+            listener.on_post_save(sublime.View(xsl_path, window=window))
+            if not transformed.wait(60):
+                raise RuntimeError("saving {0} did not re-transform {1}: {2}".format(xsl_path, xml_path, sublime.errors))
+        self.measure("watch", "xsl save " + name, save_stylesheet)
+        window.run_command("xml_transformer_stop_watching")
+
+    def resolver(self, remote_delay):
+        """Serve a DTD that pulls in an entity set by relative URL, as a remote DTD would, with remote_delay per request."""
+        catalog = self.plugin.catalog
+        root = os.path.join(self.work_dir, "remote")
+        os.makedirs(os.path.join(root, "dtd", "ent"), exist_ok=True)
+        with open(os.path.join(root, "dtd", "doc.dtd"), "w", encoding="utf-8") as f:
+            f.write('<!ENTITY % symbols SYSTEM "ent/symbols.ent">\n%symbols;\n<!ELEMENT doc (#PCDATA)>\n')
+        with open(os.path.join(root, "dtd", "ent", "symbols.ent"), "w", encoding="utf-8") as f:
+            f.write('<!ENTITY copy "&#169;">\n')
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=root, **kwargs)
+
+            def do_GET(self):
+                time.sleep(remote_delay)
+                super().do_GET()
+
+            def log_message(self, format, *args):
+                pass
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            source = os.path.join(self.work_dir, "xml", "remote-dtd.xml")
+            os.makedirs(os.path.dirname(source), exist_ok=True)
+            with open(source, "w", encoding="utf-8") as f:
+                f.write('<?xml version="1.0"?>\n<!DOCTYPE doc SYSTEM "http://127.0.0.1:{0}/dtd/doc.dtd">\n<doc>&copy;</doc>\n'.format(server.server_address[1]))
+
+            def cold():
+                if catalog.prepare([source], wait=True) != 2:
+                    raise RuntimeError("resolver cache did not fetch the DTD and its entity set: " + " ".join(sorted(catalog.load_index())))
+            self.measure("resolver", "cold DTD + entity set", cold, setup=catalog.purge)
+            self.measure("resolver", "warm DTD + entity set", lambda: catalog.prepare([source]))
+
+            def miss():
+                # A run with nothing cached must not wait on the network; the fetch finishes behind it.
+                catalog.prepare([source])
+                if len(catalog.load_index()) == 2:
+                    raise RuntimeError("resolver cache fetched on the run's thread")
+
+            def filled():
+                deadline = time.time() + 60
+                while len(catalog.load_index()) < 2:
+                    if time.time() > deadline:
+                        raise RuntimeError("background fetch never cached the DTD and its entity set")
+                    time.sleep(0.01)
+            self.measure("resolver", "miss, fetched behind the run", miss, setup=lambda: (filled(), catalog.purge()))
+            filled()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def transform(self, name, xml_path, xsl_path):
+        window, command = self.command(xml_path, xsl_path)
+        captured = {}
+        window.intercept["xml_transformer_exec"] = lambda args: captured.update(args)
+        self.measure("command_build", name, lambda: command.start_transformation(None))
+
+        exec_command = self.plugin.exec.XmlTransformerExecCommand(window)
+        opened = threading.Event()
+        window.on_open = lambda path: opened.set()
+
+        def run_exec():
+            opened.clear()
+            exec_command.run(**captured)
+            if not opened.wait(600):
+                raise RuntimeError("transformation of {0} did not finish: {1}".format(xml_path, sublime.errors))
+        self.measure("process_wait", name, run_exec)
+        output_file = captured["output_file"]
+        self.measure("output_open", name, lambda: exec_command.handle_result(output_file, xsl_path, "", False))
+
+def run_benchmarks(options):
+    work_dir = options.work_dir or tempfile.mkdtemp(prefix="xmltransformer-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    os.environ["FAKE_JAVA_DELAY"] = str(options.java_delay)
+    plugin = load_plugin(os.path.join(work_dir, "cache"))
+    install_toolchain(plugin, work_dir)
+    bench = Bench(plugin, work_dir, options.repeat)
+    try:
+        for files in options.dir_files:
+            bench.directory_listing(files, max(1, files // 20))
+
+        stylesheets = os.path.join(work_dir, "xsl")
+        plain = synthetic.write_stylesheet(stylesheets, "plain")
+        many_params = synthetic.write_stylesheet(stylesheets, "params", params=options.params)
+        many_imports = synthetic.write_stylesheet(stylesheets, "imports", imports=options.imports)
+        param_file = synthetic.write_param_file(os.path.join(stylesheets, "params.xml"), options.params)
+        bench.metadata("plain", plain, None)
+        bench.metadata("{0} params".format(options.params), many_params, param_file)
+        bench.metadata("{0} imports".format(options.imports), many_imports, None)
+
+        sources = os.path.join(work_dir, "xml")
+        os.makedirs(sources, exist_ok=True)
+        for size in options.sizes:
+            for shape, write in (("wide", synthetic.write_wide_xml), ("deep", synthetic.write_deep_xml)):
+                name = "{0} {1}".format(shape, synthetic.format_size(size))
+                path = os.path.join(sources, "{0}-{1}.xml".format(shape, synthetic.format_size(size)))
+                if not os.path.exists(path) or os.path.getsize(path) < size * 0.9:
+                    write(path, size)
+                bench.validation(name, path)
+                bench.transform(name, path, plain)
+                bench.watch(name, path, plain)
+        bench.resolver(options.remote_delay)
+    finally:
+        if not options.work_dir and not options.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return bench.results
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=PACKAGE_DIR,
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path, threshold, min_time):
+    """Print median ratios against a previous results file; returns the number of regressions.
+
+    Stages faster than min_time in both runs are too noisy to flag."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = dict(((r["stage"], r["case"]), r) for r in json.load(f)["results"])
+    regressions = 0
+    print("\n{0:<18} {1:<28} {2:>10} {3:>10} {4:>7}".format("stage", "case", "baseline", "current", "ratio"))
+    for result in results:
+        previous = baseline.get((result["stage"], result["case"]))
+        if previous is None:
+            continue
+        ratio = result["median"] / previous["median"] if previous["median"] else float("inf")
+        flag = ""
+        if ratio > threshold and result["median"] >= min_time:
+            regressions += 1
+            flag = "  REGRESSION"
+        print("{0:<18} {1:<28} {2:9.4f}s {3:9.4f}s {4:6.2f}x{5}".format(
+            result["stage"], result["case"], previous["median"], result["median"], ratio, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the XmlTransformer build pipeline.")
+    parser.add_argument("--sizes", default="1K,1M,10M", help="source sizes, e.g. 1K,1M,100M,1G")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dir-files", default="1000,20000", help="files per directory for directory_listing")
+    parser.add_argument("--params", type=int, default=200, help="xsl:params in the many-params stylesheet")
+    parser.add_argument("--imports", type=int, default=50, help="length of the xsl:import chain")
+    parser.add_argument("--java-delay", type=float, default=0.0, help="seconds the fake java sleeps to model JVM start-up")
+    parser.add_argument("--remote-delay", type=float, default=0.05, help="seconds the HTTP stand-in for remote DTDs takes per request")
+    parser.add_argument("--work-dir", help="reuse generated inputs from this directory (kept afterwards)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary work directory")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--compare", help="previous results file to compare medians against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="median ratio counted as a regression")
+    parser.add_argument("--min-time", type=float, default=0.001, help="medians below this many seconds are never regressions")
+    options = parser.parse_args()
+    options.sizes = [synthetic.parse_size(size) for size in options.sizes.split(",")]
+    options.dir_files = [int(files) for files in options.dir_files.split(",") if files]
+
+    results = run_benchmarks(options)
+    report = {
+        "revision": git_revision(),
+        "created": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {
+            "sizes": options.sizes,
+            "repeat": options.repeat,
+            "dir_files": options.dir_files,
+            "params": options.params,
+            "imports": options.imports,
+            "java_delay": options.java_delay,
+            "remote_delay": options.remote_delay
+        },
+        "results": results
+    }
+    with open(options.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print("\nWrote", options.output)
+    if options.compare:
+        return 1 if compare(results, options.compare, options.threshold, options.min_time) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
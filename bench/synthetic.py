@@ -0,0 +1,102 @@
+"""Synthetic inputs for the benchmarks: XML sources, stylesheets, parameter files and directories."""
+import os
+import re
+
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+def parse_size(text):
+    """'1K', '10M', '1G' or a plain byte count."""
+    match = re.match(r"^\s*(\d+)\s*([KMG]?)B?\s*$", text.upper())
+    if not match:
+        raise ValueError("invalid size: " + text)
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return "{0}{1}".format(size // UNITS[unit], unit)
+    return str(size)
+
+def _write_until(path, size, head, block, tail):
+    """Write head, then block(n) for n = 0, 1, ... until the file reaches size bytes, then tail."""
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(head)
+        written += len(head)
+        n = 0
+        batch = []
+        batch_size = 0
+        while written + batch_size + len(tail) < size:
+            text = block(n)
+            batch.append(text)
+            batch_size += len(text)
+            n += 1
+            if batch_size >= 1024 * 1024:
+                f.write("".join(batch))
+                written += batch_size
+                batch = []
+                batch_size = 0
+        f.write("".join(batch))
+        f.write(tail)
+
+def write_wide_xml(path, size):
+    """A flat document: one root with as many small records as fit in size bytes."""
+    _write_until(
+        path, size,
+        '<?xml version="1.0" encoding="UTF-8"?>\n<records>\n',
+        lambda n: '  <record id="{0}"><name>Item {0}</name><value>{1}</value></record>\n'.format(n, n * 7 % 1000),
+        "</records>\n")
+
+def write_deep_xml(path, size, depth=200):
+    """A document of repeated chains nested depth levels deep."""
+    opening = "".join('<level n="{0}">'.format(i) for i in range(depth))
+    closing = "</level>" * depth
+    _write_until(
+        path, size,
+        '<?xml version="1.0" encoding="UTF-8"?>\n<records>\n',
+        lambda n: "{0}<leaf>{1}</leaf>{2}\n".format(opening, n, closing),
+        "</records>\n")
+
+XSL_NS = 'xmlns:xsl="http://www.w3.org/1999/XSL/Transform"'
+
+def write_stylesheet(directory, name, params=0, imports=0):
+    """name.xsl with params top-level xsl:params, importing a chain of imports library stylesheets."""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(imports):
+        next_import = '    <xsl:import href="{0}-lib{1}.xsl"/>\n'.format(name, i + 1) if i + 1 < imports else ""
+        with open(os.path.join(directory, "{0}-lib{1}.xsl".format(name, i)), "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0"?>\n<xsl:stylesheet version="3.0" {0}>\n{1}'
+                    '    <xsl:template name="lib{2}"><span>lib{2}</span></xsl:template>\n'
+                    '</xsl:stylesheet>\n'.format(XSL_NS, next_import, i))
+    path = os.path.join(directory, name + ".xsl")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0"?>\n<xsl:stylesheet version="3.0" {0}>\n'.format(XSL_NS))
+        if imports:
+            f.write('    <xsl:import href="{0}-lib0.xsl"/>\n'.format(name))
+        f.write('    <xsl:output method="html" indent="yes"/>\n')
+        for i in range(params):
+            f.write('    <xsl:param name="p{0}" select="\'default{0}\'"/>\n'.format(i))
+        f.write('    <xsl:template match="/">\n'
+                '        <html><body><xsl:value-of select="count(//record)"/></body></html>\n'
+                '    </xsl:template>\n'
+                '</xsl:stylesheet>\n')
+    return path
+
+def write_param_file(path, params):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<params>\n')
+        for i in range(params):
+            f.write('    <param name="p{0}" value="value {0}"/>\n'.format(i))
+        f.write("</params>\n")
+    return path
+
+def make_directory(directory, files, subdirs):
+    """A directory holding files .xml/.xsl files and subdirs subdirectories, as on a busy share."""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(subdirs):
+        os.makedirs(os.path.join(directory, "dir{0:05d}".format(i)), exist_ok=True)
+    for i in range(files):
+        extension = ".xsl" if i % 10 == 0 else ".xml"
+        with open(os.path.join(directory, "file{0:06d}{1}".format(i, extension)), "w") as f:
+            f.write("<x/>")
+    return directory
@@ -0,0 +1,606 @@
+import net.sf.saxon.s9api.DocumentBuilder;
+import net.sf.saxon.s9api.ItemType;
+import net.sf.saxon.s9api.Location;
+import net.sf.saxon.s9api.Processor;
+import net.sf.saxon.s9api.QName;
+import net.sf.saxon.s9api.SaxonApiException;
+import net.sf.saxon.s9api.Serializer;
+import net.sf.saxon.s9api.XdmAtomicValue;
+import net.sf.saxon.s9api.XdmDestination;
+import net.sf.saxon.s9api.XdmNode;
+import net.sf.saxon.s9api.XdmValue;
+import net.sf.saxon.s9api.XmlProcessingError;
+import net.sf.saxon.s9api.Xslt30Transformer;
+import net.sf.saxon.s9api.XsltCompiler;
+import net.sf.saxon.s9api.XsltExecutable;
+
+import javax.xml.transform.Source;
+import javax.xml.transform.stream.StreamSource;
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileInputStream;
+import java.io.FileNotFoundException;
+import java.io.FileOutputStream;
+import java.io.FilterOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.io.StringReader;
+import java.io.UncheckedIOException;
+import java.io.Writer;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
+import java.util.concurrent.FutureTask;
+
+/**
+ * Long-lived Saxon process used by the XmlTransformer Sublime Text package.
+ *
+ * Requests arrive on stdin, one per line, as tab-separated fields:
+ *
+ *     OP  ID  key=value  key=value ...
+ *
+ * Responses are written to stdout, one event per line:
+ *
+ *     ID  EVENT  field ...
+ *
+ * Tabs, newlines and backslashes inside fields are escaped as \t, \n, \r and \\.
+ * Every request ends with a DONE event carrying 0 (success) or 1 (failure).
+ *
+ * Compiled stylesheets are kept in an LRU cache keyed by the "cache_key" option, which the
+ * plugin derives from the stylesheet and its whole xsl:import/xsl:include graph.
+ *
+ * TRANSFORM reads "source" from disk, or parses "source_text" (resolved against "base_uri") when
+ * the plugin sends an unsaved buffer. A "base_uri" with a "source" file (a split chunk) stands in for
+ * the file's own location. Output goes to the "output" file, relative xsl:result-document hrefs
+ * resolving against "base_output_uri" when given, or with stream=1 back to the plugin as CHUNK events.
+ *
+ * SWEEP applies one stylesheet to one source under several parameter sets, compiling the
+ * stylesheet and parsing the source once for all of them. PIPELINE chains several stylesheets,
+ * passing each result to the next stage as an in-memory tree and writing only the last one.
+ *
+ * CANCEL stops the request named by its "target" option, leaving every other request running. The
+ * target is interrupted, and stops at its next output write or pipeline stage at the latest; it still
+ * ends with DONE 1, carrying the single error "Cancelled".
+ */
+public final class XmlTransformerWorker {
+    static final String PROTOCOL_VERSION = "1";
+    static final int CHUNK_SIZE = 8192;
+
+    private final Processor processor = new Processor(false);
+    private final PrintStream out;
+    private final ExecutorService pool;
+    private final Map<String, FutureTask<XsltExecutable>> stylesheets;
+    private final Map<String, Request> inflight = new ConcurrentHashMap<>();
+
+    XmlTransformerWorker(PrintStream out, int threads, final int cacheSize) {
+        this.out = out;
+        this.pool = Executors.newFixedThreadPool(Math.max(1, threads));
+        this.stylesheets = new LinkedHashMap<String, FutureTask<XsltExecutable>>(16, 0.75f, true) {
+            @Override
+            protected boolean removeEldestEntry(Map.Entry<String, FutureTask<XsltExecutable>> eldest) {
+                return size() > cacheSize;
+            }
+        };
+    }
+
+    public static void main(String[] args) throws IOException {
+        int threads = args.length > 0 ? Integer.parseInt(args[0]) : Runtime.getRuntime().availableProcessors();
+        int cacheSize = args.length > 1 ? Integer.parseInt(args[1]) : 16;
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), false, "UTF-8");
+        // Anything Saxon or the JVM prints must not corrupt the protocol channel.
+        System.setOut(System.err);
+        XmlTransformerWorker worker = new XmlTransformerWorker(protocol, threads, cacheSize);
+        worker.serve(new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8)));
+        System.exit(0);
+    }
+
+    void serve(BufferedReader in) throws IOException {
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            final Request request = Request.parse(line);
+            if ("QUIT".equals(request.op)) {
+                break;
+            }
+            if ("PING".equals(request.op)) {
+                emit(request.id, "PONG", PROTOCOL_VERSION, processor.getSaxonProductVersion());
+                emit(request.id, "DONE", "0");
+                continue;
+            }
+            if ("CANCEL".equals(request.op)) {
+                cancel(request.get("target"));
+                emit(request.id, "DONE", "0");
+                continue;
+            }
+            inflight.put(request.id, request);
+            pool.execute(() -> handle(request));
+        }
+        pool.shutdownNow();
+    }
+
+    private void cancel(String id) {
+        Request request = id == null ? null : inflight.get(id);
+        if (request == null) {
+            return;
+        }
+        synchronized (request) {
+            request.cancelled = true;
+            if (request.thread != null) {
+                request.thread.interrupt();
+            }
+        }
+    }
+
+    private void handle(Request request) {
+        List<String> errors = new ArrayList<>();
+        synchronized (request) {
+            request.thread = Thread.currentThread();
+        }
+        try {
+            request.checkCancelled();
+            if ("TRANSFORM".equals(request.op)) {
+                transform(request, errors);
+            } else if ("SWEEP".equals(request.op)) {
+                sweep(request, errors);
+            } else if ("PIPELINE".equals(request.op)) {
+                pipeline(request, errors);
+            } else {
+                errors.add("Error: unknown worker request " + request.op);
+            }
+        } catch (SaxonApiException e) {
+            if (errors.isEmpty()) {
+                errors.add(describe(e));
+            }
+        } catch (RuntimeException | Error e) {
+            errors.add("Fatal Error: " + e);
+        } finally {
+            synchronized (request) {
+                request.thread = null;
+            }
+            // Clear an interrupt from a late CANCEL before this pool thread takes the next request.
+            Thread.interrupted();
+            inflight.remove(request.id);
+        }
+        if (request.cancelled) {
+            errors.clear();
+            errors.add("Cancelled");
+        }
+        for (String error : errors) {
+            emit(request.id, "ERR", error);
+        }
+        emit(request.id, "DONE", errors.isEmpty() ? "0" : "1");
+    }
+
+    private void transform(Request request, List<String> errors) throws SaxonApiException {
+        long started = System.nanoTime();
+        XsltExecutable executable = compile(request, request.get("xsl"), request.get("cache_key"), errors);
+        long compiled = System.nanoTime();
+        Xslt30Transformer transformer = executable.load30();
+        transformer.setStylesheetParameters(parameters(request.withPrefix("p.")));
+        transformer.setMessageHandler(message -> emit(request.id, "MSG", message.getContent().getStringValue()));
+        ChunkWriter chunks = null;
+        CancellableOutput output = null;
+        Serializer serializer;
+        if ("1".equals(request.get("stream"))) {
+            chunks = new ChunkWriter(request);
+            serializer = transformer.newSerializer(chunks);
+        } else {
+            output = new CancellableOutput(request, new File(request.get("output")));
+            serializer = output.serializer(transformer, request.get("base_output_uri"));
+        }
+        StreamSource source;
+        InputStream input = null;
+        if (request.get("source_text") != null) {
+            source = new StreamSource(new StringReader(request.get("source_text")), request.get("base_uri"));
+        } else if (request.get("base_uri") != null) {
+            try {
+                input = new FileInputStream(request.get("source"));
+            } catch (FileNotFoundException e) {
+                throw new SaxonApiException(e);
+            }
+            source = new StreamSource(input, request.get("base_uri"));
+        } else {
+            source = new StreamSource(new File(request.get("source")));
+        }
+        try {
+            transformer.transform(source, serializer);
+        } finally {
+            if (output != null) {
+                output.close();
+            }
+            if (input != null) {
+                try {
+                    input.close();
+                } catch (IOException e) {
+                    // Only read from; nothing is lost.
+                }
+            }
+        }
+        if (chunks != null) {
+            chunks.flush();
+        }
+        long finished = System.nanoTime();
+        emit(request.id, "TIME", "compile", millis(compiled - started));
+        emit(request.id, "TIME", "execute", millis(finished - compiled));
+    }
+
+    /**
+     * Run every parameter set of a SWEEP request against one shared source tree. Set N is given by
+     * the "set.N.name", "set.N.output" and "set.N.p.*" options; up to "threads" sets run at once.
+     * Each set ends with a SET event carrying N, 0 or 1, and its execution time in ms.
+     */
+    private void sweep(Request request, List<String> errors) throws SaxonApiException {
+        long started = System.nanoTime();
+        XsltExecutable executable = compile(request, request.get("xsl"), request.get("cache_key"), errors);
+        long compiled = System.nanoTime();
+        DocumentBuilder builder = processor.newDocumentBuilder();
+        // Apply the stylesheet's xsl:strip-space, as transform() would when it builds the tree itself.
+        builder.setWhitespaceStrippingPolicy(executable.getWhitespaceStrippingPolicy());
+        XdmNode document = builder.build(new File(request.get("source")));
+        emit(request.id, "TIME", "compile", millis(compiled - started));
+        emit(request.id, "TIME", "parse", millis(System.nanoTime() - compiled));
+
+        int count = 0;
+        while (request.get("set." + count + ".output") != null) {
+            count++;
+        }
+        String threads = request.get("threads");
+        int poolSize = Math.max(1, Math.min(count, threads == null ? 1 : Integer.parseInt(threads)));
+        ExecutorService sets = Executors.newFixedThreadPool(poolSize);
+        List<Future<Boolean>> results = new ArrayList<>();
+        for (int i = 0; i < count; i++) {
+            final int index = i;
+            results.add(sets.submit(() -> runSet(request, executable, document, index)));
+        }
+        sets.shutdown();
+        int failed = 0;
+        try {
+            for (Future<Boolean> result : results) {
+                if (!result.get()) {
+                    failed++;
+                }
+            }
+        } catch (InterruptedException e) {
+            sets.shutdownNow();
+            Thread.currentThread().interrupt();
+            throw new SaxonApiException(e);
+        } catch (ExecutionException e) {
+            throw new SaxonApiException(e.getCause());
+        }
+        if (failed > 0) {
+            errors.add("Error: " + failed + " of " + count + " parameter sets failed");
+        }
+    }
+
+    /**
+     * Run the stages of a PIPELINE request in order. Stage N applies "stage.N.xsl" (cached under
+     * "stage.N.cache_key") with the "stage.N.p.*" parameters to the previous stage's result, or to
+     * "source" for the first stage. Intermediate results stay in memory; only the last stage is
+     * serialized, to "output". Each finished stage emits a STAGE event carrying N and its time in
+     * ms, compilation included.
+     */
+    private void pipeline(Request request, List<String> errors) throws SaxonApiException {
+        File sourceFile = new File(request.get("source"));
+        Source source = new StreamSource(sourceFile);
+        for (int index = 0; request.get("stage." + index + ".xsl") != null; index++) {
+            request.checkCancelled();
+            String prefix = "stage." + index + ".";
+            long started = System.nanoTime();
+            XsltExecutable executable = compile(request, request.get(prefix + "xsl"), request.get(prefix + "cache_key"), errors);
+            Xslt30Transformer transformer = executable.load30();
+            transformer.setStylesheetParameters(parameters(request.withPrefix(prefix + "p.")));
+            String label = "[" + new File(request.get(prefix + "xsl")).getName() + "] ";
+            transformer.setMessageHandler(message -> emit(request.id, "MSG", label + message.getContent().getStringValue()));
+            if (request.get("stage." + (index + 1) + ".xsl") == null) {
+                try (CancellableOutput output = new CancellableOutput(request, new File(request.get("output")))) {
+                    transformer.transform(source, output.serializer(transformer, null));
+                }
+            } else {
+                XdmDestination result = new XdmDestination();
+                // Relative URIs in later stages resolve against the original source, as with files on disk.
+                result.setBaseURI(sourceFile.toURI());
+                transformer.transform(source, result);
+                source = result.getXdmNode().asSource();
+            }
+            emit(request.id, "STAGE", Integer.toString(index), millis(System.nanoTime() - started));
+        }
+    }
+
+    private boolean runSet(Request request, XsltExecutable executable, XdmNode document, int index) {
+        String prefix = "set." + index + ".";
+        String label = "[" + request.get(prefix + "name") + "] ";
+        long started = System.nanoTime();
+        boolean ok = false;
+        try {
+            request.checkCancelled();
+            Xslt30Transformer transformer = executable.load30();
+            transformer.setStylesheetParameters(parameters(request.withPrefix(prefix + "p.")));
+            transformer.setMessageHandler(message -> emit(request.id, "MSG", label + message.getContent().getStringValue()));
+            transformer.setGlobalContextItem(document);
+            try (CancellableOutput output = new CancellableOutput(request, new File(request.get(prefix + "output")))) {
+                transformer.applyTemplates(document, output.serializer(transformer, null));
+            }
+            ok = true;
+        } catch (SaxonApiException e) {
+            emit(request.id, "ERR", label + describe(e));
+        } catch (RuntimeException e) {
+            emit(request.id, "ERR", label + "Fatal Error: " + e);
+        }
+        emit(request.id, "SET", Integer.toString(index), ok ? "0" : "1", millis(System.nanoTime() - started));
+        return ok;
+    }
+
+    /**
+     * Compile a stylesheet of the request, or reuse the executable cached under its cache key.
+     * Concurrent requests for the same key wait for a single compilation.
+     */
+    private XsltExecutable compile(Request request, String xslPath, String key, List<String> errors) throws SaxonApiException {
+        final boolean quiet = "1".equals(request.get("quiet"));
+        final File xsl = new File(xslPath);
+        final XsltCompiler compiler = processor.newXsltCompiler();
+        compiler.setErrorReporter(error -> {
+            if (!error.isWarning()) {
+                errors.add(describe(error));
+            } else if (!quiet) {
+                emit(request.id, "MSG", describe(error));
+            }
+        });
+        if (key == null) {
+            return compiler.compile(new StreamSource(xsl));
+        }
+        key = key + "|" + xsl.getAbsolutePath();
+        FutureTask<XsltExecutable> task;
+        boolean owner = false;
+        synchronized (stylesheets) {
+            task = stylesheets.get(key);
+            if (task == null) {
+                task = new FutureTask<>(() -> compiler.compile(new StreamSource(xsl)));
+                stylesheets.put(key, task);
+                owner = true;
+            }
+        }
+        emit(request.id, "CACHE", owner ? "miss" : "hit");
+        if (owner) {
+            task.run();
+        }
+        try {
+            return task.get();
+        } catch (InterruptedException e) {
+            Thread.currentThread().interrupt();
+            throw new SaxonApiException(e);
+        } catch (ExecutionException e) {
+            synchronized (stylesheets) {
+                stylesheets.remove(key, task);
+            }
+            if (e.getCause() instanceof SaxonApiException) {
+                throw (SaxonApiException) e.getCause();
+            }
+            throw new SaxonApiException(e.getCause());
+        }
+    }
+
+    private static Map<QName, XdmValue> parameters(Map<String, String> values) throws SaxonApiException {
+        Map<QName, XdmValue> result = new LinkedHashMap<>();
+        for (Map.Entry<String, String> entry : values.entrySet()) {
+            // Same typing as "name=value" on the Saxon command line.
+            result.put(QName.fromClarkName(entry.getKey()),
+                       new XdmAtomicValue(entry.getValue(), ItemType.UNTYPED_ATOMIC));
+        }
+        return result;
+    }
+
+    static String describe(XmlProcessingError error) {
+        Location location = error.getLocation();
+        String code = error.getErrorCode() == null ? "" : error.getErrorCode().getLocalName() + " ";
+        String kind = error.isWarning() ? "Warning" : "Error";
+        if (location != null && location.getLineNumber() > 0) {
+            return kind + " on line " + location.getLineNumber() + " column " + Math.max(1, location.getColumnNumber())
+                    + " of " + fileName(location.getSystemId()) + ":\n  " + code + error.getMessage();
+        }
+        return kind + ": " + code + error.getMessage();
+    }
+
+    static String describe(SaxonApiException e) {
+        String code = e.getErrorCode() == null ? "" : e.getErrorCode().getLocalName() + " ";
+        if (e.getLineNumber() > 0) {
+            return "Error on line " + e.getLineNumber() + " column 1 of " + fileName(e.getSystemId()) + ":\n  "
+                    + code + e.getMessage();
+        }
+        return "Error: " + code + e.getMessage();
+    }
+
+    private static String fileName(String systemId) {
+        if (systemId == null) {
+            return "unknown";
+        }
+        return systemId.substring(systemId.lastIndexOf('/') + 1);
+    }
+
+    private static String millis(long nanos) {
+        return Long.toString(nanos / 1000000L);
+    }
+
+    synchronized void emit(String id, String event, String... fields) {
+        StringBuilder line = new StringBuilder(id).append('\t').append(event);
+        for (String field : fields) {
+            line.append('\t').append(escape(field));
+        }
+        out.print(line.append('\n'));
+        out.flush();
+    }
+
+    static String escape(String value) {
+        StringBuilder result = new StringBuilder(value.length());
+        for (int i = 0; i < value.length(); i++) {
+            char c = value.charAt(i);
+            switch (c) {
+                case '\\': result.append("\\\\"); break;
+                case '\t': result.append("\\t"); break;
+                case '\n': result.append("\\n"); break;
+                case '\r': result.append("\\r"); break;
+                default: result.append(c);
+            }
+        }
+        return result.toString();
+    }
+
+    static String unescape(String value) {
+        StringBuilder result = new StringBuilder(value.length());
+        for (int i = 0; i < value.length(); i++) {
+            char c = value.charAt(i);
+            if (c == '\\' && i + 1 < value.length()) {
+                char next = value.charAt(++i);
+                result.append(next == 't' ? '\t' : next == 'n' ? '\n' : next == 'r' ? '\r' : next);
+            } else {
+                result.append(c);
+            }
+        }
+        return result.toString();
+    }
+
+    /** Serializer target that sends output to the plugin in CHUNK events of about CHUNK_SIZE characters. */
+    final class ChunkWriter extends Writer {
+        private final Request request;
+        private final String id;
+        private final StringBuilder buffer = new StringBuilder(CHUNK_SIZE);
+
+        ChunkWriter(Request request) {
+            this.request = request;
+            this.id = request.id;
+        }
+
+        @Override
+        public void write(char[] chars, int offset, int length) throws IOException {
+            if (request.cancelled) {
+                throw new IOException("Cancelled");
+            }
+            buffer.append(chars, offset, length);
+            if (buffer.length() >= CHUNK_SIZE) {
+                flush();
+            }
+        }
+
+        @Override
+        public void flush() {
+            if (buffer.length() > 0) {
+                emit(id, "CHUNK", buffer.toString());
+                buffer.setLength(0);
+            }
+        }
+
+        @Override
+        public void close() {
+            flush();
+        }
+    }
+
+    /** Output file that makes the transformation writing it fail once its request is cancelled. */
+    static final class CancellableOutput extends FilterOutputStream {
+        private final Request request;
+        private final File file;
+
+        CancellableOutput(Request request, File file) throws SaxonApiException {
+            super(open(file));
+            this.request = request;
+            this.file = file;
+        }
+
+        private static FileOutputStream open(File file) throws SaxonApiException {
+            try {
+                return new FileOutputStream(file);
+            } catch (FileNotFoundException e) {
+                throw new SaxonApiException(e);
+            }
+        }
+
+        Serializer serializer(Xslt30Transformer transformer, String baseOutputUri) {
+            // Relative xsl:result-document hrefs resolve against the output file, as with newSerializer(File).
+            transformer.setBaseOutputURI(baseOutputUri != null ? baseOutputUri : file.toURI().toString());
+            return transformer.newSerializer(this);
+        }
+
+        @Override
+        public void write(int b) throws IOException {
+            if (request.cancelled) {
+                throw new IOException("Cancelled");
+            }
+            out.write(b);
+        }
+
+        @Override
+        public void write(byte[] bytes, int offset, int length) throws IOException {
+            if (request.cancelled) {
+                throw new IOException("Cancelled");
+            }
+            out.write(bytes, offset, length);
+        }
+
+        @Override
+        public void close() {
+            try {
+                super.close();
+            } catch (IOException e) {
+                throw new UncheckedIOException(e);
+            }
+        }
+    }
+
+    /** One decoded request line. Options keep their order so prefixed groups stay stable. */
+    static final class Request {
+        final String op;
+        final String id;
+        final Map<String, String> options = new LinkedHashMap<>();
+        volatile boolean cancelled;
+        Thread thread;
+
+        private Request(String op, String id) {
+            this.op = op;
+            this.id = id;
+        }
+
+        static Request parse(String line) {
+            String[] fields = line.split("\t", -1);
+            Request request = new Request(unescape(fields[0]), fields.length > 1 ? unescape(fields[1]) : "0");
+            for (int i = 2; i < fields.length; i++) {
+                String field = unescape(fields[i]);
+                int eq = field.indexOf('=');
+                if (eq > 0) {
+                    request.options.put(field.substring(0, eq), field.substring(eq + 1));
+                }
+            }
+            return request;
+        }
+
+        String get(String key) {
+            return options.get(key);
+        }
+
+        void checkCancelled() throws SaxonApiException {
+            if (cancelled) {
+                throw new SaxonApiException("Cancelled");
+            }
+        }
+
+        Map<String, String> withPrefix(String prefix) {
+            Map<String, String> result = new LinkedHashMap<>();
+            for (Map.Entry<String, String> entry : options.entrySet()) {
+                if (entry.getKey().startsWith(prefix)) {
+                    result.put(entry.getKey().substring(prefix.length()), entry.getValue());
+                }
+            }
+            return result;
+        }
+    }
+}